@@ -0,0 +1,35 @@
+"""
+Run the benchmark suite. All benchmarks use a fake model backend (benchmarks.fake_backend),
+so they measure the code generator itself plus a simulated model delay.
+
+Run from the repository root with:
+    python -m benchmarks [--delay SECONDS] [getattr] [context] [writer] [end_to_end]
+"""
+import argparse
+from . import bench_getattr, bench_context, bench_writer, bench_end_to_end
+
+
+def main():
+    benchmarks = {
+        "getattr": bench_getattr.main,
+        "context": bench_context.main,
+        "writer": bench_writer.main,
+        "end_to_end": None,
+    }
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks of the code generator with a fake model backend.")
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run: {', '.join(benchmarks)} (default: all)")
+    parser.add_argument("--delay", type=float, default=0.05, help="simulated model delay in seconds for the end-to-end benchmark (default: 0.05)")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error(f"unknown benchmark: {name}")
+    benchmarks["end_to_end"] = lambda: bench_end_to_end.main(delay=args.delay)
+
+    for i, name in enumerate(args.benchmarks or benchmarks):
+        if i:
+            print()
+        benchmarks[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark of CodeGenerator.get_default_code_context on synthetic class hierarchies.
+
+Run from the repository root with:
+    python -m benchmarks.bench_context
+"""
+from code_generator.code_generator import CodeGenerator
+from code_generator.snapshot import StackSnapshot
+from code_generator.source_index import get_source_index
+from .common import bench, temp_modules
+
+SIZES = (10, 100, 1000)
+METHODS_PER_CLASS = 5
+# Each class derives from the class at index (i - 1) // BRANCHING, so the hierarchy is a tree
+BRANCHING = 4
+
+
+def hierarchy_source(size):
+    source = "from code_generator import GenerativeBase\n\n\nclass Class0(GenerativeBase):\n    value = 0\n"
+    for i in range(1, size):
+        source += f"\n\nclass Class{i}(Class{(i - 1) // BRANCHING}):\n    value = {i}\n"
+        for j in range(METHODS_PER_CLASS):
+            source += f"\n    def method{j}(self, x):\n        \"\"\"Return x plus {j}.\"\"\"\n        y = x + {j}\n        return y\n"
+    return source
+
+
+def main(number=200):
+    print("get_default_code_context, per call:")
+    generator = CodeGenerator()
+    stack = StackSnapshot.capture()
+    with temp_modules() as load:
+        for size in SIZES:
+            module = load(f"bench_hierarchy_{size}", hierarchy_source(size))
+            leaf = getattr(module, f"Class{size - 1}")
+            path = module.__file__
+            # Fewer runs for the larger hierarchies
+            runs = max(2, number // size)
+
+            def cold():
+                get_source_index().invalidate(path)
+                generator.get_default_code_context(leaf, "missing", stack)
+
+            bench(f"{size} classes, cold source index", cold, runs, unit="ms", repeat=3)
+            bench(f"{size} classes, warm source index", lambda: generator.get_default_code_context(leaf, "missing", stack), runs, unit="ms", repeat=3)
+            print(f"{size} classes: context of {generator.last_context_size} chars")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Benchmark of the end-to-end latency of generating a missing member, from the attribute miss
+to the code being written, with a simulated model delay.
+
+Run from the repository root with:
+    python -m benchmarks.bench_end_to_end [delay in seconds]
+"""
+import sys
+import time
+import itertools
+from .common import configured, temp_modules
+from .fake_backend import install
+
+MODULE_SOURCE = "from code_generator import GenerativeBase\n\n\nclass Target(GenerativeBase):\n    value = 1\n\n    def existing(self, x):\n        return x\n"
+
+
+def main(delay=0.05, number=5):
+    backend = install(delay)
+    names = itertools.count()
+    print(f"End-to-end generation with a model delay of {delay * 1000:.0f} ms, per generation:")
+    with temp_modules() as load:
+        module = load("bench_end_to_end_target", MODULE_SOURCE)
+        for mode in ("staged", "structured"):
+            for kind in ("method", "attribute"):
+                with configured(generation_mode=mode, after_generation="raise", placement="ast"):
+                    calls = backend.calls
+                    start = time.perf_counter()
+                    for _ in range(number):
+                        name = f"generated_{next(names)}"
+                        try:
+                            if kind == "method":
+                                getattr(module.Target(), name)()
+                            else:
+                                str(getattr(module.Target(), name))
+                        except AttributeError:
+                            pass
+                    seconds = (time.perf_counter() - start) / number
+                label = f"{mode} mode, missing {kind}"
+                print(f"{label:<50} {seconds * 1000:10.2f} ms  ({(backend.calls - calls) / number:.0f} model calls)")
+
+
+if __name__ == "__main__":
+    main(*(float(arg) for arg in sys.argv[1:2]))
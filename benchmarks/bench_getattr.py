@@ -0,0 +1,25 @@
+"""
+Micro-benchmark of the cost of a GenerativeBase attribute miss.
+
+Run from the repository root with:
+    python -m benchmarks.bench_getattr
+"""
+from code_generator import GenerativeBase
+from .common import bench
+
+
+class Probe(GenerativeBase):
+    pass
+
+
+def main(number=20000):
+    print("GenerativeBase.__getattr__ miss, per miss:")
+    probe = Probe()
+    bench("miss on the same instance", lambda: probe.missing_attribute, number)
+    bench("hasattr probe on the same instance", lambda: hasattr(probe, "missing_attribute"), number)
+    bench("miss on a new instance each time", lambda: Probe().missing_attribute, number)
+    bench("baseline: defined attribute lookup", lambda: probe.__class__, number)
+
+
+if __name__ == "__main__":
+    main()
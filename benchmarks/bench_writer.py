@@ -0,0 +1,67 @@
+"""
+Benchmark of CodeWriter.insert_code and replace_code on large files, and of writing a file
+through the file writer.
+
+Run from the repository root with:
+    python -m benchmarks.bench_writer
+"""
+import os
+import tempfile
+from code_generator.code_writer import CodeWriter
+from code_generator.file_writer import Patch
+from .common import bench, configured
+from .fake_backend import install
+
+CLASSES = 100
+METHODS_PER_CLASS = 20
+PATCHES = 10
+
+NEW_METHOD = 'def generated(self, x):\n    """Generated for the benchmarks."""\n    return x * 2'
+
+
+def large_source(classes=CLASSES, methods=METHODS_PER_CLASS):
+    source = "import os\nimport sys\n"
+    for i in range(classes):
+        source += f"\n\nclass Class{i}:\n    \"\"\"Class number {i}.\"\"\"\n    value = {i}\n"
+        for j in range(methods):
+            source += f"\n    def method{j}(self, x):\n        y = x + {j}\n        return y\n"
+    return source
+
+
+def main(number=10):
+    install()
+    source = large_source()
+    qualname = f"Class{CLASSES // 2}"
+    old_method = "def method7(self, x):\n        y = x + 7\n        return y"
+    print(f"CodeWriter on a file of {source.count(chr(10))} lines, per call:")
+    writer = CodeWriter()
+    with configured(placement="ast"):
+        bench("insert_code, AST placement", lambda: writer.insert_code(main_source=source, code=NEW_METHOD, class_name=qualname), number, unit="ms")
+        bench("insert_code, imports", lambda: writer.insert_code(main_source=source, code="import re", class_name=qualname), number, unit="ms")
+    with configured(placement="ai"):
+        bench("insert_code, AI placement (fake model)", lambda: writer.insert_code(main_source=source, code=NEW_METHOD, class_name=qualname), number, unit="ms")
+    bench("replace_code", lambda: writer.replace_code(main_source=source, old_code=old_method, new_code=NEW_METHOD, class_name=qualname), number, unit="ms")
+
+    with tempfile.TemporaryDirectory(prefix="code_generator_bench_") as directory, configured(placement="ast"):
+        path = os.path.join(directory, "large.py")
+
+        def patches():
+            return [Patch(qualname, NEW_METHOD.replace("generated", f"generated{i}"), message="Add generated code") for i in range(PATCHES)]
+
+        def one_batch():
+            with open(path, "w") as f:
+                f.write(source)
+            writer.apply_changes(path, patches())
+
+        def one_by_one():
+            with open(path, "w") as f:
+                f.write(source)
+            for patch in patches():
+                writer.apply_changes(path, [patch])
+
+        bench(f"apply_changes, {PATCHES} patches in one batch", one_batch, max(1, number // 4), unit="ms", repeat=3)
+        bench(f"apply_changes, {PATCHES} patches one by one", one_by_one, max(1, number // 4), unit="ms", repeat=3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import timeit
+import tempfile
+import importlib
+import contextlib
+from code_generator import config
+
+
+def bench(label, func, number, unit="us", repeat=5):
+    """
+    Run func number times, repeat times over, and print the best time per call.
+    """
+    seconds = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    scale = {"us": 1e6, "ms": 1e3, "s": 1}[unit]
+    print(f"{label:<50} {seconds * scale:10.2f} {unit}")
+    return seconds
+
+
+@contextlib.contextmanager
+def configured(**settings):
+    """
+    Change config settings for the block.
+    """
+    old = {name: getattr(config, name) for name in settings}
+    for name, value in settings.items():
+        setattr(config, name, value)
+    try:
+        yield
+    finally:
+        for name, value in old.items():
+            setattr(config, name, value)
+
+
+@contextlib.contextmanager
+def temp_modules():
+    """
+    A temporary directory on sys.path to write benchmark modules to; yields a function
+    that writes and imports the module name with the given source.
+    """
+    with tempfile.TemporaryDirectory(prefix="code_generator_bench_") as directory:
+        sys.path.insert(0, directory)
+        names = []
+
+        def load(name, source):
+            with open(os.path.join(directory, f"{name}.py"), "w") as f:
+                f.write(source)
+            names.append(name)
+            importlib.invalidate_caches()
+            return importlib.import_module(name)
+
+        try:
+            yield load
+        finally:
+            sys.path.remove(directory)
+            for name in names:
+                sys.modules.pop(name, None)
@@ -0,0 +1,84 @@
+"""
+A deterministic stand-in for the model, for benchmarks.
+
+FakeBackend answers every prompt CodeGenerator sends with a small valid response that
+only depends on the prompt, after sleeping for delay seconds to simulate the model.
+"""
+import re
+import time
+import threading
+from code_generator import config
+from code_generator.backends import Backend, register_backend
+from code_generator.structured import SECTION_HEADERS, member_header
+
+_IMPLEMENT = re.compile(r"^Implement (?:the method|a new method to set the attribute) \w+\.(\w+)", re.MULTILINE)
+_CLASS_ATTRIBUTE = re.compile(r"^Add the attribute \w+\.(\w+) to the class", re.MULTILINE)
+_MODIFY = re.compile(r"^Modify the method \w+\.(\w+) to set the attribute \w+\.(\w+)", re.MULTILINE)
+_MEMBER = re.compile(r"^### MEMBER (\w+)$", re.MULTILINE)
+
+
+class FakeBackend(Backend):
+    name = "fake"
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def complete(self, prompt, provider=None) -> str:
+        with self._lock:
+            self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.respond(prompt)
+
+    def respond(self, prompt):
+        members = _MEMBER.findall(prompt)
+        if members:
+            response = "".join(f"{member_header(name)}\n{self.method(name)}\n" for name in members)
+            return response + f"{SECTION_HEADERS['imports']}\nNone\n{SECTION_HEADERS['commit_message']}\nAdd {', '.join(members)}\n"
+
+        match = _MODIFY.search(prompt)
+        if match:
+            code = f"def {match.group(1)}(self, *args, **kwargs):\n    self.{match.group(2)} = None"
+        elif _CLASS_ATTRIBUTE.search(prompt):
+            code = f"{_CLASS_ATTRIBUTE.search(prompt).group(1)} = None"
+        elif _IMPLEMENT.search(prompt):
+            code = self.method(_IMPLEMENT.search(prompt).group(1))
+        else:
+            code = None
+
+        if SECTION_HEADERS["code"] in prompt:
+            response = f"{SECTION_HEADERS['code']}\n{code}\n{SECTION_HEADERS['imports']}\nNone\n{SECTION_HEADERS['commit_message']}\nAdd generated code\n"
+            if SECTION_HEADERS["return_value"] in prompt:
+                response += f"{SECTION_HEADERS['return_value']}\nNone\n"
+            return response
+        if "class attribute or an instance attribute" in prompt:
+            return "class"
+        if "should the following code be inserted" in prompt:
+            return "2"
+        if "can be run with eval" in prompt:
+            return "None"
+        if "import statements that are required" in prompt:
+            return "None"
+        if "commit message" in prompt:
+            return "Add generated code"
+        return code or "None"
+
+    @staticmethod
+    def method(name):
+        return f'def {name}(self, *args, **kwargs):\n    """Generated for the benchmarks."""\n    return None'
+
+
+def install(delay=0.0):
+    """
+    Register a FakeBackend as "fake" and select it, with the response cache and git commits turned off.
+    Returns the backend.
+    """
+    backend = FakeBackend(delay)
+    register_backend("fake", backend)
+    config.backend = "fake"
+    config.fallback_backend = None
+    config.cache_enabled = False
+    config.git_branch = None
+    return backend
@@ -1,13 +1,21 @@
 from .generative_base import GenerativeBase
+from .generative_base import AsyncGenerativeBase
 from .code_generator import CodeGenerator
 from .code_writer import CodeWriter
 from .exceptions import CodeGenerationException
 from .exceptions import CodeWriterException
+from .exceptions import BackendException
+from .exceptions import InvalidResponseException
+from .exceptions import GenerationPendingException
 
 __all__ = [
     "GenerativeBase",
+    "AsyncGenerativeBase",
     "CodeGenerator",
     "CodeWriter",
     "CodeGenerationException",
     "CodeWriterException",
+    "BackendException",
+    "InvalidResponseException",
+    "GenerationPendingException",
 ]
@@ -0,0 +1,67 @@
+import asyncio
+import weakref
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from . import config
+
+# The event loop of the async generation the current thread works for
+_event_loop = contextvars.ContextVar("code_generator_event_loop", default=None)
+
+_semaphores = weakref.WeakKeyDictionary()
+_semaphores_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Return the event loop of the async generation this code runs for, or None in a sync generation.
+    """
+    return _event_loop.get()
+
+
+def get_semaphore(loop) -> asyncio.Semaphore:
+    """
+    Return the semaphore that caps the async generations in flight on loop.
+    """
+    with _semaphores_lock:
+        if loop not in _semaphores:
+            _semaphores[loop] = asyncio.Semaphore(config.async_max_generations)
+        return _semaphores[loop]
+
+
+async def run_generation(func, *args, **kwargs):
+    """
+    Run the blocking generation step func(*args, **kwargs) on a worker thread, so the event loop
+    keeps running, with at most config.async_max_generations of them at the same time.
+    Model calls made by func are run on the event loop (see run_on_loop).
+    """
+    loop = asyncio.get_running_loop()
+    async with get_semaphore(loop):
+        # Only the worker sees the loop: sync generations on the loop thread must not use it
+        context = contextvars.copy_context()
+        context.run(_event_loop.set, loop)
+        return await loop.run_in_executor(get_async_executor(), lambda: context.run(func, *args, **kwargs))
+
+
+def run_on_loop(coroutine):
+    """
+    Run coroutine on the event loop of the current async generation and wait for its result.
+    Must be called from a worker thread, not from the loop itself.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_async_executor():
+    """
+    Return the thread pool async generations run on. It is separate from the pipeline executor,
+    whose stages the generations wait for.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.async_max_generations, thread_name_prefix="code_generator_async")
+        return _executor
@@ -0,0 +1,496 @@
+import json
+import asyncio
+import queue
+import codecs
+import threading
+import subprocess
+import http.client
+import http.server
+from urllib.parse import urlsplit
+from . import config
+from .exceptions import BackendException
+
+
+class Backend:
+    """
+    Base class for the backends that CodeGenerator.prompt_ai sends prompts to.
+    """
+    name = None
+
+    def complete(self, prompt, provider=None) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt, provider=None):
+        """
+        Yield the response in chunks as it arrives. Closing the generator early stops the response.
+        Backends that cannot stream yield the whole response at once.
+        """
+        yield self.complete(prompt, provider)
+
+    async def acomplete(self, prompt, provider=None) -> str:
+        """
+        complete() for async generations. By default it runs complete() on a worker thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.complete, prompt, provider)
+
+    async def astream(self, prompt, provider=None):
+        """
+        stream() for async generations. By default each chunk of stream() is read on a worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        stream = self.stream(prompt, provider)
+        done = object()
+        # A chunk may still be being read when the reader is cancelled; close after it
+        lock = threading.Lock()
+
+        def read():
+            with lock:
+                return next(stream, done)
+
+        def close():
+            with lock:
+                stream.close()
+
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, read)
+                if chunk is done:
+                    break
+                yield chunk
+        finally:
+            await loop.run_in_executor(None, close)
+
+    def close(self):
+        pass
+
+
+class TgptBackend(Backend):
+    """
+    Runs the tgpt CLI once per prompt.
+    """
+    name = "tgpt"
+
+    def complete(self, prompt, provider=None):
+        provider = provider or config.provider
+        try:
+            result = subprocess.run(["tgpt", "-q", "--provider", provider, prompt], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True)
+        except FileNotFoundError:
+            raise BackendException("tgpt is not installed")
+        except subprocess.CalledProcessError as e:
+            raise BackendException(f"tgpt failed: {e.stderr}")
+        return result.stdout.strip()
+
+    def stream(self, prompt, provider=None):
+        provider = provider or config.provider
+        try:
+            process = subprocess.Popen(["tgpt", "-q", "--provider", provider, prompt], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except FileNotFoundError:
+            raise BackendException("tgpt is not installed")
+        finished = False
+        try:
+            for line in process.stdout:
+                yield line
+            stderr = process.stderr.read()
+            if process.wait() != 0:
+                raise BackendException(f"tgpt failed: {stderr}")
+            finished = True
+        finally:
+            if not finished:
+                # The response was stopped early
+                process.kill()
+            process.wait()
+            process.stdout.close()
+            process.stderr.close()
+
+    async def acomplete(self, prompt, provider=None):
+        response = ""
+        async for chunk in self.astream(prompt, provider):
+            response += chunk
+        return response.strip()
+
+    async def astream(self, prompt, provider=None):
+        provider = provider or config.provider
+        try:
+            process = await asyncio.create_subprocess_exec("tgpt", "-q", "--provider", provider, prompt, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except FileNotFoundError:
+            raise BackendException("tgpt is not installed")
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        finished = False
+        try:
+            async for line in process.stdout:
+                yield decoder.decode(line)
+            stderr = await process.stderr.read()
+            if await process.wait() != 0:
+                raise BackendException(f"tgpt failed: {stderr.decode(errors='replace')}")
+            finished = True
+        finally:
+            if not finished and process.returncode is None:
+                # The response was stopped early
+                process.kill()
+            await process.wait()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections to a single host.
+    """
+    def __init__(self, url, size=4, timeout=120):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {url}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _new_connection(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        # Returns (connection, reused)
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        conn, response = self.open(method, path, body=body, headers=headers)
+        try:
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise BackendException(f"HTTP request to {self.host} failed: {e}")
+        self.finish(conn, response, True)
+        return response.status, response.getheader("Content-Type", ""), data
+
+    def open(self, method, path, body=None, headers=None):
+        """
+        Send a request and return the connection and the response, with the body still unread.
+        The connection must be handed back with finish().
+        """
+        while True:
+            conn, reused = self.acquire()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                return conn, conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                # An idle connection may have been closed by the server
+                # Retry on a fresh connection, but only once per reused one
+                if reused:
+                    continue
+                raise BackendException(f"HTTP request to {self.host} failed: {e}")
+
+    def finish(self, conn, response, read_all):
+        # A connection can only be reused once its response was read to the end
+        if read_all and not response.will_close:
+            self.release(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class HttpBackend(Backend):
+    """
+    Sends prompts to an HTTP text-generation endpoint over pooled keep-alive connections.
+    The endpoint is looked up by provider name in config.http_providers unless a url is given.
+    """
+    name = "http"
+
+    def __init__(self, url=None, pool_size=None, timeout=None):
+        self.url = url
+        self.pool_size = pool_size or config.http_pool_size
+        self.timeout = timeout or config.http_timeout
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get_url(self, provider=None):
+        if self.url:
+            return self.url
+        provider = provider or config.provider
+        try:
+            return config.http_providers[provider]
+        except KeyError:
+            raise BackendException(f"No HTTP endpoint configured for provider {provider}")
+
+    def get_pool(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(url, size=self.pool_size, timeout=self.timeout)
+            return self._pools[key]
+
+    def complete(self, prompt, provider=None):
+        url = self.get_url(provider)
+        status, content_type, data = self.get_pool(url).request("POST", self.get_path(url), body=self.get_body(prompt), headers=self.get_headers())
+        if status != 200:
+            raise BackendException(f"HTTP backend returned status {status}: {data[:200]!r}")
+        return self.parse_response(content_type, data)
+
+    def stream(self, prompt, provider=None):
+        url = self.get_url(provider)
+        pool = self.get_pool(url)
+        conn, response = pool.open("POST", self.get_path(url), body=self.get_body(prompt, stream=True), headers=self.get_headers())
+        read_all = False
+        try:
+            if response.status != 200:
+                data = response.read()
+                read_all = True
+                raise BackendException(f"HTTP backend returned status {response.status}: {data[:200]!r}")
+            content_type = response.getheader("Content-Type", "")
+            if "text/event-stream" in content_type:
+                yield from self.parse_events(response)
+            elif "json" in content_type:
+                yield self.parse_response(content_type, response.read())
+            else:
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                while True:
+                    data = response.read1(8192)
+                    if not data:
+                        break
+                    yield decoder.decode(data)
+                rest = decoder.decode(b"", final=True)
+                if rest:
+                    yield rest
+            # Reading past the end marks the response as done, so the connection can be reused
+            response.read()
+            read_all = True
+        except (OSError, http.client.HTTPException) as e:
+            raise BackendException(f"HTTP request to {pool.host} failed: {e}")
+        finally:
+            pool.finish(conn, response, read_all)
+
+    def get_path(self, url):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        return path
+
+    def get_body(self, prompt, stream=False):
+        payload = {"messages": [{"role": "user", "content": prompt}]}
+        if stream:
+            payload["stream"] = True
+        return json.dumps(payload).encode()
+
+    def get_headers(self):
+        return {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+    def parse_events(self, response):
+        # Server-sent events, OpenAI style: "data: {json}" lines, ending with "data: [DONE]"
+        for line in response:
+            line = line.decode("utf-8", errors="replace").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                continue
+            try:
+                payload = json.loads(data)
+            except ValueError:
+                yield data
+                continue
+            if isinstance(payload, dict) and payload.get("choices"):
+                choice = payload["choices"][0]
+                text = (choice.get("delta") or {}).get("content") or choice.get("text")
+            elif isinstance(payload, dict):
+                text = payload.get("content") or payload.get("response")
+            else:
+                text = None
+            if text:
+                yield text
+
+    def parse_response(self, content_type, data):
+        text = data.decode("utf-8", errors="replace")
+        if "json" in content_type:
+            try:
+                payload = json.loads(text)
+            except ValueError:
+                return text.strip()
+            # OpenAI-style chat completion
+            if isinstance(payload, dict) and payload.get("choices"):
+                return payload["choices"][0]["message"]["content"].strip()
+            if isinstance(payload, dict):
+                for key in ("response", "text", "content"):
+                    if key in payload:
+                        return str(payload[key]).strip()
+        return text.strip()
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools = {}
+
+
+class _StubRequestHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 so connections are kept alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        messages = payload.get("messages") or [{"content": ""}]
+        prompt = messages[-1].get("content", "")
+        with self.server.stub.lock:
+            self.server.stub.requests += 1
+        try:
+            response = self.server.stub.responder(prompt)
+        except Exception as e:
+            self.send_error_response(500, f"{e!r}")
+            return
+        if not isinstance(response, str) and hasattr(response, "__iter__"):
+            # Responders can stream their response as an iterable of chunks
+            self.send_chunked(response)
+            return
+        body = str(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_response(self, status, message):
+        body = message.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunked(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                data = str(chunk).encode()
+                if data:
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            # The client stopped reading
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """
+    Local HTTP server that answers prompts with a responder callable, so the HTTP backend can be used offline.
+    A responder that returns an iterable instead of a string has its chunks streamed one by one,
+    and one that raises gets a 500 response.
+    """
+    def __init__(self, responder=None, host="127.0.0.1", port=0):
+        self.responder = responder or (lambda prompt: "None")
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    def start(self):
+        if self._server is None:
+            self._server = http.server.ThreadingHTTPServer((self.host, self.port), _StubRequestHandler)
+            self._server.daemon_threads = True
+            self._server.stub = self
+            self.port = self._server.server_address[1]
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class StubBackend(HttpBackend):
+    """
+    HTTP backend wired to a local StubServer.
+    """
+    name = "stub"
+
+    def __init__(self, responder=None, server=None):
+        self.server = server or StubServer(responder)
+        super().__init__(url=None)
+
+    def get_url(self, provider=None):
+        return self.server.start().url
+
+    def close(self):
+        super().close()
+        self.server.stop()
+
+
+_backend_classes = {
+    "tgpt": TgptBackend,
+    "http": HttpBackend,
+    "stub": StubBackend,
+}
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name, backend):
+    """
+    Register a Backend class or instance under name so it can be selected with config.backend.
+    """
+    with _backends_lock:
+        old = _backends.pop(name, None)
+        if isinstance(backend, Backend):
+            _backends[name] = backend
+        else:
+            _backend_classes[name] = backend
+    if old is not None and old is not backend:
+        old.close()
+
+
+def get_backend(name=None) -> Backend:
+    """
+    Return the long-lived backend instance for name (default config.backend).
+    """
+    name = name or config.backend
+    with _backends_lock:
+        if name not in _backends:
+            if name not in _backend_classes:
+                raise BackendException(f"Unknown backend: {name}")
+            _backends[name] = _backend_classes[name]()
+        return _backends[name]
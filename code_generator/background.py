@@ -0,0 +1,112 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationPool:
+    """
+    Bounded pool of worker threads that run generations off the calling thread.
+    At most max_workers jobs run and max_queue more wait; further jobs are rejected
+    instead of blocking the caller. A job that is already in flight for the same key
+    is not submitted again; its future is returned instead.
+    Threads are used rather than processes because generation is I/O bound and
+    needs the live classes of this process.
+    """
+    def __init__(self, max_workers=None, max_queue=None, name="generation"):
+        self.name = name
+        self.max_workers = max_workers or config.background_workers
+        self.max_queue = config.background_queue_size if max_queue is None else max_queue
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"code_generator_{name}")
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._lock = threading.Lock()
+        self.futures = {}
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Submit func(*args, **kwargs) under key. Returns its future, or None if the pool is full.
+        """
+        with self._lock:
+            future = self.futures.get(key)
+            if future is not None:
+                return future
+            if not self._slots.acquire(blocking=False):
+                self.rejected += 1
+                return None
+            self.submitted += 1
+            future = self._executor.submit(self._run, func, args, kwargs)
+            self.futures[key] = future
+        future.add_done_callback(lambda future: self._done(key, future))
+        return future
+
+    def _run(self, func, args, kwargs):
+        with self._lock:
+            self.running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _done(self, key, future):
+        with self._lock:
+            if self.futures.get(key) is future:
+                del self.futures[key]
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+                if not future.cancelled():
+                    logger.warning("Background %s of %s failed: %r", self.name, key, future.exception())
+            else:
+                self.completed += 1
+        self._slots.release()
+
+    @property
+    def queue_depth(self):
+        with self._lock:
+            return len(self.futures) - self.running
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self.running,
+                "queued": len(self.futures) - self.running,
+                "capacity": self.max_workers + self.max_queue,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+# Retrieval indexes are built one at a time, on their own thread so they never take a generation slot
+INDEXING_QUEUE_SIZE = 16
+
+_pool = None
+_indexing_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_generation_pool() -> GenerationPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = GenerationPool()
+        return _pool
+
+
+def get_indexing_pool() -> GenerationPool:
+    global _indexing_pool
+    with _pool_lock:
+        if _indexing_pool is None:
+            _indexing_pool = GenerationPool(max_workers=1, max_queue=INDEXING_QUEUE_SIZE, name="indexing")
+        return _indexing_pool
@@ -0,0 +1,134 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from . import config
+
+
+def default_cache_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "code_generator", "responses.sqlite3")
+
+
+class ResponseCache:
+    """
+    On-disk cache of AI responses, keyed by a hash of the prompt, backend and provider.
+    Entries expire after ttl seconds and the least recently used entries are evicted
+    once the cache grows past max_bytes or max_entries.
+    """
+    def __init__(self, path=None, max_bytes=None, max_entries=None, ttl=None):
+        self.path = path or default_cache_path()
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def key(prompt, backend="", provider=""):
+        digest = hashlib.sha256()
+        for part in (backend or "", provider or "", prompt):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                # Expired
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now))
+            self._evict()
+
+    def _evict(self):
+        if self.ttl is not None:
+            cursor = self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+            self.evictions += max(cursor.rowcount, 0)
+        entries, total_bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if (self.max_entries is None or entries <= self.max_entries) \
+        and (self.max_bytes is None or total_bytes <= self.max_bytes):
+            return
+        # Walk from the least recently used entry until we are within the limits
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if (self.max_entries is None or entries <= self.max_entries) \
+            and (self.max_bytes is None or total_bytes <= self.max_bytes):
+                break
+            doomed.append((key,))
+            entries -= 1
+            total_bytes -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            entries, total_bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the shared ResponseCache for the current config, or None if caching is disabled.
+    """
+    global _cache
+    if not config.cache_enabled:
+        return None
+    path = config.cache_path or default_cache_path()
+    with _cache_lock:
+        if _cache is None or _cache.path != path:
+            if _cache is not None:
+                _cache.close()
+            _cache = ResponseCache(path)
+        # Limits may be changed at any time
+        _cache.max_bytes = config.cache_max_bytes
+        _cache.max_entries = config.cache_max_entries
+        _cache.ttl = config.cache_ttl
+        return _cache
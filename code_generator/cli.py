@@ -0,0 +1,116 @@
+"""
+Command-line entry point for generating missing members ahead of time.
+
+    code-generator scan PATH...        list the members that would be generated
+    code-generator generate PATH...    generate them, one class per worker process
+"""
+import sys
+import argparse
+import importlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import config
+from .scanner import ProjectScanner
+from .snapshot import FrameRecord, StackSnapshot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="code-generator", description="Generate the members that GenerativeBase subclasses use but do not define, ahead of time.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan = subparsers.add_parser("scan", help="list the missing members")
+    scan.add_argument("paths", nargs="+", help="source files or directories to scan")
+
+    generate = subparsers.add_parser("generate", help="generate the missing members")
+    generate.add_argument("paths", nargs="+", help="source files or directories to scan")
+    generate.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    generate.add_argument("--backend", help="backend to send prompts to (config.backend)")
+    generate.add_argument("--provider", help="AI provider (config.provider)")
+    generate.add_argument("--mode", choices=["staged", "structured"], help="generation mode (config.generation_mode)")
+    generate.add_argument("--branch", help="branch to commit the generated code to (config.git_branch)")
+
+    args = parser.parse_args(argv)
+    scanner = ProjectScanner(args.paths)
+    missing = scanner.scan()
+    for path, error in scanner.errors:
+        print(f"Skipped {path}: {error}", file=sys.stderr)
+
+    if args.command == "scan":
+        for member in missing:
+            access = member.accesses[0]
+            kind = "method" if member.is_method else "attribute"
+            print(f"{member.class_info.full_name}.{member.name} ({kind}), used at {access.path}:{access.lineno}")
+        print(f"{len(missing)} missing members")
+        return 0
+
+    overrides = {name: value for name, value in (("backend", args.backend), ("provider", args.provider), ("generation_mode", args.mode), ("git_branch", args.branch)) if value is not None}
+    return generate_all(missing, args.jobs, overrides)
+
+
+def generate_all(missing, jobs=None, overrides=None):
+    """
+    Generate the missing members (scanner.MissingMember), one class per worker process.
+    Returns 0 if every class was generated, 1 otherwise.
+    """
+    by_class = OrderedDict()
+    for member in missing:
+        by_class.setdefault(member.class_info, []).append(member)
+    if not by_class:
+        print("Nothing to generate")
+        return 0
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for info, members in by_class.items():
+            misses = [(member.name, [(a.path, a.lineno, a.function, a.call, a.args, a.kwargs) for a in member.accesses]) for member in members]
+            futures[executor.submit(generate_class, info.path, info.module, info.qualname, misses, overrides or {})] = info
+        for future in as_completed(futures):
+            info = futures[future]
+            try:
+                names = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{info.full_name}: failed: {e!r}", file=sys.stderr)
+                continue
+            print(f"{info.full_name}: generated {', '.join(names) if names else 'nothing'}")
+    return 1 if failed else 0
+
+
+def generate_class(path, module_name, qualname, misses, overrides):
+    """
+    Worker: import the class and generate its missing members with a batched request.
+    misses is a list of (name, [(path, lineno, function, call, args, kwargs), ...]).
+    """
+    from .recorder import MissRecorder
+    from .scanner import module_name as find_module_name
+
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    # Members are installed in the worker's copy of the class, which is thrown away
+    config.hot_install = False
+    root = find_module_name(path)[1]
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    cls = importlib.import_module(module_name)
+    for part in qualname.split("."):
+        cls = getattr(cls, part)
+
+    recorder = MissRecorder()
+    for name, accesses in misses:
+        # Defined at runtime in a way the scanner cannot see
+        if any(name in vars(base) for base in cls.__mro__):
+            continue
+        path, lineno, function, _, _, _ = accesses[0]
+        # Index 0 stands for the frame of the miss, like in a snapshot taken by __getattr__
+        snapshot = StackSnapshot([FrameRecord(path, lineno, "<ahead-of-time generation>"), FrameRecord(path, lineno, function)])
+        recorder.record(cls, name, snapshot)
+        for _, _, _, call, args, kwargs in accesses:
+            if call:
+                recorder.record_use(cls, name, "__call__", args, kwargs)
+    generated = recorder.flush()
+    return [name for names in generated.values() for name in names]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,61 @@
+import os
+import ast
+import time
+import sqlite3
 import inspect
-import subprocess
+import logging
+import textwrap
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import wait, FIRST_COMPLETED
+from . import config
+from .aio import get_event_loop, run_on_loop
+from .backends import get_backend
+from .cache import get_response_cache
+from .context import ContextBuilder, CHARS_PER_TOKEN
+from .hierarchy import get_class_registry
+from .instrumentation import get_instrumentation, phase
+from .retrieval import get_retrieval_index, project_root, tokenize_code
+from .retry import RetryPolicy, get_circuit_breaker, get_providers, get_hedge_executor
+from .patching import number_lines, apply_patch
+from .placement import replace_member
+from .snapshot import StackSnapshot
+from .source_index import get_source_index
+from .streaming import FirstLineParser, CodeParser, SectionParser, PatchParser
+from .structured import StructuredResponse, BatchResponse, SECTION_HEADERS, member_header
 from .exceptions import CodeGenerationException
+from .exceptions import CodeWriterException
+from .exceptions import BackendException
+from .exceptions import InvalidResponseException
+
+logger = logging.getLogger(__name__)
+
+# The base classes of generative classes, left out of their hierarchy
+BASE_CLASS_NAMES = ("GenerativeBase", "AsyncGenerativeBase")
+
+
+def is_async_class(cls):
+    return any(base.__name__ == "AsyncGenerativeBase" for base in cls.__mro__)
+
+
+def check_patched_module(cls, name, code):
+    """
+    Replace the method name of cls with code in the module source of cls, indented like the method,
+    and check that the module still parses. Raises CodeWriterException if it does not.
+    """
+    path = inspect.getsourcefile(cls)
+    with open(path) as f:
+        source = f.read()
+    patched = replace_member(source, cls.__qualname__, code, name)
+    try:
+        ast.parse(patched, filename=path)
+    except SyntaxError as e:
+        raise CodeWriterException(f"Patched module {path} is not valid Python: {e}")
+
 
 class CodeGenerator:
-    def generate_method(self, cls, method_name, args, kwargs, frozen_stack):
+    def generate_method(self, cls, method_name, args, kwargs, frozen_stack, structured=False, return_value_for=None):
         code_context = self.get_default_code_context(cls, method_name, frozen_stack)
 
         prompt = f"Implement the method {cls.__name__}.{method_name} in the class {cls.__name__} with the arguments {args} and the keyword arguments {kwargs}.\n"
@@ -11,11 +63,15 @@ class CodeGenerator:
         prompt += "The method was called with the arguments {args} and the keyword arguments {kwargs}.\n"
         prompt += "Do not generate the class definition, only the method implementation.\n"
         prompt += "Your job is to define the method.\n"
+        if is_async_class(cls):
+            prompt += "The class is used from asyncio code and its methods are awaited, so define the method with async def.\n"
 
+        if structured:
+            return self.generate_structured(prompt, code_context, return_value_for=return_value_for)
         code = self.generate_code(prompt, code_context)
         return code
 
-    def generate_method_for_attribute(self, cls, attribute_name, stack):
+    def generate_method_for_attribute(self, cls, attribute_name, stack, structured=False, return_value_for=None):
         # Implement a new method to set the attribute
         code_context = self.get_default_code_context(cls, attribute_name, stack)
 
@@ -28,10 +84,12 @@ class CodeGenerator:
         prompt += "Return only the code for the method.\n"
         prompt += "Do not generate the class definition, only the method implementation.\n"
 
+        if structured:
+            return self.generate_structured(prompt, code_context, return_value_for=return_value_for)
         code = CodeGenerator().generate_code(prompt, code_context)
         return code
 
-    def generate_class_attribute(self, cls, attribute_name, stack):
+    def generate_class_attribute(self, cls, attribute_name, stack, structured=False, return_value_for=None):
         # Add the attribute to the class source as a class attribute
         code_context = self.get_default_code_context(cls, attribute_name, stack)
 
@@ -42,10 +100,12 @@ class CodeGenerator:
         prompt += "Return the line or lines of code where the attribute is defined.\n"
         prompt += "Do not generate the class definition (the class ClassName line), only the attribute definition (attribute_name = value).\n"
 
+        if structured:
+            return self.generate_structured(prompt, code_context, return_value_for=return_value_for)
         code = self.generate_code(prompt, code_context)
         return code
 
-    def modify_method_for_attribute(self, cls, attribute_name, stack, existing_method_name):
+    def modify_method_for_attribute(self, cls, attribute_name, stack, existing_method_name, structured=False, return_value_for=None):
         # Modify an existing method to set the attribute
         code_context = self.get_default_code_context(cls, attribute_name, stack)
         existing_method_source = inspect.getsource(cls.__dict__[existing_method_name])
@@ -55,9 +115,17 @@ class CodeGenerator:
         prompt += "We have determined that the attribute should be set by modifying an existing method to set the attribute.\n"
         prompt += "Your job is to modify the method.\n"
         prompt += "The method must retain its original functionality.\n"
+
+        if not structured and config.modify_mode == "patch":
+            code = self.patch_code(prompt, code_context, existing_method_source, cls, existing_method_name)
+            if code is not None:
+                return code
+
         prompt += "Return only the source code of the modified method.\n"
         prompt += "Do not generate the class definition, only the modified method.\n"
 
+        if structured:
+            return self.generate_structured(prompt, code_context, existing_code=existing_method_source, return_value_for=return_value_for)
         code = self.modify_code(prompt, code_context, existing_method_source)
         return code
 
@@ -86,12 +154,13 @@ class CodeGenerator:
         commit_message = f"AI generated {commit_message}"
         return commit_message
 
-    def generate_info(self, prompt, code_context=""):
+    def generate_info(self, prompt, code_context="", first_line=False):
+        # With first_line=True the answer is a single line, and the response is not read past it
         prompt = f"{code_context}\n\n{prompt}"
         prompt += "- Based on the code above, and the instructions, generate a valid response.\n"
         prompt += "- Do not generate any additional text aside from the response that is requested.\n"
 
-        info = self.prompt_ai(prompt)
+        info = self.prompt_ai(prompt, parser=FirstLineParser if first_line else None)
         return info
 
     def generate_code(self, prompt, code_context=""):
@@ -104,7 +173,7 @@ class CodeGenerator:
         prompt += "- Do not generate any import statements, they will be added later.\n"
         prompt += "- Do not include the text ```python.\n"
 
-        code = self.prompt_ai(prompt)
+        code = self.prompt_ai(prompt, parser=CodeParser)
         # Remove the Markdown formatting
         code = code.strip()
         code = code.replace("```python", "")
@@ -122,13 +191,113 @@ class CodeGenerator:
         prompt += "- Do not generate any import statements, they will be added later.\n"
         prompt += "- Do not include the text ```python.\n"
 
-        code = self.prompt_ai(prompt)
+        code = self.prompt_ai(prompt, parser=CodeParser)
         # Remove the Markdown formatting
         code = code.strip()
         code = code.replace("```python", "")
         code = code.replace("```", "")
         return code
 
+    def patch_code(self, prompt, code_context, code, cls=None, name=None):
+        """
+        Ask for the change to code as a unified diff and apply it locally.
+        With cls and name, code is the method name of cls, and the patched method must also leave
+        the module of cls valid once it replaces the method there.
+        Returns the modified code, dedented, or None if the patch did not apply.
+        """
+        source = textwrap.dedent(code)
+        prompt = f"{code_context}\n\n{prompt}"
+        prompt += f"- The following code is the existing code, with line numbers:\n{number_lines(source)}"
+        prompt += "- Return only a unified diff of the change against the existing code, with @@ hunk headers that use the line numbers above.\n"
+        prompt += "- Do not include the line numbers in the lines of the diff.\n"
+        prompt += "- Keep the diff as small as possible, with at most 2 lines of context around each change.\n"
+        prompt += "- Do not generate any explaining text and do not include the text ```diff.\n"
+
+        patch = self.prompt_ai(prompt, parser=PatchParser)
+        try:
+            patched = apply_patch(source, patch).strip()
+            if cls is not None and name is not None:
+                check_patched_module(cls, name, patched)
+        except (InvalidResponseException, CodeWriterException) as e:
+            logger.info("Patch could not be applied, asking for the whole method: %s", e)
+            return None
+        return patched
+
+    def generate_structured(self, prompt, code_context="", existing_code="", return_value_for=None) -> StructuredResponse:
+        """
+        Ask for the code, its imports and a commit message in a single response.
+        return_value_for is (special_method_name, args, kwargs) when the return value is needed too.
+        """
+        prompt = f"{code_context}\n\n{prompt}"
+        if existing_code:
+            prompt += f"- The following code is the existing code: {existing_code}\n"
+        prompt += "- Generate Python code as described.\n"
+        prompt += "- If appropriate, document the code clearly and concisely with comments to explain what the code does.\n"
+        prompt += "- If it is a function, add a docstring to the function.\n"
+        prompt += "- Do not generate any additional code beside the code that is described.\n"
+        prompt += "- Respond with the following sections, each starting with its header line exactly as written:\n"
+        prompt += f"{SECTION_HEADERS['code']}\n"
+        prompt += "The Python code, without any import statements.\n"
+        prompt += f"{SECTION_HEADERS['imports']}\n"
+        prompt += "The Python import statements that are required for the code, or 'None' if no import statements are required.\n"
+        prompt += f"{SECTION_HEADERS['commit_message']}\n"
+        prompt += "A commit message for the changes.\n"
+        if return_value_for is not None:
+            special_method_name, args, kwargs = return_value_for
+            prompt += f"{SECTION_HEADERS['return_value']}\n"
+            prompt += "A Python expression that can be run with eval to return the value of the attribute or its return value if it is a function"
+            if args:
+                prompt += f", called with the arguments {args}"
+            if kwargs:
+                prompt += f" and the keyword arguments {kwargs}"
+            prompt += f". It must return a value compatible with the special method {special_method_name}.\n"
+        prompt += "- Do not generate any text outside of these sections.\n"
+        prompt += "- Do not include the text ```python.\n"
+
+        return StructuredResponse.parse(self.prompt_ai(prompt, parser=SectionParser))
+
+    def generate_batch(self, cls, records) -> BatchResponse:
+        """
+        Implement several missing members of cls with a single model request.
+        records are recorder.MissRecord objects.
+        """
+        names = [record.name for record in records]
+        code_context = self.get_default_code_context(cls, ", ".join(names), records[0].snapshot)
+
+        prompt = f"The following members were accessed on instances of the class {cls.__module__}.{cls.__name__} but they were not defined in the class:\n"
+        for record in records:
+            prompt += record.describe()
+        prompt += "Your job is to implement all of them in the class.\n"
+        prompt += "Members that are called must be implemented as methods. Other members must be implemented as class attributes or properties.\n"
+        if is_async_class(cls):
+            prompt += "The class is used from asyncio code and its methods are awaited, so define the methods with async def.\n"
+        prompt += "Do not generate the class definition, only the member implementations.\n"
+        prompt = f"{code_context}\n\n{prompt}"
+        prompt += "- Generate Python code as described.\n"
+        prompt += "- If appropriate, document the code clearly and concisely with comments to explain what the code does.\n"
+        prompt += "- If it is a function, add a docstring to the function.\n"
+        prompt += "- Respond with the following sections, each starting with its header line exactly as written:\n"
+        for name in names:
+            prompt += f"{member_header(name)}\n"
+            prompt += f"The Python code of {name}, without any import statements.\n"
+        prompt += f"{SECTION_HEADERS['imports']}\n"
+        prompt += "The Python import statements that are required for the code, or 'None' if no import statements are required.\n"
+        prompt += f"{SECTION_HEADERS['commit_message']}\n"
+        prompt += "A commit message for the changes.\n"
+        prompt += "- Do not generate any text outside of these sections.\n"
+        prompt += "- Do not include the text ```python.\n"
+
+        return BatchResponse.parse(self.prompt_ai(prompt, parser=SectionParser), names)
+
+    def evaluate_return_value(self, code, attribute_name, special_method_name, args=[], kwargs={}, expression=None):
+        # Use the expression from a structured response if there is one
+        if expression:
+            try:
+                return eval(expression)
+            except Exception as e:
+                logger.warning("Return value expression %s failed: %s", expression, e)
+        return self.generate_return_value(code, attribute_name, special_method_name, args, kwargs)
+
     def generate_imports(self, code):
         prompt = f"The following code was generated by the code generator: {code}\n"
         prompt += "- Generate the Python import statements that are required for the code.\n"
@@ -138,7 +307,7 @@ class CodeGenerator:
         prompt += "- Do not include any other text beside the import statements or the text 'None'.\n"
         prompt += "- Do not include the text ```python.\n"
 
-        imports = self.prompt_ai(prompt)
+        imports = self.prompt_ai(prompt, parser=CodeParser)
         if imports == "None":
             imports = ""
         return imports
@@ -152,31 +321,109 @@ class CodeGenerator:
         prompt += "If the attribute should be defined as an instance attribute, but there is no existing method that can be sensibly modified to set the attribute, return 'None'.\n"
         prompt += "Return only 'class' or 'None' or the name of the method that should be modified to set the attribute.\n"
 
-        method = self.generate_info(prompt, code_context)
+        method = self.generate_info(prompt, code_context, first_line=True)
 
         return method
 
     def get_default_code_context(self, cls, method_name, frozen_stack):
         # Get the default code context
+        # Pieces are ranked by relevance: the class itself, its closest parents,
+        # the code around the call, the stack trace, the code found by retrieval,
+        # then other related classes.
+        # Less relevant pieces are elided or left out to fit config.context_budget.
+        with phase("context", member=f"{cls.__qualname__}.{method_name}") as event:
+            code_context = self._build_code_context(ContextBuilder(), cls, method_name, frozen_stack)
+            event.bytes_out = len(code_context)
+        return code_context
+
+    def _build_code_context(self, builder, cls, method_name, frozen_stack):
+
         # Get the parent classes
         parent_classes = self.get_all_parent_classes(cls)
-        parent_class_sources = self.get_class_sources(parent_classes, method_name)
+        parents_section = f"Parent classes of {cls.__module__}.{cls.__name__}"
+        for i, parent in enumerate(parent_classes):
+            # parent_classes has the farthest ancestor first
+            distance = len(parent_classes) - i
+            builder.add(parents_section, 1 + distance * 0.01,
+                        lambda parent=parent: self.get_class_source(parent, method_name),
+                        lambda parent=parent: "".join(self.get_class_source(parent, method_name).splitlines(True)[:2]) + "...\n")
+
+        # Get the code of the project that matches the missing name and the call best
+        snippets = self.get_relevant_code(cls, method_name, frozen_stack, parent_classes)
+        for i, snippet in enumerate(snippets):
+            builder.add("Relevant code elsewhere in the project", 5 + i * 0.01,
+                        lambda snippet=snippet: self.render_snippet(snippet),
+                        lambda snippet=snippet: "".join(self.render_snippet(snippet).splitlines(True)[:2]) + "...\n")
 
         # Get other related classes, siblings, cousins, etc
-        other_related_classes = self.get_all_related_classes(cls, excluded_classes=parent_classes)
-        other_related_class_sources = self.get_class_sources(other_related_classes, method_name)
-        caller_source = self.get_calling_code(stack=frozen_stack, stack_depth=1)
-        stack_trace = self.get_stack_trace(frozen_stack, start_depth=1)
-        self_source = self.get_class_source(cls, method_name, full=True)
-        
-        code_context = f"Parent classes of {cls.__module__}.{cls.__name__}:\n {parent_class_sources}\n"
-        code_context += f"Other related classes:\n {other_related_class_sources}\n"
-        code_context += f"Code of around the call:\n {caller_source}\n"
-        code_context += f"Stack trace: Most recent frame first:\n {stack_trace}\n"
-        code_context += f"Code of class {cls.__module__}.{cls.__name__}:\n {self_source}\n"
-
+        # Only without retrieval results: most of them have nothing to do with the missing name
+        if not snippets:
+            other_related_classes = self.get_all_related_classes(cls, excluded_classes=parent_classes)
+            for i, related in enumerate(other_related_classes):
+                builder.add("Other related classes", 10 + i * 0.01, lambda related=related: self.get_class_source(related, method_name))
+
+        builder.add("Code of around the call", 2, lambda: self.get_calling_code(stack=frozen_stack, stack_depth=1))
+        builder.add("Stack trace: Most recent frame first", 3, lambda: self.get_stack_trace(frozen_stack, start_depth=1))
+        builder.add(f"Code of class {cls.__module__}.{cls.__name__}", 0,
+                    lambda: self.get_class_source(cls, method_name, full=True),
+                    lambda: self.get_class_source(cls, method_name))
+
+        code_context = builder.build()
+        self.last_context_size = builder.size
+        logger.debug("Code context for %s.%s: %d chars (~%d tokens), %d pieces elided, %d left out", cls.__name__, method_name, builder.size, builder.tokens, builder.elided, builder.omitted)
         return code_context
 
+    def get_relevant_code(self, cls, method_name, frozen_stack, parent_classes=()):
+        """
+        Search the retrieval index of the project of cls for the functions and classes that
+        match the missing name, the class name and the code around the call best.
+        The class, its parents and the calling function are left out, they are in the context anyway.
+        The index is brought up to date in the background; until it was built once, nothing is found.
+        """
+        try:
+            class_file = os.path.abspath(inspect.getsourcefile(cls))
+        except (OSError, TypeError):
+            return []
+        root = project_root(class_file)
+        index = get_retrieval_index(root) if root is not None else None
+        if index is None:
+            return []
+        index.update_in_background()
+        if not index.ready:
+            return []
+
+        query = Counter()
+        # The missing name counts most
+        for term in tokenize_code(method_name):
+            query[term] += 3
+        query.update(tokenize_code(cls.__name__))
+
+        exclude = []
+        for excluded in [cls, *parent_classes]:
+            try:
+                exclude.append((os.path.abspath(inspect.getsourcefile(excluded)), excluded.__qualname__))
+            except (OSError, TypeError):
+                pass
+        if len(frozen_stack) > 1:
+            query.update(tokenize_code(self.get_calling_code(stack=frozen_stack, stack_depth=1)))
+            caller_frame = frozen_stack[1]
+            try:
+                caller = get_source_index().get_file(caller_frame.filename).find_enclosing(caller_frame.lineno)
+            except (OSError, SyntaxError, UnicodeDecodeError):
+                caller = None
+            if caller is not None:
+                exclude.append((os.path.abspath(caller_frame.filename), caller))
+
+        try:
+            return index.search(query, config.retrieval_top_k, exclude)
+        except sqlite3.Error as e:
+            logger.warning("Retrieval index %s failed: %r", index.path, e)
+            return []
+
+    def render_snippet(self, snippet):
+        path = os.path.relpath(snippet.path, os.getcwd()) if snippet.path.startswith(os.getcwd() + os.sep) else snippet.path
+        return f"{path}, {snippet.qualname}:\n" + self.add_line_numbers(snippet.source.splitlines(), start=snippet.lineno)
+
     def add_line_numbers(self, code_lines, start=1) -> str:
         source = ""
         for line in code_lines:
@@ -185,10 +432,19 @@ class CodeGenerator:
         return source
 
     def get_class_source(self, cls, name, full=False):
+        # Rendered sources are cached until the class file changes
+        index = get_source_index()
+        source = index.get_summary(cls, (name, full))
+        if source is None:
+            source = self.render_class_source(cls, name, full, index)
+            index.set_summary(cls, (name, full), source)
+        return source
+
+    def render_class_source(self, cls, name, full, index):
         if full:
             try:
                 source = f"{cls.__module__}.{cls.__name__}:\n"
-                source_lines, lineno = inspect.getsourcelines(cls)
+                source_lines, lineno = index.getsourcelines(cls)
                 source += self.add_line_numbers(source_lines, start=lineno)
                 return source
             except (OSError, TypeError):
@@ -198,7 +454,7 @@ class CodeGenerator:
         source = f"{cls.__module__}.{cls.__name__}:\n"
         # Add the class def line and the method implementation to the source
         try:
-            class_source, lineno = inspect.getsourcelines(cls)
+            class_source, lineno = index.getsourcelines(cls)
             source += f"{lineno}: {class_source[0]}\n"
         except (OSError, TypeError):
             # Class source could not be found
@@ -207,13 +463,13 @@ class CodeGenerator:
 
         # Add the source of the __init__ method
         if "__init__" in cls.__dict__:
-            source_lines, lineno = inspect.getsourcelines(cls.__dict__["__init__"])
+            source_lines, lineno = index.getsourcelines(cls.__dict__["__init__"])
             source += self.add_line_numbers(source_lines, start=lineno)
 
         # Add the source of the method
         if name in cls.__dict__:
             if inspect.isfunction(cls.__dict__[name]):
-                source_lines, lineno = inspect.getsourcelines(cls.__dict__[name])
+                source_lines, lineno = index.getsourcelines(cls.__dict__[name])
                 source += self.add_line_numbers(source_lines, start=lineno)
             else:
                 source += f"{name}={cls.__dict__[name]}\n"
@@ -223,7 +479,7 @@ class CodeGenerator:
             if attr_name != "__init__" \
             and attr_name != name:
                 if inspect.isfunction(attr):
-                    method_source, lineno = inspect.getsourcelines(attr)
+                    method_source, lineno = index.getsourcelines(attr)
                     source += f"{lineno}: {method_source[0]}\n"
                     source += "...\n"
                 else:
@@ -239,31 +495,17 @@ class CodeGenerator:
         return sources
 
     def get_all_related_classes(self, cls, excluded_classes=None):
-        subclass_families = []
-        parent_classes = self.get_all_parent_classes(cls)
-        for parent in parent_classes:
-            parent_subclasses = self.get_all_subclasses(parent)
-            # Has to be for loop here instead of list comprehension so we can get subclasses of excluded classes
-            if excluded_classes is not None and parent not in excluded_classes:
-                parent_subclasses.append(parent)
-
-            # Remove all in excluded_classes
-            if excluded_classes is not None:
-                parent_subclasses = [c for c in parent_subclasses if c not in excluded_classes]
-            subclass_families.append(parent_subclasses)
-        # Combine the freundshachts into generations so the 'ages' are closer together in the list
-        zipped_subclass_families = zip(*subclass_families)
-        subclass_generations = [list(gen) for gen in zipped_subclass_families]
-        # Flatten the generations
-        classes = [cls for gen in subclass_generations for cls in gen]
-        return classes
+        excluded_classes = set(excluded_classes or ()) | {cls}
+        # Closest ancestors first, so siblings come before cousins
+        ancestors = [parent for parent in cls.__mro__[1:] if parent.__name__ not in BASE_CLASS_NAMES and parent is not object]
+        return get_class_registry().related_classes(ancestors, excluded_classes)
 
     def get_all_parent_classes(self, cls, excluded_classes=None):
         parent_classes = []
         for parent in cls.__mro__:
             if excluded_classes is not None and parent in excluded_classes:
                 continue
-            if parent.__name__ == "GenerativeBase"\
+            if parent.__name__ in BASE_CLASS_NAMES\
             or parent is object\
             or parent is cls:
                 continue
@@ -273,59 +515,207 @@ class CodeGenerator:
         return parent_classes
 
     def get_all_subclasses(self, cls, excluded_classes=None):
+        excluded_classes = excluded_classes or ()
+        registry = get_class_registry()
+        if registry.is_registered(cls):
+            return registry.descendants(cls, excluded_classes)
         subclasses = []
         for subclass in cls.__subclasses__():
-            if excluded_classes is not None and subclass not in excluded_classes:
+            if subclass not in excluded_classes:
                 subclasses.append(subclass)
             subclasses.extend(self.get_all_subclasses(subclass, excluded_classes))
         return subclasses
 
     def get_calling_code(self, stack=None, stack_depth=0, slice_pre=10, slice_post=10):
-        caller_source = ""
         if stack is None:
-            caller_frame = inspect.stack()[stack_depth]
-        else:
-            caller_frame = stack[stack_depth]
-        frame_info = inspect.getframeinfo(caller_frame[0])
+            stack = StackSnapshot.capture()
+        caller_frame = stack[stack_depth]
+        try:
+            file_index = get_source_index().get_file(caller_frame.filename)
+        except (OSError, SyntaxError, UnicodeDecodeError):
+            return ""
         # If caller is a method, get the source of the method
         # If caller is module, only get the source immediately around the call
-        if frame_info.function != "<module>":
-            try:
-                caller_source_lines, lineno = inspect.getsourcelines(caller_frame[0])
-                caller_source = self.add_line_numbers(caller_source_lines, start=lineno)
-            except (OSError, TypeError):
-                caller_source = ""
-        else:
-            try:
-                caller_source_lines, lineno = inspect.getsourcelines(caller_frame[0])
-                source_we_need = caller_source_lines[frame_info.lineno - slice_pre:frame_info.lineno + slice_post]
-                caller_source = self.add_line_numbers(source_we_need, start=frame_info.lineno - slice_pre + 1)
-            except (OSError, TypeError):
-                caller_source = ""
-            except IndexError:
-                caller_source = self.get_calling_code(stack=stack, stack_depth=stack_depth, slice_pre=slice_pre - 1, slice_post=slice_post - 1)
-
-        return caller_source
+        if caller_frame.function != "<module>":
+            qualname = file_index.find_enclosing(caller_frame.lineno)
+            if qualname is None:
+                return ""
+            caller_source_lines, lineno = file_index.get_lines(qualname)
+            return self.add_line_numbers(caller_source_lines, start=lineno)
+        start = max(caller_frame.lineno - slice_pre, 0)
+        source_we_need = file_index.lines[start:caller_frame.lineno + slice_post]
+        return self.add_line_numbers(source_we_need, start=start + 1)
 
     def get_stack_trace(self, frozen_stack, start_depth=1):
         stack_trace = ""
         for frame in frozen_stack[start_depth:]:
-            frame_info = inspect.getframeinfo(frame[0])
-            stack_trace += f"File: {frame_info.filename}, Line: {frame_info.lineno}, Function: {frame_info.function}\n"
+            stack_trace += f"File: {frame.filename}, Line: {frame.lineno}, Function: {frame.function}\n"
         return stack_trace
 
-    def prompt_ai(self, prompt, try_count=0):
+    def prompt_ai(self, prompt, parser=None):
+        """
+        Send prompt to the backend, or answer it from the cache.
+        parser is the streaming.ResponseParser class used to read a streamed response;
+        only responses that pass its checks are cached.
+        """
+        logger.debug("AI prompt (%d chars, ~%d tokens): %s", len(prompt), len(prompt) // CHARS_PER_TOKEN, prompt)
+        with phase("model", backend=config.backend) as event:
+            event.bytes_in = len(prompt)
+            cache = get_response_cache()
+            if cache is not None:
+                key = cache.key(prompt, config.backend, config.provider)
+                response = cache.get(key)
+                if response is not None:
+                    event.details["cached"] = True
+                    event.bytes_out = len(response)
+                    logger.debug("AI response (cached): %s", response)
+                    return response
+
+            response, _, _ = self.request_ai(prompt, parser=parser)
+            event.bytes_out = len(response)
+        logger.debug("AI response: %s", response)
+        # The last attempt is used even if it is invalid, but it is not kept
+        if cache is not None and (parser is None or parser.check_response(response)):
+            # Stored under the backend and provider that were asked for, even after a failover, as that is what is looked up
+            cache.set(key, response)
+        return response
+
+    def request_ai(self, prompt, parser=None):
+        """
+        Send prompt until a valid response comes back.
+        Returns (response, backend, provider), the backend and provider being the ones that answered.
+        Backend failures are retried after a backoff (retry.RetryPolicy), on the provider with the
+        fewest recent failures whose circuit breaker lets requests through. Streamed responses that
+        were stopped because they were invalid are asked for again right away.
+        """
+        policy = RetryPolicy()
+        failures = 0
+        aborted = 0
+        while True:
+            providers = self.get_available_providers()
+            if not providers:
+                raise CodeGenerationException(f"AI prompt failed: every provider has been failing, try again in {config.circuit_reset_timeout} seconds.")
+            try:
+                # Invalid responses are stopped early, except on the last attempt
+                return self.complete_hedged(prompt, providers, parser, abort=aborted < config.stream_retries)
+            except InvalidResponseException as e:
+                aborted += 1
+                self.count_retry()
+                logger.info("AI response stopped early, asking again: %s", e)
+            except BackendException as e:
+                failures += 1
+                if failures >= policy.attempts:
+                    raise CodeGenerationException(f"AI prompt failed too many times. {e}")
+                self.count_retry()
+                delay = policy.delay(failures - 1)
+                logger.info("AI prompt failed, retrying in %.2fs: %s", delay, e)
+                time.sleep(delay)
+
+    def get_available_providers(self):
+        # Providers with the fewest recent failures come first; the sort keeps the configured order otherwise
+        breakers = [(provider, get_circuit_breaker(config.backend, provider)) for provider in get_providers()]
+        return [provider for provider, breaker in sorted(breakers, key=lambda item: item[1].recent_failures()) if breaker.available()]
+
+    def count_retry(self):
+        event = get_instrumentation().current()
+        if event is not None:
+            event.retries += 1
+
+    def complete_hedged(self, prompt, providers, parser=None, abort=True):
+        """
+        Send prompt to the first of providers. With config.hedge_after set, the prompt is also sent
+        to the second one if there is no response by then, and the first valid response is used.
+        Returns (response, backend, provider), like complete().
+        """
+        if config.hedge_after is None or len(providers) < 2:
+            return self.complete_on(providers[0], prompt, parser, abort)
+
+        executor = get_hedge_executor()
+        cancel = threading.Event()
+        pending = {executor.submit(contextvars.copy_context().run, self.complete_on, providers[0], prompt, parser, abort, cancel)}
+        done, _ = wait(pending, timeout=config.hedge_after)
+        if not done:
+            logger.info("No response from %s after %ss, also asking %s", providers[0], config.hedge_after, providers[1])
+            pending.add(executor.submit(contextvars.copy_context().run, self.complete_on, providers[1], prompt, parser, abort, cancel))
+        error = None
         try:
-            print("AI prompt:", prompt, "\n")
-            # Escape the prompt to avoid special characters
-            prompt = prompt.replace('"', '\\"')
-            response = subprocess.run(["tgpt", "-q", "--provider", "pollinations", prompt], stdout=subprocess.PIPE, check=True, text=True).stdout.strip()
-            print("AI response:", response, "\n")
-            return response
-        except subprocess.CalledProcessError as e:
-            if try_count > 3:
-                raise CodeGenerationException(f"AI prompt failed too many times. {e.stderr}")
-            return self.prompt_ai(prompt, try_count + 1)
-
-
-
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        return future.result()
+                    except CodeGenerationException as e:
+                        error = e
+            raise error
+        finally:
+            # Stop the slower request
+            cancel.set()
+
+    def complete_on(self, provider, prompt, parser=None, abort=True, cancel=None):
+        breaker = get_circuit_breaker(config.backend, provider)
+        if not breaker.allow():
+            raise BackendException(f"Provider {provider} is not used for now, it has been failing")
+        try:
+            response = self.complete(prompt, parser, abort, provider, cancel)
+        except BackendException:
+            if cancel is not None and cancel.is_set():
+                breaker.record_cancelled()
+            else:
+                breaker.record_failure()
+            raise
+        except InvalidResponseException:
+            # The provider works, the response just was not usable
+            breaker.record_success()
+            raise
+        breaker.record_success()
+        return response
+
+    def complete(self, prompt, parser=None, abort=True, provider=None, cancel=None):
+        """
+        Send prompt to config.backend, or to config.fallback_backend if that fails.
+        Returns (response, backend, provider), the backend being the one that answered.
+        """
+        provider = provider or config.provider
+        try:
+            return self.read_response(get_backend(), prompt, parser, abort, provider, cancel), config.backend, provider
+        except BackendException as e:
+            if not config.fallback_backend or config.fallback_backend == config.backend:
+                raise
+            logger.warning("Backend %s failed, falling back to %s: %s", config.backend, config.fallback_backend, e)
+            response = self.read_response(get_backend(config.fallback_backend), prompt, parser, abort, provider, cancel)
+            return response, config.fallback_backend, provider
+
+    def read_response(self, backend, prompt, parser=None, abort=True, provider=None, cancel=None):
+        provider = provider or config.provider
+        if get_event_loop() is not None:
+            # Async generations read the response on their event loop
+            return run_on_loop(self.aread_response(backend, prompt, parser, abort, provider, cancel))
+        if parser is None or not config.streaming:
+            return backend.complete(prompt, provider)
+        parser = parser(abort)
+        stream = backend.stream(prompt, provider)
+        try:
+            for chunk in stream:
+                # cancel is set when a hedged request to another provider answered first
+                if parser.feed(chunk) or (cancel is not None and cancel.is_set()):
+                    break
+        finally:
+            # Stops the response if it was not read to the end
+            stream.close()
+        return parser.result()
+
+    async def aread_response(self, backend, prompt, parser=None, abort=True, provider=None, cancel=None):
+        """
+        read_response() on an event loop, with the async methods of the backend.
+        """
+        if parser is None or not config.streaming:
+            return await backend.acomplete(prompt, provider)
+        parser = parser(abort)
+        stream = backend.astream(prompt, provider)
+        try:
+            async for chunk in stream:
+                if parser.feed(chunk) or (cancel is not None and cancel.is_set()):
+                    break
+        finally:
+            await stream.aclose()
+        return parser.result()
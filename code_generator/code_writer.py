@@ -1,18 +1,57 @@
+import os
 import inspect
+import logging
+import tempfile
+import threading
+import contextlib
 import subprocess
+from collections import OrderedDict
+from . import config
 from .code_generator import CodeGenerator
+from .file_writer import Patch, get_file_writer
+from .instrumentation import get_instrumentation, phase
+from .placement import SourceEdits, insert_into_class, replace_member, merge_imports, member_name, is_import_block
 from .exceptions import CodeWriterException
 
+logger = logging.getLogger(__name__)
+
+class GitBatch:
+    """
+    Files and commit messages waiting to be committed together by CodeWriter.git_batch.
+    """
+    def __init__(self):
+        self.files = OrderedDict()
+        self.messages = []
+
+    def add(self, path, content, message):
+        self.files[os.path.realpath(path)] = content
+        self.messages.append(message)
+
+
+_git_batch = None
+_git_batch_lock = threading.Lock()
+_git_commit_lock = threading.Lock()
+
+
+def find_anchor(lines, anchor):
+    """
+    The line number of an anchor from CodeWriter.anchor_code() in lines, or None if it is not there.
+    """
+    text, occurrence = anchor
+    matches = [i for i, line in enumerate(lines) if line == text]
+    if occurrence < len(matches):
+        return matches[occurrence] + 1
+    return None
+
+
 class CodeWriter(CodeGenerator):
-    def insert_code(self, cls=None, main_source=None, code="") -> str:
+    def insert_code(self, cls=None, main_source=None, code="", class_name=None, anchor=None) -> str:
         # Validate inputs
         if cls and main_source:
             raise ValueError("Cannot specify both cls and main_source")
         if cls:
             # Get the class source
-            class_file = inspect.getsourcefile(cls)
-            with open(class_file) as f:
-                class_source = f.read()
+            class_source = self.read_source(inspect.getsourcefile(cls))
         elif main_source:
             class_source = main_source
         else:
@@ -22,20 +61,45 @@ class CodeWriter(CodeGenerator):
             # No code to insert; Nothing to do
             return class_source
 
+        if config.placement == "ast":
+            try:
+                return self.place_code(class_source, code, cls.__qualname__ if cls else class_name)
+            except CodeWriterException as e:
+                logger.info("AST placement failed, asking the AI instead: %s", e)
+
+        lines = class_source.split("\n")
+        # An anchor from anchor_code() saves asking the AI again, if its line is still there
+        line_number = find_anchor(lines, anchor) if anchor is not None else None
+        if line_number is None:
+            line_number = self.ask_line_number(class_source, code, cls.__name__ if cls else None)
+        return self.insert_at_line(lines, line_number, code)
+
+    def anchor_code(self, class_source, code, class_name=None):
+        """
+        Ask the AI where code goes in class_source, ahead of writing it. Returns an anchor for
+        insert_code(): the text of the line the code goes after and how many identical lines
+        come before it, so the code can still be placed if lines were added elsewhere since.
+        """
+        line_number = self.ask_line_number(class_source, code, class_name)
+        lines = class_source.split("\n")
+        text = lines[line_number - 1]
+        return text, lines[:line_number - 1].count(text)
+
+    def ask_line_number(self, class_source, code, class_name=None) -> int:
         # Add line numbers to the class source
         lines = class_source.split("\n")
         class_source = "Class source:\n"
         for i, line in enumerate(lines):
             class_source += f"{i + 1}: {line}\n"
 
-        prompt = f"Where in the {'class ' + cls.__name__ if cls else 'above source code'} should the following code be inserted?\n"
+        prompt = f"Where in the {'class ' + class_name if class_name else 'above source code'} should the following code be inserted?\n"
         prompt += f"Code to insert:\n{code}\n\n"
         prompt += "Please choose a line number from the class source above.\n"
         prompt += "Return the line number as a string.\n"
         prompt += "The line number must be between 1 and the number of lines in the class source and it must be a whole number.\n"
         prompt += "The code will be inserted in the class source immediately before the code at that line number.\n"
 
-        line_number = self.generate_info(prompt, class_source)
+        line_number = self.generate_info(prompt, class_source, first_line=True)
 
         try:
             line_number = int(line_number)
@@ -44,7 +108,9 @@ class CodeWriter(CodeGenerator):
 
         if not (1 <= line_number <= len(lines)):
             raise CodeWriterException(f"Invalid line number: {line_number}")
+        return line_number
 
+    def insert_at_line(self, lines, line_number, code) -> str:
         # Add AI watermark
         code = code.strip()
         code = f"""## AI GENERATED CODE; PLEASE REVIEW ##
@@ -64,15 +130,29 @@ class CodeWriter(CodeGenerator):
         new_class_source = "\n".join(new_lines)
         return new_class_source
 
-    def replace_code(self, cls=None, main_source=None, old_code="", new_code="") -> str:
+    def place_code(self, class_source, code, qualname=None) -> str:
+        """
+        Place code without asking the AI: imports are merged into the module import block,
+        anything else is inserted into the body of the class qualname.
+        """
+        if is_import_block(code):
+            return merge_imports(class_source, code)
+        if qualname is None:
+            raise CodeWriterException("No class to insert the code into")
+        return insert_into_class(class_source, qualname, code)
+
+    def replace_code(self, cls=None, main_source=None, old_code="", new_code="", class_name=None) -> str:
+        """
+        Replace the member of the class (cls, or class_name in main_source) that old_code defines with new_code.
+        The member is found in the parsed class by name rather than by its text, so it is replaced even if it
+        was edited since old_code was read, and the same text elsewhere in the file is left alone.
+        """
         if cls and main_source:
             raise ValueError("Cannot specify both cls and main_source")
 
         if cls:
             # Get the class source
-            class_file = inspect.getsourcefile(cls)
-            with open(class_file) as f:
-                class_source = f.read()
+            class_source = self.read_source(inspect.getsourcefile(cls))
         elif main_source:
             class_source = main_source
         else:
@@ -83,50 +163,241 @@ class CodeWriter(CodeGenerator):
             return class_source
 
         if not old_code.strip():
-            return self.insert_code(cls=cls, main_source=main_source, code=new_code)
-
-        # Indent the new code
-        new_code = new_code.replace("\n", "\n    ")
-
-        replacement_str = f"""
-## AI MODIFIED CODE; PLEASE REVIEW ##
-{new_code}
-## END OF AI MODIFIED CODE ##
+            return self.insert_code(cls=cls, main_source=main_source, code=new_code, class_name=class_name)
 
-## ORIGINAL CODE; REMOVE WHEN REVIEWED ##
-\"\"\"
-{old_code}
-\"\"\"
-## END OF ORIGINAL CODE ##
-"""
+        qualname = cls.__qualname__ if cls else class_name
+        if qualname is None:
+            raise ValueError("Must specify either cls or class_name")
+        name = member_name(old_code)
+        if name is None:
+            raise CodeWriterException(f"Cannot tell which member of {qualname} the old code defines")
+        return replace_member(class_source, qualname, new_code, name)
 
-        new_class_source = class_source.replace(old_code, replacement_str)
+    def apply_patches(self, source, patches) -> str:
+        """
+        Apply patches (file_writer.Patch) to source and return the result.
+        With AST placement the source is parsed once and every patch is placed against that parse;
+        a patch that cannot be placed that way is applied on its own afterwards, which may ask the AI.
+        The error of a patch that could not be applied at all is set on it.
+        """
+        remaining = patches
+        if config.placement == "ast":
+            try:
+                edits = SourceEdits(source)
+            except CodeWriterException:
+                edits = None
+            if edits is not None:
+                remaining = []
+                for patch in patches:
+                    try:
+                        patch.plan(edits)
+                    except CodeWriterException as e:
+                        logger.info("AST placement failed, placing the patch on its own: %s", e)
+                        remaining.append(patch)
+                source = edits.apply()
+        for patch in remaining:
+            try:
+                source = patch.apply(source, self)
+            except CodeWriterException as e:
+                patch.error = e
+        return source
 
-        return new_class_source
+    def read_source(self, class_file) -> str:
+        # Without auto_merge the generated code only lives on config.git_branch, so build on top of that
+        if config.git_branch and not config.auto_merge:
+            source = self.branch_source(class_file)
+            if source is not None:
+                return source
+        with open(class_file) as f:
+            return f.read()
 
+    def branch_source(self, class_file):
+        """
+        The content of class_file that the next commit to config.git_branch builds on: what an open
+        git_batch() holds for it, else its blob on the branch, else its blob in HEAD (the branch starts
+        from HEAD). None if git does not have the file.
+        """
+        with _git_batch_lock:
+            if _git_batch is not None and os.path.realpath(class_file) in _git_batch.files:
+                return _git_batch.files[os.path.realpath(class_file)]
+        for branch in (config.git_branch, None):
+            try:
+                return self.git_show_file(class_file, branch)
+            except CodeWriterException:
+                pass
+        return None
 
     def commit_changes(self, cls, class_source, commit_message):
         class_file = inspect.getsourcefile(cls)
+        with get_file_writer().locked(os.path.realpath(class_file)):
+            self.commit_source(class_file, class_source, commit_message)
+
+    def apply_changes(self, class_file, patches):
+        """
+        Apply patches (file_writer.Patch) to the current source of class_file and write and commit it once,
+        together with any patches other threads queued for the same file in the meantime.
+        """
+        return get_file_writer().flush(class_file, self, patches)
+
+    def commit_source(self, class_file, class_source, commit_message, patches=None):
+        """
+        Store class_source, the patched source of class_file: with auto_merge (or without git_branch)
+        it is written to the working tree, and with git_branch it is committed to that branch.
+        With auto_merge class_source was built on the working tree file, which may hold edits the
+        user has not committed; so if the patches that made it are given, the branch commit applies
+        them again to the branch's own version of the file instead.
+        """
+        if config.auto_merge or not config.git_branch:
+            # Write to the class source file
+            get_file_writer().write(class_file, class_source)
+
+        if config.git_branch:
+            if config.auto_merge and patches:
+                class_source = self._patch_branch_source(class_file, class_source, patches)
+                if class_source is None:
+                    return
+            self.git_commit_changes(class_file, class_source, commit_message)
+
+    def _patch_branch_source(self, class_file, class_source, patches):
+        base = self.branch_source(class_file)
+        if base is None:
+            # Not tracked yet, so there is nothing to keep apart from the working tree
+            return class_source
+        copies = [Patch(patch.qualname, patch.code, old_code=patch.old_code, message=patch.message, imports=patch.imports, anchor=patch.anchor) for patch in patches]
+        source = self.apply_patches(base, copies)
+        for patch in copies:
+            if patch.error is not None:
+                logger.warning("Could not apply a patch of %s to branch %s: %s", patch.qualname, config.git_branch, patch.error)
+        if not any(patch.error is None for patch in copies):
+            return None
+        return source
+
+    def git_commit_changes(self, class_file, class_source, commit_message):
+        # Inside git_batch() the commit is made when the batch ends
+        with _git_batch_lock:
+            batch = _git_batch
+            if batch is not None:
+                batch.add(class_file, class_source, commit_message)
+                return
+        try:
+            self.git_commit_files({class_file: class_source}, commit_message)
+        except CodeWriterException as e:
+            logger.warning("Could not commit to branch %s: %s", config.git_branch, e)
+
+    @contextlib.contextmanager
+    def git_batch(self):
+        """
+        Collect the branch commits of every commit_changes call made inside the block
+        (from any thread) into a single commit.
+        """
+        global _git_batch
+        with _git_batch_lock:
+            if _git_batch is not None:
+                # Nested batches join the outer one
+                outer = _git_batch
+            else:
+                outer = None
+                _git_batch = GitBatch()
+        if outer is not None:
+            yield outer
+            return
+        try:
+            yield _git_batch
+        finally:
+            with _git_batch_lock:
+                batch = _git_batch
+                _git_batch = None
+            if batch.files:
+                try:
+                    self.git_commit_files(batch.files, "\n\n".join(batch.messages))
+                except CodeWriterException as e:
+                    logger.warning("Could not commit to branch %s: %s", config.git_branch, e)
+
+    def git_commit_files(self, files, message, branch=None):
+        """
+        Commit files ({path: content}) to branch without touching the working tree, the index or HEAD.
+        Blobs are written with hash-object and staged in a temporary index read from the branch head
+        (or HEAD if the branch does not exist yet), then committed with commit-tree and update-ref.
+        """
+        branch = branch or config.git_branch
+        by_repo = {}
+        for path, content in files.items():
+            path = os.path.realpath(path)
+            repo = self.git_toplevel(os.path.dirname(path))
+            by_repo.setdefault(repo, {})[os.path.relpath(path, repo).replace(os.sep, "/")] = content
+        commits = []
+        with phase("git", files=len(files)) as event:
+            event.bytes_in = sum(len(content) for content in files.values())
+            for repo, repo_files in by_repo.items():
+                commits.append(self._git_commit_tree(repo, repo_files, message, f"refs/heads/{branch}"))
+        return commits
+
+    def _git_commit_tree(self, repo, files, message, ref):
+        with _git_commit_lock, tempfile.TemporaryDirectory(prefix="code_generator_") as tmp:
+            env = dict(os.environ, GIT_INDEX_FILE=os.path.join(tmp, "index"))
+            # Another process may move the branch while we build the commit; update-ref then fails and we retry
+            for attempt in range(3):
+                old_commit = self.git_rev_parse(repo, ref)
+                parent = old_commit or self.git_rev_parse(repo, "HEAD")
+                if parent:
+                    self.shell(["git", "read-tree", parent], cwd=repo, env=env)
+                for rel_path, content in files.items():
+                    sha = self.shell(["git", "hash-object", "-w", "--stdin", "--path", rel_path], cwd=repo, input=content)
+                    # Keep the mode of files that are already tracked, e.g. executables
+                    staged = self.shell(["git", "ls-files", "-s", "--", rel_path], cwd=repo, env=env)
+                    mode = staged.split()[0] if staged else "100644"
+                    self.shell(["git", "update-index", "--add", "--cacheinfo", f"{mode},{sha},{rel_path}"], cwd=repo, env=env)
+                tree = self.shell(["git", "write-tree"], cwd=repo, env=env)
+                if parent and tree == self.git_rev_parse(repo, f"{parent}^{{tree}}"):
+                    # Nothing changed
+                    return parent
+                command = ["git", "commit-tree", tree, "-m", message]
+                if parent:
+                    command[3:3] = ["-p", parent]
+                commit = self.shell(command, cwd=repo, env=env)
+                try:
+                    self.shell(["git", "update-ref", "-m", "code_generator: commit", ref, commit, old_commit or "0" * 40], cwd=repo)
+                except CodeWriterException:
+                    if attempt == 2:
+                        raise
+                    event = get_instrumentation().current()
+                    if event is not None:
+                        event.retries += 1
+                    continue
+                logger.info("Committed %s to %s as %s", ", ".join(files), ref, commit[:10])
+                return commit
+
+    def git_toplevel(self, directory):
+        return self.shell(["git", "rev-parse", "--show-toplevel"], cwd=directory)
+
+    def git_rev_parse(self, repo, revision):
+        try:
+            return self.shell(["git", "rev-parse", "--verify", "--quiet", revision], cwd=repo)
+        except CodeWriterException:
+            return None
 
-        # Write to the class source file
-        # Simpler than using git for now :)-
-        with open(class_file, "w") as f:
-            f.write(class_source)
+    def git_show_file(self, path, branch):
+        # branch=None shows the file in HEAD
+        path = os.path.realpath(path)
+        repo = self.git_toplevel(os.path.dirname(path))
+        rel_path = os.path.relpath(path, repo).replace(os.sep, "/")
+        revision = f"refs/heads/{branch}" if branch else "HEAD"
+        return self.shell(["git", "show", f"{revision}:{rel_path}"], cwd=repo, strip=False)
 
     def git_stash(self):
-        print("Stashing changes...")
+        logger.debug("Stashing changes...")
         self.shell(["git", "stash"])
 
     def git_stash_pop(self):
-        print("Popping changes...")
+        logger.debug("Popping changes...")
         self.shell(["git", "stash", "pop"])
 
     def git_current_branch(self):
-        print("Getting current branch...")
+        logger.debug("Getting current branch...")
         return self.shell(["git", "branch", "--show-current"])
 
     def git_switch(self, branch_name):
-        print(f"Switching to branch {branch_name}...")
+        logger.debug("Switching to branch %s...", branch_name)
         try:
             subprocess.run(["git", "switch", branch_name], check=True)
         except subprocess.CalledProcessError as e:
@@ -137,26 +408,28 @@ class CodeWriter(CodeGenerator):
                 raise CodeWriterException(f"Error switching to branch {branch_name}: {e.stderr}")
 
     def git_add(self, filename):
-        print(f"Adding {filename} to git...")
+        logger.debug("Adding %s to git...", filename)
         self.shell(["git", "add", filename])
 
     def git_status(self):
-        print("Getting git status...")
+        logger.debug("Getting git status...")
         return self.shell(["git", "status"])
 
     def git_commit(self, message):
-        print("Committing changes...")
+        logger.debug("Committing changes...")
         self.shell(["git", "commit", "-m", message])
 
     def git_merge(self, branch):
-        print(f"Merging branch {branch}...")
+        logger.debug("Merging branch %s...", branch)
         self.shell(["git", "merge", branch])
 
-    def shell(self, command):
-        print(f"Running shell command: {' '.join(command)}")
+    def shell(self, command, cwd=None, env=None, input=None, strip=True):
+        logger.debug("Running shell command: %s", " ".join(command))
         try:
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True)
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True, cwd=cwd, env=env, input=input)
+        except FileNotFoundError as e:
+            raise CodeWriterException(f"Error running shell command: {e}")
         except subprocess.CalledProcessError as e:
             raise CodeWriterException(f"Error running shell command: {e.stderr}")
         else:
-            return result.stdout.strip()
+            return result.stdout.strip() if strip else result.stdout
@@ -1,6 +1,9 @@
 git_branch = 'ai-assistant'
 """
 The git branch to commit AI-generated code to.
+Commits are made with git plumbing commands, so the working tree, the
+index and the checked out branch are never touched. The branch is created
+from HEAD if it does not exist. None to not commit at all.
 Default: "ai-assistant"
 """
 
@@ -18,8 +21,301 @@ Possible values:
     This is the default value.
 """
 
+hot_install = True
+"""
+Whether generated members are also set on the class in memory right after they are written,
+so the rest of the program uses them without reloading the module and without asking the AI again.
+With after_generation = "continue" the current call then returns through the generated code.
+Default: True
+"""
+
 auto_merge = True
 """
-Whether to automatically merge AI-generated code into the main branch.
+Whether to also write AI-generated code to the working tree.
+Generated code is committed to git_branch (when it is set) without touching
+the working tree, the index or HEAD; the commit builds on the branch's own
+version of each file, so uncommitted edits in the working tree never end
+up on the branch. If True, the generated code is also written to the
+source files in the working tree, so it can be used right away. If False,
+it only lives on git_branch, and later generations build on the version
+of the file on that branch. Without git_branch the code is always written
+to the working tree.
+Default: True
+"""
+
+backend = "http"
+"""
+The backend that prompts are sent to.
+Possible values:
+    "http" - Long-lived HTTP client with keep-alive connection pooling.
+        The endpoint is taken from http_providers.
+    "tgpt" - Run the tgpt CLI once per prompt.
+    "stub" - Local stub server, for running without network access.
+Other backends can be added with backends.register_backend.
+Default: "http"
+"""
+
+fallback_backend = "tgpt"
+"""
+The backend to use when the main backend fails. None to disable.
+Default: "tgpt"
+"""
+
+provider = "pollinations"
+"""
+The AI provider to use.
+Default: "pollinations"
+"""
+
+providers = None
+"""
+Providers to fail over to, in order of preference, when a provider keeps failing
+or its circuit breaker is open. Hedged requests go to the second available one.
+Default: None, which means only provider
+"""
+
+retry_attempts = 5
+"""
+Number of times a prompt is sent before giving up when the backend fails.
+Default: 5
+"""
+
+retry_backoff = 0.5
+"""
+Base delay in seconds before a retry. The delay doubles with every retry,
+up to retry_backoff_max, and a random part of it is used (full jitter).
+Default: 0.5
+"""
+
+retry_backoff_max = 30
+"""
+Maximum delay in seconds before a retry.
+Default: 30
+"""
+
+circuit_failure_threshold = 5
+"""
+Number of failures in a row after which a provider is not used for circuit_reset_timeout seconds.
+Default: 5
+"""
+
+circuit_reset_timeout = 60
+"""
+Number of seconds a provider is skipped after its circuit breaker opened.
+After that a single request is let through to test it.
+Default: 60
+"""
+
+hedge_after = None
+"""
+If a response took longer than this many seconds, the same prompt is also sent
+to the next provider in providers and the first valid answer is used.
+Default: None, which means no hedged requests
+"""
+
+http_providers = {
+    "pollinations": "https://text.pollinations.ai/",
+}
+"""
+Endpoint URL of each provider for the "http" backend.
+"""
+
+http_pool_size = 4
+"""
+Maximum number of idle keep-alive connections kept per host by the "http" backend.
+Default: 4
+"""
+
+http_timeout = 120
+"""
+Timeout in seconds of a single HTTP request.
+Default: 120
+"""
+
+streaming = True
+"""
+Whether to read responses as they are streamed by the backend.
+Responses are then checked while they arrive: code that clearly is not Python
+(e.g. text before the code) is stopped and asked for again, and one-line
+answers stop after their first line.
+Default: True
+"""
+
+stream_retries = 2
+"""
+How many times a response that was stopped early because it was invalid is asked for again.
+The last attempt is always read to the end and used as it is.
+Default: 2
+"""
+
+cache_enabled = True
+"""
+Whether to cache AI responses on disk. A prompt that was already answered
+by the same backend and provider is then answered from the cache.
+Default: True
+"""
+
+cache_path = None
+"""
+Path of the response cache database.
+Default: None, which means $XDG_CACHE_HOME/code_generator/responses.sqlite3
+"""
+
+cache_max_bytes = 64 * 1024 * 1024
+"""
+Maximum total size of the cached responses in bytes. The least recently
+used responses are evicted first. None for no limit.
+Default: 64 MiB
+"""
+
+cache_max_entries = 10000
+"""
+Maximum number of cached responses. None for no limit.
+Default: 10000
+"""
+
+cache_ttl = 7 * 24 * 60 * 60
+"""
+Number of seconds a cached response stays valid. None to never expire.
+Default: one week
+"""
+
+max_workers = 8
+"""
+Number of threads used to run independent generation stages concurrently.
+Default: 8
+"""
+
+generation_mode = "staged"
+"""
+How the code, imports and commit message are requested from the AI.
+Possible values:
+    "staged" - One model call for each of them.
+    "structured" - A single model call that returns all of them in one
+        structured response. A part that cannot be parsed from the
+        response is requested with its own model call instead.
+Default: "staged"
+"""
+
+modify_mode = "patch"
+"""
+How an existing method that has to set a missing attribute is modified
+(in "staged" generation mode).
+Possible values:
+    "patch" - The AI returns a unified diff against the numbered source of
+        the method, which is applied and checked locally. If it does not
+        apply, the whole method is requested as with "full".
+    "full" - The AI returns the whole modified method.
+Default: "patch"
+"""
+
+placement = "ast"
+"""
+How CodeWriter decides where generated code goes.
+Possible values:
+    "ast" - Find the class with the ast module and append methods and
+        class attributes to its body. Imports are merged into the module
+        import block. Falls back to "ai" if the source cannot be parsed.
+    "ai" - Ask the AI for a line number.
+Default: "ast"
+"""
+
+context_budget = 24000
+"""
+Maximum size in characters of the code context sent with a prompt
+(about 4 characters per token). The most relevant context is kept:
+the class itself, its closest parents, the code around the call and
+the stack trace, the code found by retrieval, then other related
+classes. None for no limit.
+Default: 24000
+"""
+
+retrieval_enabled = True
+"""
+Whether to search the project for the code most relevant to the
+missing name and its call site, and send it with the prompt instead of
+the other classes of the hierarchy. The functions and classes of the
+project (see retrieval_root) are kept in an on-disk BM25 index that is
+updated in the background as files change.
 Default: True
 """
+
+retrieval_root = None
+"""
+Directory of the project whose code is searched by retrieval.
+Default: None, which means the git work tree of the module of the class,
+or without one, the directory the module is imported from. Retrieval is
+skipped if that is the home directory, a filesystem root or a directory
+of installed packages.
+"""
+
+retrieval_top_k = 5
+"""
+Number of functions and classes found by retrieval to add to the code context.
+Default: 5
+"""
+
+retrieval_path = None
+"""
+Directory of the retrieval index databases, one per project.
+Default: None, which means $XDG_CACHE_HOME/code_generator/retrieval
+"""
+
+retrieval_refresh = 10
+"""
+Seconds during which the retrieval index is not checked again for
+changed files after it was brought up to date.
+Default: 10
+"""
+
+retrieval_max_files = 5000
+"""
+Maximum number of source files in the retrieval index of a project.
+Default: 5000
+"""
+
+record_mode = False
+"""
+Whether to only record missing attributes instead of generating them right away.
+Accessing a missing attribute then raises AttributeError, and
+recorder.flush() generates everything that was recorded with one
+model request per class and one file write per source file.
+Default: False
+"""
+
+background_generation = False
+"""
+Whether to generate missing attributes on a background worker pool.
+Using a missing attribute then raises GenerationPendingException (an
+AttributeError) right away instead of waiting for the generation, so
+after_generation = "continue" does not apply.
+Default: False
+"""
+
+background_workers = 2
+"""
+Number of background generations that run at the same time.
+Default: 2
+"""
+
+background_queue_size = 32
+"""
+Number of background generations that may wait for a worker. Beyond
+that, new generations are rejected rather than blocking the caller.
+Default: 32
+"""
+
+async_max_generations = 4
+"""
+Maximum number of generations of AsyncGenerativeBase members in flight at
+the same time on an event loop. Further ones wait for a slot without
+blocking the loop.
+Default: 4
+"""
+
+lock_dir = None
+"""
+Directory of the lock files that keep processes from generating the
+same attribute at the same time.
+Default: None, which means code_generator_locks in the temp directory
+"""
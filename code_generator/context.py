@@ -0,0 +1,85 @@
+from . import config
+
+# Rough size of a token, used to report prompt sizes in tokens
+CHARS_PER_TOKEN = 4
+
+# Pieces are not truncated below this size; they are left out instead
+MIN_TRUNCATED_CHARS = 200
+
+
+class ContextBuilder:
+    """
+    Assembles the code context of a prompt within a character budget.
+    Each piece has a priority (lower is more relevant) and one or more variants, from most to
+    least detailed. Pieces are filled in by priority using the most detailed variant that still
+    fits; the least detailed one is truncated if none fit, and the piece is left out if not even
+    that fits. Variants may be callables so they are only rendered when they are considered.
+    Sections are rendered in the order they were first added to, whatever the priorities.
+    """
+    def __init__(self, budget=None):
+        self.budget = config.context_budget if budget is None else budget
+        self.sections = {}
+        self.pieces = []
+        self.size = 0
+        self.elided = 0
+        self.omitted = 0
+
+    def add(self, section, priority, *variants):
+        self.sections.setdefault(section, [])
+        piece = (priority, len(self.pieces), section, variants)
+        self.pieces.append(piece)
+        self.sections[section].append(piece)
+        return self
+
+    @property
+    def tokens(self):
+        return self.size // CHARS_PER_TOKEN
+
+    def build(self) -> str:
+        self.elided = 0
+        self.omitted = 0
+        remaining = None
+        if self.budget:
+            # Section headers are always rendered, and room is kept for the line that counts left out pieces
+            remaining = self.budget - sum(len(section) + 4 for section in self.sections) - len(self._omitted_line(len(self.pieces)))
+        chosen = {}
+        for piece in sorted(self.pieces, key=lambda piece: piece[:2]):
+            text = self._fit(piece[3], remaining)
+            if text is None:
+                self.omitted += 1
+                continue
+            chosen[piece] = text
+            if remaining is not None:
+                remaining -= len(text)
+
+        context = ""
+        for section, pieces in self.sections.items():
+            texts = [chosen[piece] for piece in pieces if piece in chosen]
+            context += f"{section}:\n {''.join(texts)}\n"
+        if self.omitted:
+            context += self._omitted_line(self.omitted)
+        self.size = len(context)
+        return context
+
+    @staticmethod
+    def _omitted_line(omitted):
+        return f"({omitted} less relevant pieces of context were left out)\n"
+
+    def _fit(self, variants, remaining):
+        text = ""
+        for i, variant in enumerate(variants):
+            text = variant() if callable(variant) else variant
+            if remaining is None or len(text) <= remaining:
+                if i:
+                    self.elided += 1
+                return text
+        if remaining is None or remaining < MIN_TRUNCATED_CHARS:
+            return None
+        self.elided += 1
+        marker = "\n... (truncated)\n"
+        cut = remaining - len(marker)
+        # Cut at a line boundary if there is one
+        line_end = text.rfind("\n", 0, cut)
+        if line_end > 0:
+            cut = line_end
+        return text[:cut] + marker
@@ -3,3 +3,21 @@ class CodeGenerationException(Exception):
 
 class CodeWriterException(Exception):
     pass
+
+class BackendException(CodeGenerationException):
+    pass
+
+class InvalidResponseException(CodeGenerationException):
+    """
+    Raised while a streamed response is read, as soon as it clearly is not what was asked for.
+    """
+    pass
+
+class GenerationPendingException(AttributeError):
+    """
+    Raised instead of waiting when a missing attribute is generated in the background.
+    future is the concurrent.futures.Future of the generation, or None if the queue was full.
+    """
+    def __init__(self, message, future=None):
+        super().__init__(message)
+        self.future = future
@@ -0,0 +1,323 @@
+import os
+import ast
+import json
+import stat
+import logging
+import textwrap
+import hashlib
+import tempfile
+import threading
+import contextlib
+from .exceptions import CodeWriterException
+from .instrumentation import phase
+from .placement import member_name, is_import_block, import_statements
+from .singleflight import get_single_flight
+from .source_index import get_source_index
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = ".cgjournal"
+
+
+def _digest(content):
+    if content is None:
+        return None
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class Patch:
+    """
+    A pending edit of a source file, anchored to a class rather than to a line number:
+    code is inserted into the class qualname (imports are merged into the module imports),
+    or replaces old_code if that is given. Patches are applied to whatever the file holds
+    when the batch is written, so edits made since the code was generated are kept.
+    With imports=True code is the import statements the other patches need.
+    anchor is where the AI placed the code beforehand (CodeWriter.anchor_code), for AI placement.
+    error is set if the patch could not be applied.
+    """
+    __slots__ = ("qualname", "code", "old_code", "message", "imports", "anchor", "error")
+
+    def __init__(self, qualname, code, old_code="", message=None, imports=False, anchor=None):
+        self.qualname = qualname
+        self.code = code
+        self.old_code = old_code
+        self.message = message
+        self.imports = imports
+        self.anchor = anchor
+        self.error = None
+
+    def check(self):
+        """
+        Check the code before it is placed, so a bad patch fails on its own instead of failing the
+        whole batch when the patched file does not parse. What is not an import statement is left
+        out of an imports patch. Raises CodeWriterException if the code is not valid Python.
+        """
+        if self.imports:
+            if self.code.strip() and not is_import_block(self.code):
+                logger.warning("Leaving out what is not an import statement from the imports for %s: %r", self.qualname, self.code)
+                self.code = import_statements(self.code)
+            return
+        try:
+            ast.parse(textwrap.dedent(self.code))
+        except SyntaxError as e:
+            raise CodeWriterException(f"Code for {self.qualname} is not valid Python: {e}")
+
+    def apply(self, source, code_writer) -> str:
+        if self.old_code.strip():
+            return code_writer.replace_code(main_source=source, old_code=self.old_code, new_code=self.code, class_name=self.qualname)
+        return code_writer.insert_code(main_source=source, code=self.code, class_name=self.qualname, anchor=self.anchor)
+
+    def plan(self, edits):
+        """
+        Add the patch to edits (placement.SourceEdits) without asking the AI.
+        """
+        if not self.code.strip():
+            return
+        if self.old_code.strip():
+            name = member_name(self.old_code)
+            if name is None:
+                raise CodeWriterException(f"Cannot tell which member of {self.qualname} the old code defines")
+            edits.replace(self.qualname, self.code, name)
+        elif self.imports or is_import_block(self.code):
+            edits.merge_imports(self.code)
+        else:
+            edits.insert(self.qualname, self.code)
+
+
+class FileWriter:
+    """
+    Collects pending patches per file and writes each file once for all of them.
+    A flush takes the file's lock (threads and processes), applies every pending patch of
+    the file to its current source in one pass, checks that the result parses, and writes it
+    through a temp file, fsync and rename, so the file is never left half written.
+    Before the rename a journal with the old and the new content is written next to the file;
+    it is removed once the write is done. A journal that is left behind by an interrupted write
+    is replayed (or rolled back) the next time the file is written, or with recover().
+    """
+    def __init__(self):
+        self.pending = {}
+        self._lock = threading.Lock()
+        self._held = threading.local()
+        self._path_locks = {}
+        self.writes = 0
+        self.patches = 0
+
+    def add(self, path, patch):
+        path = os.path.realpath(path)
+        with self._lock:
+            self.pending.setdefault(path, []).append(patch)
+
+    def flush(self, path, code_writer, patches=()):
+        """
+        Queue patches for path and write every patch pending for it.
+        code_writer.read_source(path) gives the current source and code_writer.commit_source(path, source, message, patches)
+        stores the patched source; both run under the file lock. Returns the source that was written, or None
+        if another thread already wrote the patches. Raises the error of the first of patches that failed.
+        """
+        path = os.path.realpath(path)
+        for patch in patches:
+            self.add(path, patch)
+        source = None
+        with self.locked(path):
+            with self._lock:
+                batch = self.pending.pop(path, [])
+            if batch:
+                source = self._write_batch(path, batch, code_writer)
+        for patch in patches:
+            if patch.error is not None:
+                raise patch.error
+        return source
+
+    def _write_batch(self, path, batch, code_writer):
+        try:
+            source = self._read_source(path, code_writer)
+        except (OSError, CodeWriterException) as e:
+            for patch in batch:
+                patch.error = e
+            return None
+
+        for patch in batch:
+            try:
+                patch.check()
+            except CodeWriterException as e:
+                patch.error = e
+        batch = [patch for patch in batch if patch.error is None]
+
+        # One pass over the source for the whole batch
+        with phase("placement", path=path, patches=len(batch)) as event:
+            event.bytes_in = sum(len(patch.code) for patch in batch)
+            source = code_writer.apply_patches(source, batch)
+            event.bytes_out = len(source)
+        applied = [patch for patch in batch if patch.error is None]
+        if not applied:
+            return None
+
+        try:
+            ast.parse(source, filename=path)
+        except SyntaxError as e:
+            # Nothing is written, and a journal left by an interrupted write stays for recover()
+            error = CodeWriterException(f"Patched source of {path} does not parse, the batch was not written: {e}")
+            for patch in applied:
+                patch.error = error
+            return None
+
+        messages = []
+        for patch in applied:
+            if patch.message and patch.message not in messages:
+                messages.append(patch.message)
+        try:
+            code_writer.commit_source(path, source, "\n\n".join(messages), applied)
+        except (OSError, CodeWriterException) as e:
+            for patch in applied:
+                patch.error = e
+            return None
+        with self._lock:
+            self.patches += len(applied)
+        return source
+
+    def _read_source(self, path, code_writer):
+        journal = self._read_journal(path)
+        if journal is not None and journal["new"] is not None:
+            # A write of path was interrupted; build on what it was writing.
+            # The journal is replayed when the batch is written.
+            return journal["new"]
+        return code_writer.read_source(path)
+
+    def _read_journal(self, path):
+        try:
+            with open(self.journal_path(path)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write(self, path, content):
+        """
+        Replace the content of path atomically, keeping a journal until the new content is in place.
+        """
+        path = os.path.realpath(path)
+        with self.locked(path):
+            self.recover(path)
+            try:
+                with open(path) as f:
+                    original = f.read()
+            except FileNotFoundError:
+                original = None
+            if original == content:
+                return
+            with phase("write", path=path) as event:
+                event.bytes_out = len(content)
+                self._write_journaled(path, original, content)
+            with self._lock:
+                self.writes += 1
+        get_source_index().invalidate(path)
+
+    def _write_journaled(self, path, original, content):
+        journal_path = self.journal_path(path)
+        journal = {"path": path, "original": original, "new": content, "original_sha256": _digest(original), "new_sha256": _digest(content)}
+        self._atomic_write(journal_path, json.dumps(journal))
+        self._atomic_write(path, content)
+        os.remove(journal_path)
+
+    def recover(self, path, rollback=False):
+        """
+        Finish (or with rollback=True, undo) the write of path that a journal was left for.
+        Returns True if there was a journal. Raises CodeWriterException if the file was changed
+        by something else since, and leaves the journal for the conflict to be resolved by hand.
+        """
+        path = os.path.realpath(path)
+        journal_path = self.journal_path(path)
+        with self.locked(path):
+            try:
+                with open(journal_path) as f:
+                    journal = json.load(f)
+            except FileNotFoundError:
+                return False
+            except ValueError:
+                # Journals are renamed into place, so this one never got that far and the file was not touched
+                os.remove(journal_path)
+                return True
+
+            try:
+                with open(path) as f:
+                    current = _digest(f.read())
+            except FileNotFoundError:
+                current = None
+            target = "original" if rollback else "new"
+            if current not in (journal["original_sha256"], journal["new_sha256"]):
+                raise CodeWriterException(f"{path} was changed after an interrupted write; see {journal_path}")
+            if current != journal[f"{target}_sha256"]:
+                if journal[target] is None:
+                    os.remove(path)
+                else:
+                    self._atomic_write(path, journal[target])
+                get_source_index().invalidate(path)
+            os.remove(journal_path)
+            return True
+
+    @staticmethod
+    def journal_path(path):
+        directory, name = os.path.split(path)
+        return os.path.join(directory, f".{name}{JOURNAL_SUFFIX}")
+
+    @staticmethod
+    def journals(directory):
+        """
+        Paths of the files under directory that have an interrupted write.
+        """
+        paths = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.startswith(".") and name.endswith(JOURNAL_SUFFIX):
+                    paths.append(os.path.join(root, name[1:-len(JOURNAL_SUFFIX)]))
+        return paths
+
+    @staticmethod
+    def _atomic_write(path, content):
+        directory = os.path.dirname(path)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+            except FileNotFoundError:
+                pass
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            raise
+        # Make the rename itself durable
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    @contextlib.contextmanager
+    def locked(self, path):
+        # Re-entrant per thread: a second flock on the same file from this process would block
+        held = getattr(self._held, "paths", None)
+        if held is None:
+            held = self._held.paths = set()
+        if path in held:
+            yield
+            return
+        with self._lock:
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+        with path_lock, get_single_flight().file_lock(("file", path)):
+            held.add(path)
+            try:
+                yield
+            finally:
+                held.discard(path)
+
+
+_file_writer = FileWriter()
+
+
+def get_file_writer() -> FileWriter:
+    return _file_writer
@@ -1,8 +1,35 @@
-from .universal_attribute import UniversalAttribute
+import logging
+from . import config
+from .hierarchy import get_class_registry
+from .recorder import get_recorder
+from .snapshot import StackSnapshot
+from .universal_attribute import UniversalAttribute, AsyncUniversalAttribute
+
+logger = logging.getLogger(__name__)
 
 class GenerativeBase:
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Keep the class hierarchy index up to date for related-class lookups
+        get_class_registry().register(cls)
+
     def __getattr__(self, name):
-        print(f"GenerativeBase: __getattr__ called for {name}")
-        return UniversalAttribute(name, self)
+        logger.debug("GenerativeBase: __getattr__ called for %s", name)
+        if config.record_mode:
+            # Only log the miss; the recorder generates it later
+            get_recorder().record(self.__class__, name, StackSnapshot.capture())
+        return UniversalAttribute.for_owner(self, name)
 
 
+class AsyncGenerativeBase(GenerativeBase):
+    """
+    GenerativeBase for asyncio code. Missing members are awaited, as in
+    await obj.missing_method(...) or await obj.missing_attribute, and generated
+    without blocking the event loop.
+    """
+    def __getattr__(self, name):
+        logger.debug("AsyncGenerativeBase: __getattr__ called for %s", name)
+        if config.record_mode:
+            get_recorder().record(self.__class__, name, StackSnapshot.capture())
+        return AsyncUniversalAttribute.for_owner(self, name)
+
@@ -0,0 +1,80 @@
+import weakref
+import threading
+from collections import deque
+
+
+class ClassRegistry:
+    """
+    Parent/child adjacency of the GenerativeBase subclasses, maintained by GenerativeBase.__init_subclass__.
+    Classes are held weakly, so registering a class does not keep it alive.
+    """
+    def __init__(self):
+        # class -> list of weak references to its direct subclasses, in definition order
+        self._children = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def register(self, cls):
+        with self._lock:
+            if cls not in self._children:
+                self._children[cls] = []
+            for base in cls.__bases__:
+                if base is object:
+                    continue
+                if base not in self._children:
+                    self._children[base] = []
+                self._children[base].append(weakref.ref(cls))
+
+    def is_registered(self, cls):
+        return cls in self._children
+
+    def children(self, cls):
+        with self._lock:
+            refs = self._children.get(cls, ())
+            children = [ref() for ref in refs]
+            if None in children:
+                # Drop classes that were garbage collected
+                self._children[cls] = [ref for ref in refs if ref() is not None]
+        return [child for child in children if child is not None]
+
+    def parents(self, cls):
+        return [base for base in cls.__bases__ if base is not object]
+
+    def descendants(self, cls, excluded_classes=(), seen=None):
+        """
+        All subclasses of cls, closest generation first.
+        Excluded classes are left out of the result but their subclasses are still visited.
+        """
+        seen = set() if seen is None else seen
+        descendants = []
+        queue = deque(self.children(cls))
+        while queue:
+            subclass = queue.popleft()
+            if subclass in seen:
+                continue
+            seen.add(subclass)
+            if subclass not in excluded_classes:
+                descendants.append(subclass)
+            queue.extend(self.children(subclass))
+        return descendants
+
+    def related_classes(self, ancestors, excluded_classes=()):
+        """
+        The ancestors and their descendants (siblings, cousins, etc), closest ancestor first.
+        Runs in time proportional to the classes visited, not to the size of the hierarchy.
+        """
+        seen = set()
+        related = []
+        for ancestor in ancestors:
+            if ancestor not in seen:
+                seen.add(ancestor)
+                if ancestor not in excluded_classes:
+                    related.append(ancestor)
+            related.extend(self.descendants(ancestor, excluded_classes, seen))
+        return related
+
+
+_class_registry = ClassRegistry()
+
+
+def get_class_registry() -> ClassRegistry:
+    return _class_registry
@@ -0,0 +1,93 @@
+import sys
+import types
+import weakref
+import linecache
+import textwrap
+import itertools
+from .exceptions import CodeGenerationException
+
+_counter = itertools.count()
+
+
+class _ClassBody:
+    """
+    Metaclass for running generated code as a class body of cls: the body sees the attributes
+    cls already has, like the names defined before it in the class statement, and its functions
+    get cls in their __class__ cell. Calling it returns the namespace instead of a class.
+    """
+    def __init__(self, cls):
+        self.cls = cls
+
+    def __prepare__(self, name, bases):
+        return dict(vars(self.cls))
+
+    def __call__(self, name, bases, namespace):
+        cell = namespace.pop("__classcell__", None)
+        if cell is not None:
+            cell.cell_contents = self.cls
+        return namespace
+
+
+def install_code(cls, code, imports=""):
+    """
+    Compile generated code in the module of cls and set the members it defines on cls,
+    so they can be used right away without reloading the module.
+    The imports are run in the module first, then the code runs as a class body, so
+    class attributes can refer to the other attributes of cls and super() without
+    arguments works in methods. Returns the names that were set.
+    Raises CodeGenerationException if the code cannot be compiled or run.
+    """
+    module = sys.modules.get(cls.__module__)
+    if module is None:
+        raise CodeGenerationException(f"Module {cls.__module__} of class {cls.__qualname__} is not loaded")
+    module_globals = module.__dict__
+
+    body = textwrap.indent(textwrap.dedent(code).strip() or "pass", "    ")
+    source = f"class {cls.__name__}(metaclass=__class_body__):\n{body}\n"
+    filename = f"<generated {cls.__qualname__} {next(_counter)}>"
+    # Registered with linecache so inspect.getsource and tracebacks can show the code,
+    # for as long as a function compiled from it is alive
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    try:
+        if imports and imports.strip():
+            exec(compile(textwrap.dedent(imports), filename, "exec"), module_globals)
+        scope = {"__class_body__": _ClassBody(cls)}
+        exec(compile(source, filename, "exec"), module_globals, scope)
+    except Exception as e:
+        linecache.cache.pop(filename, None)
+        raise CodeGenerationException(f"Generated code for {cls.__qualname__} could not be installed: {e!r}")
+
+    original = vars(cls)
+    members = {name: value for name, value in scope[cls.__name__].items()
+               if name not in ("__module__", "__qualname__") and (name not in original or original[name] is not value)}
+    functions = []
+    for name, value in members.items():
+        for function in _functions(value):
+            if function.__code__.co_filename == filename:
+                function.__qualname__ = f"{cls.__qualname__}.{function.__name__}"
+                functions.append(function)
+        setattr(cls, name, value)
+    _release_lines_with(filename, functions)
+    return list(members)
+
+
+def _functions(value):
+    # The functions behind a member: itself, or those of a classmethod, staticmethod or property
+    for function in (value, getattr(value, "__func__", None), *(getattr(value, name, None) for name in ("fget", "fset", "fdel"))):
+        if isinstance(function, types.FunctionType):
+            yield function
+
+
+def _release_lines_with(filename, functions):
+    alive = {id(function) for function in functions}
+    if not alive:
+        linecache.cache.pop(filename, None)
+        return
+
+    def release(function_id):
+        alive.discard(function_id)
+        if not alive:
+            linecache.cache.pop(filename, None)
+
+    for function in functions:
+        weakref.finalize(function, release, id(function))
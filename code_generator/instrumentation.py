@@ -0,0 +1,159 @@
+import time
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# The phases of a generation, in the order they happen
+PHASES = ("context", "model", "placement", "write", "git")
+
+
+class PhaseEvent:
+    """
+    One timed phase. bytes_in and bytes_out are the sizes of what went into and came out of
+    the phase (the prompt and the response of a model call), retries the number of retries
+    it took, and error the exception it ended with, if any.
+    """
+    __slots__ = ("phase", "start", "duration", "bytes_in", "bytes_out", "retries", "error", "details")
+
+    def __init__(self, phase, details):
+        self.phase = phase
+        self.start = time.perf_counter()
+        self.duration = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+        self.error = None
+        self.details = details
+
+    def __repr__(self):
+        return f"PhaseEvent({self.phase!r}, duration={self.duration}, bytes_in={self.bytes_in}, bytes_out={self.bytes_out}, retries={self.retries})"
+
+
+class PhaseStats:
+    __slots__ = ("count", "total", "max", "bytes_in", "bytes_out", "retries", "errors")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+        self.errors = 0
+
+    def add(self, event):
+        self.count += 1
+        self.total += event.duration
+        self.max = max(self.max, event.duration)
+        self.bytes_in += event.bytes_in
+        self.bytes_out += event.bytes_out
+        self.retries += event.retries
+        self.errors += event.error is not None
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count else 0.0,
+            "max_seconds": self.max,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "retries": self.retries,
+            "errors": self.errors,
+        }
+
+
+class Instrumentation:
+    """
+    Times the phases of generation and keeps aggregate counters per phase.
+    Each finished phase is logged at DEBUG level and passed to every hook added with add_hook,
+    e.g. to export it to a metrics system. Hooks run on the thread that ran the phase and must not raise.
+    """
+    def __init__(self):
+        self.hooks = []
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    @contextlib.contextmanager
+    def phase(self, name, **details):
+        """
+        Time the block as phase name. The block can fill in the sizes and retries of the yielded PhaseEvent.
+        """
+        event = PhaseEvent(name, details)
+        stack = self._stack()
+        stack.append(event)
+        try:
+            yield event
+        except BaseException as e:
+            event.error = e
+            raise
+        finally:
+            stack.pop()
+            self._finish(event)
+
+    def current(self):
+        """
+        The innermost phase running on this thread, or None.
+        """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _finish(self, event):
+        event.duration = time.perf_counter() - event.start
+        with self._lock:
+            self._stats.setdefault(event.phase, PhaseStats()).add(event)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s took %.3fs (%d bytes in, %d bytes out, %d retries)%s", event.phase, event.duration, event.bytes_in, event.bytes_out, event.retries, f" {event.details}" if event.details else "")
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception:
+                logger.exception("Instrumentation hook %r failed", hook)
+
+    def stats(self):
+        """
+        Aggregate counters per phase: {phase: {"count", "total_seconds", "mean_seconds", "max_seconds", "bytes_in", "bytes_out", "retries", "errors"}}.
+        """
+        with self._lock:
+            return {phase: stats.as_dict() for phase, stats in self._stats.items()}
+
+    def report(self):
+        """
+        The counters as a table, slowest phase first.
+        """
+        stats = self.stats()
+        lines = [f"{'phase':<10} {'count':>6} {'total s':>9} {'mean s':>8} {'max s':>8} {'bytes in':>10} {'bytes out':>10} {'retries':>7} {'errors':>6}"]
+        for phase, s in sorted(stats.items(), key=lambda item: -item[1]["total_seconds"]):
+            lines.append(f"{phase:<10} {s['count']:>6} {s['total_seconds']:>9.3f} {s['mean_seconds']:>8.3f} {s['max_seconds']:>8.3f} {s['bytes_in']:>10} {s['bytes_out']:>10} {s['retries']:>7} {s['errors']:>6}")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    return _instrumentation
+
+
+def phase(name, **details):
+    return _instrumentation.phase(name, **details)
@@ -0,0 +1,129 @@
+import re
+import ast
+import textwrap
+from .exceptions import InvalidResponseException
+
+_HUNK_HEADER = re.compile(r"^@@+ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@+")
+_FENCE = re.compile(r"^\s*```")
+
+# How far from the line number in its header a hunk is looked for, in lines
+MAX_OFFSET = 20
+
+
+def number_lines(source) -> str:
+    """
+    The lines of source prefixed with their 1-based numbers, keeping the indentation.
+    """
+    lines = source.splitlines()
+    width = len(str(len(lines)))
+    return "".join(f"{number:>{width}}| {line}\n" for number, line in enumerate(lines, 1))
+
+
+class Hunk:
+    """
+    One hunk of a unified diff: its start line and its (op, text) lines, op being
+    " " for context, "-" for a removed line and "+" for an added one.
+    """
+    __slots__ = ("start", "lines")
+
+    def __init__(self, start):
+        self.start = start
+        self.lines = []
+
+    @property
+    def old(self):
+        # The lines the hunk expects to find
+        return [text for op, text in self.lines if op != "+"]
+
+    def apply(self, matched):
+        """
+        The lines that replace matched, the lines of the source the hunk was found at.
+        Context lines are taken from the source, so their indentation is kept as it was.
+        """
+        new = []
+        matched = iter(matched)
+        for op, text in self.lines:
+            if op == "+":
+                new.append(text)
+            elif op == " ":
+                new.append(next(matched))
+            else:
+                next(matched)
+        return new
+
+
+def parse_patch(patch):
+    """
+    Parse the hunks of a unified diff. File headers, fences and any text before the first hunk are ignored.
+    Raises InvalidResponseException if there are no hunks.
+    """
+    hunks = []
+    for line in patch.splitlines():
+        header = _HUNK_HEADER.match(line)
+        if header:
+            hunks.append(Hunk(int(header.group(1))))
+        elif not hunks or _FENCE.match(line) or line.startswith(("--- ", "+++ ", "\\")):
+            continue
+        elif line.startswith(("-", "+")):
+            hunks[-1].lines.append((line[0], line[1:]))
+        else:
+            # A context line; models often drop the leading space of blank ones
+            hunks[-1].lines.append((" ", line[1:] if line.startswith(" ") else line))
+    if not hunks:
+        raise InvalidResponseException("Patch has no hunks")
+    return hunks
+
+
+def _find(lines, expected, start):
+    """
+    Return the index where the lines expected are in lines, looking near start first.
+    Lines are compared without trailing whitespace, then, if that finds nothing, without any.
+    """
+    for normalize in (str.rstrip, str.strip):
+        expected_lines = [normalize(line) for line in expected]
+        for offset in range(MAX_OFFSET + 1):
+            for index in {start - offset, start + offset}:
+                if 0 <= index <= len(lines) - len(expected) \
+                and [normalize(line) for line in lines[index:index + len(expected)]] == expected_lines:
+                    return index
+    return None
+
+
+def apply_patch(source, patch) -> str:
+    """
+    Apply the unified diff patch to source, whose lines it numbers from 1.
+    Hunks are located by their lines, so line numbers that are a little off do not matter.
+    The result must be valid Python. Raises InvalidResponseException if the patch does not apply.
+    """
+    lines = source.splitlines()
+    located = []
+    for hunk in parse_patch(patch):
+        if not hunk.lines:
+            continue
+        if not hunk.old:
+            # Pure insertion after line start
+            index = min(max(hunk.start, 0), len(lines))
+        else:
+            index = _find(lines, hunk.old, hunk.start - 1)
+            if index is None:
+                raise InvalidResponseException(f"Patch hunk at line {hunk.start} does not match the code")
+        located.append((index, hunk))
+
+    located.sort(key=lambda item: item[0])
+    end = 0
+    for index, hunk in located:
+        if index < end:
+            raise InvalidResponseException(f"Patch hunks overlap at line {index + 1}")
+        end = index + len(hunk.old)
+
+    # From the bottom up, so the indexes of the hunks above stay valid
+    for index, hunk in reversed(located):
+        end = index + len(hunk.old)
+        lines[index:end] = hunk.apply(lines[index:end])
+    patched = "\n".join(lines) + "\n"
+
+    try:
+        ast.parse(textwrap.dedent(patched))
+    except SyntaxError as e:
+        raise InvalidResponseException(f"Patched code is not valid Python: {e}")
+    return patched
@@ -0,0 +1,54 @@
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import config
+
+
+class Pipeline:
+    """
+    A dependency graph of generation stages.
+    Each stage is started on the thread pool as soon as the stages it depends on
+    have finished, and receives their results as positional arguments.
+    """
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, func, *deps):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self.stages[name] = (func, deps)
+        return self
+
+    def run(self, executor=None) -> dict:
+        executor = executor or get_executor()
+        results = {}
+        pending = dict(self.stages)
+        running = {}
+        while pending or running:
+            for name, (func, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    del pending[name]
+                    # Stages see the context variables of the caller, e.g. the event loop of an async generation
+                    running[executor.submit(contextvars.copy_context().run, func, *[results[dep] for dep in deps])] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                # Re-raises the exception of a failed stage
+                results[name] = future.result()
+        return results
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Return the thread pool shared by all pipelines.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.max_workers, thread_name_prefix="code_generator")
+        return _executor
@@ -0,0 +1,335 @@
+import ast
+import textwrap
+from .exceptions import CodeWriterException
+
+GENERATED_HEADER = "## AI GENERATED CODE; PLEASE REVIEW ##"
+GENERATED_FOOTER = "## END OF AI GENERATED CODE ##"
+MODIFIED_HEADER = "## AI MODIFIED CODE; PLEASE REVIEW ##"
+MODIFIED_FOOTER = "## END OF AI MODIFIED CODE ##"
+
+
+def parse_source(source):
+    try:
+        return ast.parse(source)
+    except SyntaxError as e:
+        raise CodeWriterException(f"Cannot place code in source that does not parse: {e}")
+
+
+def find_class_node(tree, qualname):
+    """
+    Find the ClassDef for a class __qualname__, including classes nested in classes and functions.
+    If a name is defined more than once, the last definition wins, like it does at runtime.
+    """
+    parts = [part for part in qualname.split(".") if part != "<locals>"]
+    scopes = [tree]
+    node = None
+    for i, part in enumerate(parts):
+        want_class = i == len(parts) - 1
+        node = None
+        for scope in scopes:
+            for child in ast.iter_child_nodes(scope):
+                if isinstance(child, ast.ClassDef) and child.name == part:
+                    node = child
+                elif not want_class and isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)) and child.name == part:
+                    node = child
+        if node is None:
+            return None
+        scopes = [node]
+    return node if isinstance(node, ast.ClassDef) else None
+
+
+def is_import_block(code):
+    try:
+        tree = ast.parse(textwrap.dedent(code))
+    except SyntaxError:
+        return False
+    return bool(tree.body) and all(isinstance(node, (ast.Import, ast.ImportFrom)) for node in tree.body)
+
+
+def import_statements(code):
+    """
+    The import statements of code, one per line, without anything else: the imports a model
+    is asked for sometimes come with other code or text. Lines that do not parse are left out.
+    """
+    try:
+        nodes = ast.parse(textwrap.dedent(code)).body
+    except SyntaxError:
+        nodes = []
+        for line in code.splitlines():
+            try:
+                nodes.extend(ast.parse(line.strip()).body)
+            except SyntaxError:
+                continue
+    return "\n".join(ast.unparse(node) for node in nodes if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def is_attribute_block(code):
+    try:
+        tree = ast.parse(textwrap.dedent(code))
+    except SyntaxError:
+        return False
+    return bool(tree.body) and all(isinstance(node, (ast.Assign, ast.AnnAssign)) for node in tree.body)
+
+
+def member_source(source, qualname, name):
+    """
+    The source of the member name of the class qualname in source, dedented, or None if the class does not define it.
+    """
+    node = find_class_node(parse_source(source), qualname)
+    if node is None:
+        return None
+    lines = source.split("\n")
+    for child in reversed(node.body):
+        if name in _class_member_names_of(child):
+            return textwrap.dedent("\n".join(lines[_statement_start(child) - 1:child.end_lineno]))
+    return None
+
+
+def class_member_names(node):
+    names = set()
+    for child in node.body:
+        names |= _class_member_names_of(child)
+    return names
+
+
+def _class_member_names_of(child):
+    names = set()
+    if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        names.add(child.name)
+    elif isinstance(child, ast.Assign):
+        for target in child.targets:
+            if isinstance(target, ast.Name):
+                names.add(target.id)
+    elif isinstance(child, ast.AnnAssign) and isinstance(child.target, ast.Name):
+        names.add(child.target.id)
+    return names
+
+
+def _statement_start(node):
+    # Decorators come before the def line
+    decorators = getattr(node, "decorator_list", None)
+    if decorators:
+        return min(decorator.lineno for decorator in decorators)
+    return node.lineno
+
+
+def _is_docstring(node):
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+def _skip_generated_footer(lines, after_line):
+    # Comments are not in the AST; the footer of a watermark closes the statement before it,
+    # so new code goes after it. Other comments belong to the code that follows them.
+    i = after_line
+    while i < len(lines) and lines[i].strip().startswith("#"):
+        if lines[i].strip() in (GENERATED_FOOTER, MODIFIED_FOOTER):
+            return i + 1
+        i += 1
+    return after_line
+
+
+def watermark(code, indent="", header=GENERATED_HEADER, footer=GENERATED_FOOTER):
+    code = textwrap.dedent(code).strip("\n")
+    lines = [header] + code.split("\n") + [footer]
+    return [f"{indent}{line}" if line.strip() else "" for line in lines]
+
+
+def member_name(code):
+    """
+    The name that code (a method, class or class attribute) defines, or None.
+    """
+    try:
+        tree = ast.parse(textwrap.dedent(code))
+    except SyntaxError:
+        return None
+    for node in tree.body:
+        names = _class_member_names_of(node)
+        if names:
+            return sorted(names)[0]
+    return None
+
+
+class SourceEdits:
+    """
+    Edits of a module source that are all placed against a single parse of it and applied
+    together, so patching a file with many edits parses it once.
+    Edits are line ranges of the original source, [start, end) and 0-based, and the lines that
+    take their place; an empty range inserts lines. Edits at the same place are applied in the
+    order they were added. Raises CodeWriterException for an edit that cannot be placed or that
+    overlaps one that was added before; the other edits are unaffected.
+    """
+    def __init__(self, source):
+        self.lines = source.split("\n")
+        self.tree = parse_source(source)
+        self.edits = []
+        self._split_classes = set()
+        self._imports = None
+
+    def _add(self, start, end, new_lines):
+        for other_start, other_end, _, _ in self.edits:
+            if start < end and other_start < other_end:
+                overlaps = start < other_end and other_start < end
+            else:
+                # An insertion may not go inside a replaced range
+                overlaps = other_start < start < other_end or start < other_start < end
+            if overlaps:
+                raise CodeWriterException(f"Edit of lines {start + 1}-{end} overlaps another edit of lines {other_start + 1}-{other_end}")
+        self.edits.append((start, end, len(self.edits), new_lines))
+
+    def _class(self, qualname):
+        node = find_class_node(self.tree, qualname)
+        if node is None:
+            raise CodeWriterException(f"Class {qualname} not found in source")
+        return node
+
+    def insert(self, qualname, code):
+        """
+        Insert code into the body of the class qualname.
+        Class attributes go after the existing class attributes (or the docstring),
+        anything else is appended to the end of the class body.
+        """
+        node = self._class(qualname)
+        lines = self.lines
+        first = node.body[0]
+        one_line = _statement_start(first) == node.lineno
+        if one_line:
+            # One-line class body, e.g. class A: pass
+            indent = " " * (node.col_offset + 4)
+        else:
+            first_line = lines[_statement_start(first) - 1]
+            indent = first_line[:len(first_line) - len(first_line.lstrip())]
+
+        if is_attribute_block(code):
+            attributes = [child for child in node.body if isinstance(child, (ast.Assign, ast.AnnAssign))]
+            if attributes:
+                after_line = _skip_generated_footer(lines, attributes[-1].end_lineno)
+            elif _is_docstring(first):
+                after_line = first.end_lineno
+            else:
+                after_line = _statement_start(first) - 1
+            new_lines = watermark(code, indent)
+        else:
+            after_line = _skip_generated_footer(lines, node.body[-1].end_lineno)
+            new_lines = [""] + watermark(code, indent)
+
+        if one_line:
+            if node.end_lineno != node.lineno:
+                raise CodeWriterException(f"Cannot insert into the one-line body of class {node.name}")
+            if node.lineno not in self._split_classes:
+                # Move the one-line body onto its own line so the class can grow
+                header, _, body = lines[node.lineno - 1].partition(":")
+                self._add(node.lineno - 1, node.lineno, [f"{header}:", f"{indent}{body.strip()}"])
+                self._split_classes.add(node.lineno)
+            after_line = node.lineno
+        self._add(after_line, after_line, new_lines)
+
+    def replace(self, qualname, code, name=None):
+        """
+        Replace the member name of the class qualname (by default the one code defines) with code,
+        indented like the member it replaces. The watermark around the old member goes with it.
+        """
+        name = name or member_name(code)
+        if name is None:
+            raise CodeWriterException("Cannot tell which member the code replaces")
+        node = self._class(qualname)
+        children = [child for child in node.body if name in _class_member_names_of(child)]
+        if not children:
+            raise CodeWriterException(f"Class {qualname} has no member {name}")
+        child = children[-1]
+        lines = self.lines
+        start, end = _statement_start(child) - 1, child.end_lineno
+        if start > 0 and end < len(lines) \
+        and lines[start - 1].strip() in (GENERATED_HEADER, MODIFIED_HEADER) \
+        and lines[end].strip() in (GENERATED_FOOTER, MODIFIED_FOOTER):
+            start, end = start - 1, end + 1
+        first_line = lines[_statement_start(child) - 1]
+        indent = first_line[:len(first_line) - len(first_line.lstrip())]
+        self._add(start, end, watermark(code, indent, MODIFIED_HEADER, MODIFIED_FOOTER))
+
+    def merge_imports(self, imports):
+        """
+        Merge import statements into the module import block, skipping names that are already imported.
+        """
+        if not imports.strip():
+            return
+        try:
+            import_tree = ast.parse(textwrap.dedent(imports))
+        except SyntaxError as e:
+            raise CodeWriterException(f"Invalid import statements: {e}")
+        if self._imports is None:
+            existing = set()
+            after_line = 0
+            for node in self.tree.body:
+                if isinstance(node, (ast.Import, ast.ImportFrom)):
+                    existing |= _import_keys(node)
+                    after_line = node.end_lineno
+                elif _is_docstring(node) and node is self.tree.body[0]:
+                    after_line = node.end_lineno
+                else:
+                    # The import block ends at the first statement that is not an import
+                    break
+            self._imports = (existing, after_line)
+        existing, after_line = self._imports
+
+        new_keys = []
+        for node in import_tree.body:
+            if not isinstance(node, (ast.Import, ast.ImportFrom)):
+                raise CodeWriterException(f"Not an import statement: {ast.dump(node)}")
+            for key in sorted(_import_keys(node), key=lambda key: key[3]):
+                if key not in existing and key not in new_keys:
+                    new_keys.append(key)
+        if new_keys:
+            self._add(after_line, after_line, [_render_import(*key) for key in new_keys])
+            existing.update(new_keys)
+
+    def apply(self) -> str:
+        lines = list(self.lines)
+        # From the bottom up, so the positions of the edits above stay valid. At the same position
+        # a replacement goes first, and insertions in reverse, so they end up in the order they were added.
+        for start, end, _, new_lines in sorted(self.edits, key=lambda edit: (edit[0], edit[1] > edit[0], edit[2]), reverse=True):
+            lines[start:end] = new_lines
+        return "\n".join(lines)
+
+
+def insert_into_class(source, qualname, code):
+    """
+    Insert code into the body of the class qualname in source (see SourceEdits.insert).
+    """
+    edits = SourceEdits(source)
+    edits.insert(qualname, code)
+    return edits.apply()
+
+
+def replace_member(source, qualname, code, name=None):
+    """
+    Replace a member of the class qualname in source with code (see SourceEdits.replace).
+    """
+    edits = SourceEdits(source)
+    edits.replace(qualname, code, name)
+    return edits.apply()
+
+
+def _import_keys(node):
+    if isinstance(node, ast.Import):
+        return {("import", None, 0, alias.name, alias.asname) for alias in node.names}
+    return {("from", node.module, node.level, alias.name, alias.asname) for alias in node.names}
+
+
+def _render_import(kind, module, level, name, asname):
+    target = f"{name} as {asname}" if asname else name
+    if kind == "import":
+        return f"import {target}"
+    return f"from {'.' * level}{module or ''} import {target}"
+
+
+def merge_imports(source, imports):
+    """
+    Merge import statements into the module import block of source, skipping names that are already imported.
+    """
+    if not imports.strip():
+        return source
+    edits = SourceEdits(source)
+    edits.merge_imports(imports)
+    if not edits.edits:
+        return source
+    return edits.apply()
@@ -0,0 +1,163 @@
+import inspect
+import logging
+import threading
+from collections import OrderedDict
+from . import config
+from .code_writer import CodeWriter
+from .code_generator import CodeGenerator
+from .pipeline import get_executor
+from .file_writer import Patch
+from .installer import install_code
+from .exceptions import CodeGenerationException
+
+logger = logging.getLogger(__name__)
+
+# Only the first few uses of a member are kept for the prompt
+MAX_USES = 3
+
+
+class MissRecord:
+    """
+    A member that was missing on a class, where it was first accessed and how it was used.
+    uses holds (special method name, args, kwargs) tuples, with "__call__" for calls.
+    """
+    __slots__ = ("owner_class", "name", "snapshot", "uses")
+
+    def __init__(self, owner_class, name, snapshot):
+        self.owner_class = owner_class
+        self.name = name
+        self.snapshot = snapshot
+        self.uses = []
+
+    @property
+    def is_method(self):
+        return any(use[0] == "__call__" for use in self.uses)
+
+    def describe(self):
+        call_site = self.snapshot[1] if len(self.snapshot) > 1 else self.snapshot[0]
+        description = f"- {self.name}: accessed at File: {call_site.filename}, Line: {call_site.lineno}, Function: {call_site.function}\n"
+        for special_method_name, args, kwargs in self.uses:
+            if special_method_name == "__call__":
+                description += f"  Called as a method with the arguments {args} and the keyword arguments {kwargs}.\n"
+            else:
+                description += f"  Used as a value through the special method {special_method_name} with the arguments {args}.\n"
+        return description
+
+
+class MissRecorder:
+    """
+    Collects missing members in record mode (config.record_mode), so they can be generated
+    later with one model request per class and one file write per source file.
+    """
+    def __init__(self):
+        self.records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, owner_class, name, snapshot):
+        with self._lock:
+            key = (owner_class, name)
+            if key not in self.records:
+                self.records[key] = MissRecord(owner_class, name, snapshot)
+            return self.records[key]
+
+    def record_use(self, owner_class, name, special_method_name, args, kwargs):
+        with self._lock:
+            record = self.records.get((owner_class, name))
+            if record is not None and len(record.uses) < MAX_USES:
+                record.uses.append((special_method_name, args, kwargs))
+
+    def pending(self):
+        with self._lock:
+            return list(self.records.values())
+
+    def flush(self):
+        """
+        Generate all recorded members: one batched model request per class, run concurrently,
+        then one write per source file. Returns {class: [generated member names]}.
+        If a file cannot be written, the other files are still written and the error is raised at the end;
+        only the records of that file are kept for the next flush.
+        """
+        by_class = OrderedDict()
+        for record in self.pending():
+            by_class.setdefault(record.owner_class, []).append(record)
+        if not by_class:
+            return {}
+
+        futures = {cls: get_executor().submit(self._generate_class, cls, records) for cls, records in by_class.items()}
+        generated = {cls: future.result() for cls, future in futures.items()}
+
+        by_file = OrderedDict()
+        for cls in generated:
+            by_file.setdefault(inspect.getsourcefile(cls), []).append(cls)
+        # All files go into a single commit on the AI branch. The records of a file are removed as soon
+        # as it is written, so a failure in another file does not make a later flush write it twice.
+        written = []
+        error = None
+        with CodeWriter().git_batch():
+            for class_file, classes in by_file.items():
+                try:
+                    self._write_file(class_file, classes, generated)
+                except Exception as e:
+                    logger.warning("Could not write the members recorded for %s: %s", class_file, e)
+                    error = error or e
+                    continue
+                with self._lock:
+                    for cls in classes:
+                        for name in generated[cls][0]:
+                            self.records.pop((cls, name), None)
+                written.extend(classes)
+
+        if config.hot_install:
+            for cls in written:
+                members, imports, _ = generated[cls]
+                try:
+                    install_code(cls, "\n\n".join(members.values()), imports)
+                except CodeGenerationException as e:
+                    logger.warning("%s", e)
+
+        if error is not None:
+            raise error
+        return {cls: list(generated[cls][0]) for cls in written}
+
+    def _generate_class(self, cls, records):
+        response = CodeGenerator().generate_batch(cls, records)
+        members = dict(response.members)
+        # Members the batched response did not cover are generated one by one
+        for record in records:
+            if record.name not in members:
+                if record.is_method:
+                    _, args, kwargs = next(use for use in record.uses if use[0] == "__call__")
+                    members[record.name] = CodeGenerator().generate_method(cls, record.name, args, kwargs, record.snapshot)
+                else:
+                    members[record.name] = CodeGenerator().generate_class_attribute(cls, record.name, record.snapshot)
+        imports = response.imports
+        if imports is None:
+            imports = CodeGenerator().generate_imports("\n\n".join(members.values()))
+        commit_message = response.commit_message
+        if commit_message:
+            commit_message = f"AI generated {commit_message}"
+        else:
+            commit_message = CodeGenerator().generate_commit_message(old_code="", new_code="\n\n".join(members.values()))
+        return members, imports, commit_message
+
+    def _write_file(self, class_file, classes, generated):
+        patches = []
+        for cls in classes:
+            members, imports, commit_message = generated[cls]
+            patches.extend(Patch(cls.__qualname__, code, message=commit_message) for code in members.values())
+            patches.append(Patch(cls.__qualname__, imports, imports=True))
+        CodeWriter().apply_changes(class_file, patches)
+
+
+_recorder = MissRecorder()
+
+
+def get_recorder() -> MissRecorder:
+    return _recorder
+
+
+def flush():
+    """
+    Generate every member recorded in record mode.
+    """
+    return _recorder.flush()
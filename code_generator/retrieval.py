@@ -0,0 +1,336 @@
+import os
+import re
+import sys
+import ast
+import math
+import time
+import sqlite3
+import hashlib
+import keyword
+import tokenize
+import threading
+from collections import Counter
+from . import config
+from .background import get_indexing_pool
+from .cache import default_cache_path
+from .scanner import SKIPPED_DIRECTORIES, module_name
+
+# BM25 parameters: term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+
+# At most this many distinct terms of a query are looked up
+MAX_QUERY_TERMS = 200
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_WORD = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+_STOPWORDS = {word.lower() for word in keyword.kwlist} | {"self", "cls", "args", "kwargs", "str", "int", "len"}
+
+
+def tokenize_code(text):
+    """
+    The search terms of a piece of code: every identifier, lowercased, and the words
+    it is made of, so get_user_name also matches "user" and UserName.
+    """
+    terms = []
+    for identifier in _IDENTIFIER.findall(text):
+        words = [word.lower() for word in _WORD.findall(identifier)]
+        if len(words) > 1:
+            words.append(identifier.lower())
+        terms.extend(word for word in words if len(word) > 1 and word not in _STOPWORDS)
+    return terms
+
+
+def project_root(path):
+    """
+    The directory whose code is indexed for the source file path: config.retrieval_root if set,
+    otherwise the git work tree path is in, otherwise the directory path is imported from.
+    None if that is not a project of its own: the home directory, a filesystem root, or a
+    directory of installed packages, whose code would take long to index and say little.
+    """
+    if config.retrieval_root:
+        return os.path.abspath(config.retrieval_root)
+    path = os.path.abspath(path)
+    root = None
+    directory = os.path.dirname(path)
+    while True:
+        if os.path.exists(os.path.join(directory, ".git")):
+            root = directory
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+    if root is None:
+        root = module_name(path)[1]
+    if root in (os.path.expanduser("~"), os.path.dirname(root)) \
+    or any(part in ("site-packages", "dist-packages") for part in root.split(os.sep)) \
+    or root in (sys.prefix, sys.base_prefix):
+        return None
+    return root
+
+
+def default_index_path(root):
+    digest = hashlib.sha256(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(os.path.dirname(default_cache_path()), "retrieval", f"{digest}.sqlite3")
+
+
+class Snippet:
+    """
+    A function or class found by a search, with its source and BM25 score.
+    The source of a class is its summary: everything but the bodies of its methods.
+    """
+    __slots__ = ("path", "qualname", "lineno", "source", "score")
+
+    def __init__(self, path, qualname, lineno, source, score):
+        self.path = path
+        self.qualname = qualname
+        self.lineno = lineno
+        self.source = source
+        self.score = score
+
+    def __repr__(self):
+        return f"Snippet({self.path!r}, {self.qualname!r}, score={self.score:.2f})"
+
+
+def extract_snippets(source):
+    """
+    Return (qualname, first line, source) for the classes and functions of a module.
+    Functions nested in functions are part of their enclosing function.
+    """
+    lines = source.splitlines(True)
+    snippets = []
+
+    def segment(node):
+        start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        return start, lines[start - 1:node.end_lineno]
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                start, function_lines = segment(child)
+                snippets.append((prefix + child.name, start, "".join(function_lines)))
+            elif isinstance(child, ast.ClassDef):
+                start, class_lines = segment(child)
+                # Leave out method bodies but not their docstrings, the methods are snippets of their own
+                for member in reversed(child.body):
+                    if not isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                        continue
+                    body = member.body
+                    if ast.get_docstring(member, clean=False) is not None:
+                        body = body[1:]
+                    if body and body[0].lineno > member.lineno:
+                        class_lines[body[0].lineno - start:member.end_lineno - start + 1] = []
+                snippets.append((prefix + child.name, start, "".join(class_lines)))
+                visit(child, prefix + child.name + ".")
+
+    visit(ast.parse(source), "")
+    return snippets
+
+
+class RetrievalIndex:
+    """
+    On-disk BM25 index of the functions and classes of the Python files under root.
+    update() reindexes only the files whose mtime or size changed since they were last
+    indexed, and does nothing if it already ran in the last refresh seconds.
+    The index is ready once it holds the files of root: when it was built by an earlier
+    run, or once the first update() finished.
+    """
+    def __init__(self, root, path=None, refresh=None, max_files=None):
+        self.root = os.path.abspath(root)
+        self.path = path or default_index_path(self.root)
+        self.refresh = refresh
+        self.max_files = max_files
+        self.updated_at = None
+        self.indexed = 0
+        self.ready = False
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS snippets (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                qualname TEXT NOT NULL,
+                lineno INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                length INTEGER NOT NULL
+            )""")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT NOT NULL,
+                snippet INTEGER NOT NULL,
+                tf INTEGER NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS snippets_path ON snippets (path)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS terms_term ON terms (term)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS terms_snippet ON terms (snippet)")
+        self.ready = self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0] > 0
+
+    def update(self, force=False):
+        """
+        Bring the index up to date with the files on disk. Returns the number of files reindexed.
+        """
+        refresh = config.retrieval_refresh if self.refresh is None else self.refresh
+        if not force and self.updated_at is not None and time.monotonic() - self.updated_at < refresh:
+            return 0
+        current = {}
+        for path in self._source_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            stored = {path: (mtime_ns, size) for path, mtime_ns, size in self._db.execute("SELECT path, mtime_ns, size FROM files")}
+
+        changed = [path for path, key in current.items() if stored.get(path) != key]
+        removed = [path for path in stored if path not in current]
+        # Parse outside the transaction, so searches from other threads are not held up
+        parsed = {path: self._parse(path) for path in changed}
+
+        if changed or removed:
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    for path in removed:
+                        self._delete(path)
+                    for path in changed:
+                        # Another process may have indexed the file in the meantime
+                        row = self._db.execute("SELECT mtime_ns, size FROM files WHERE path = ?", (path,)).fetchone()
+                        if row is not None and tuple(row) == current[path]:
+                            continue
+                        self._delete(path)
+                        self._insert(path, current[path], parsed[path])
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+        self.updated_at = time.monotonic()
+        self.indexed += len(changed)
+        self.ready = True
+        return len(changed)
+
+    def update_in_background(self):
+        """
+        Run update() on the background indexing pool, unless it is already running or
+        queued there. Returns its future, or None if the pool is full.
+        """
+        return get_indexing_pool().submit(("retrieval", self.path), self.update)
+
+    def _source_files(self):
+        max_files = config.retrieval_max_files if self.max_files is None else self.max_files
+        count = 0
+        for directory, directories, filenames in os.walk(self.root):
+            directories[:] = sorted(d for d in directories if not d.startswith(".") and d not in SKIPPED_DIRECTORIES)
+            for filename in sorted(filenames):
+                if not filename.endswith(".py"):
+                    continue
+                if max_files is not None and count >= max_files:
+                    return
+                count += 1
+                yield os.path.join(directory, filename)
+
+    @staticmethod
+    def _parse(path):
+        try:
+            with tokenize.open(path) as f:
+                return extract_snippets(f.read())
+        except (OSError, SyntaxError, UnicodeDecodeError, ValueError):
+            # Indexed as empty, so it is not parsed again until it changes
+            return []
+
+    def _delete(self, path):
+        self._db.execute("DELETE FROM terms WHERE snippet IN (SELECT id FROM snippets WHERE path = ?)", (path,))
+        self._db.execute("DELETE FROM snippets WHERE path = ?", (path,))
+        self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _insert(self, path, key, snippets):
+        self._db.execute("INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)", (path, *key))
+        for qualname, lineno, source in snippets:
+            terms = Counter(tokenize_code(source))
+            cursor = self._db.execute(
+                "INSERT INTO snippets (path, qualname, lineno, source, length) VALUES (?, ?, ?, ?, ?)",
+                (path, qualname, lineno, source, sum(terms.values())))
+            self._db.executemany("INSERT INTO terms (term, snippet, tf) VALUES (?, ?, ?)",
+                                 [(term, cursor.lastrowid, tf) for term, tf in terms.items()])
+
+    def search(self, query, k=5, exclude=()):
+        """
+        Return the k snippets that best match query, best first.
+        query is a text or a Counter of terms, whose counts weight the terms.
+        exclude is a list of (path, qualname): those snippets and the ones nested in them are skipped.
+        """
+        terms = query if isinstance(query, Counter) else Counter(tokenize_code(query))
+        terms = dict(terms.most_common(MAX_QUERY_TERMS))
+        if not terms or k <= 0:
+            return []
+        with self._lock:
+            count, total_length = self._db.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM snippets").fetchone()
+            if not count:
+                return []
+            rows = self._db.execute(
+                f"SELECT terms.term, terms.snippet, terms.tf, snippets.length FROM terms JOIN snippets ON snippets.id = terms.snippet "
+                f"WHERE terms.term IN ({', '.join('?' * len(terms))})", list(terms)).fetchall()
+
+            document_frequency = Counter(term for term, _, _, _ in rows)
+            average_length = total_length / count or 1
+            scores = Counter()
+            for term, snippet, tf, length in rows:
+                df = document_frequency[term]
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                scores[snippet] += terms[term] * idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+
+            results = []
+            for snippet, score in scores.most_common():
+                path, qualname, lineno, source = self._db.execute(
+                    "SELECT path, qualname, lineno, source FROM snippets WHERE id = ?", (snippet,)).fetchone()
+                if any(path == excluded_path and (qualname == excluded or qualname.startswith(excluded + "."))
+                       for excluded_path, excluded in exclude):
+                    continue
+                results.append(Snippet(path, qualname, lineno, source, score))
+                if len(results) >= k:
+                    break
+        return results
+
+    def stats(self):
+        with self._lock:
+            files = self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            snippets = self._db.execute("SELECT COUNT(*) FROM snippets").fetchone()[0]
+        return {
+            "files": files,
+            "snippets": snippets,
+            "reindexed": self.indexed,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_retrieval_index(root):
+    """
+    Return the shared RetrievalIndex of the project at root, or None if retrieval is disabled.
+    """
+    if not config.retrieval_enabled:
+        return None
+    root = os.path.abspath(root)
+    path = os.path.join(config.retrieval_path, os.path.basename(default_index_path(root))) if config.retrieval_path else default_index_path(root)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None or index.path != path:
+            if index is not None:
+                index.close()
+            index = _indexes[root] = RetrievalIndex(root, path)
+        return index
@@ -0,0 +1,134 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import config
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the delay before retry n is a random time
+    between 0 and min(backoff_max, backoff * 2 ** n).
+    """
+    def __init__(self, attempts=None, backoff=None, backoff_max=None):
+        self.attempts = config.retry_attempts if attempts is None else attempts
+        self.backoff = config.retry_backoff if backoff is None else backoff
+        self.backoff_max = config.retry_backoff_max if backoff_max is None else backoff_max
+
+    def delay(self, retry):
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** retry))
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a provider that keeps failing.
+    After failure_threshold failures in a row the circuit opens and the provider is skipped.
+    After reset_timeout seconds one request is let through (half-open): if it succeeds the
+    circuit closes again, if it fails the circuit stays open for another reset_timeout.
+    """
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.failed_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a request may be sent now. In the half-open state only the first caller gets True.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self._reset_timeout():
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def available(self):
+        """
+        Like allow(), but without taking the half-open trial request.
+        """
+        with self._lock:
+            return self.state == CLOSED or (self.state == OPEN and time.monotonic() - self.opened_at >= self._reset_timeout())
+
+    def recent_failures(self):
+        """
+        The number of failures in a row, or 0 if the last one is older than reset_timeout.
+        """
+        with self._lock:
+            if self.failed_at is None or time.monotonic() - self.failed_at >= self._reset_timeout():
+                return 0
+            return self.failures
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_cancelled(self):
+        # A half-open trial request that was given up on does not tell anything; try again later
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.failed_at = time.monotonic()
+            if self.state == HALF_OPEN or self.failures >= self._failure_threshold():
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def _failure_threshold(self):
+        return config.circuit_failure_threshold if self.failure_threshold is None else self.failure_threshold
+
+    def _reset_timeout(self):
+        return config.circuit_reset_timeout if self.reset_timeout is None else self.reset_timeout
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(backend, provider) -> CircuitBreaker:
+    key = (backend, provider)
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(f"{backend}/{provider}")
+        return _breakers[key]
+
+
+def get_providers():
+    """
+    The providers to use, in order of preference.
+    """
+    providers = list(config.providers or [])
+    if config.provider not in providers:
+        providers.insert(0, config.provider)
+    return providers
+
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def get_hedge_executor():
+    """
+    Return the thread pool that hedged requests run on. It is separate from the pipeline
+    executor so model calls made from pipeline stages cannot starve it.
+    """
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=config.max_workers, thread_name_prefix="code_generator_hedge")
+        return _hedge_executor
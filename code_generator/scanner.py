@@ -0,0 +1,411 @@
+import os
+import ast
+from collections import OrderedDict
+from .placement import class_member_names
+
+GENERATIVE_BASE = "code_generator.generative_base.GenerativeBase"
+ASYNC_GENERATIVE_BASE = "code_generator.generative_base.AsyncGenerativeBase"
+
+# Members every GenerativeBase instance has
+_BUILTIN_MEMBERS = set(dir(object)) | {"__init_subclass__", "__getattr__", "__dict__", "__weakref__", "__module__"}
+
+SKIPPED_DIRECTORIES = {"__pycache__", "node_modules", "venv", "env"}
+
+
+class ClassInfo:
+    """
+    A class definition found in the scanned sources.
+    members are the names its body defines, instance_attributes the names its methods assign on self.
+    """
+    __slots__ = ("module", "qualname", "path", "lineno", "bases", "members", "instance_attributes", "resolved_bases", "children")
+
+    def __init__(self, module, qualname, path, lineno, bases, members):
+        self.module = module
+        self.qualname = qualname
+        self.path = path
+        self.lineno = lineno
+        self.bases = bases
+        self.members = members
+        self.instance_attributes = set()
+        self.resolved_bases = None
+        self.children = []
+
+    @property
+    def full_name(self):
+        return f"{self.module}.{self.qualname}"
+
+    def __repr__(self):
+        return f"ClassInfo({self.full_name!r})"
+
+
+class Access:
+    """
+    One place where a member is accessed on an instance of a class.
+    For calls, args and kwargs hold the source of the arguments.
+    """
+    __slots__ = ("path", "lineno", "function", "call", "args", "kwargs")
+
+    def __init__(self, path, lineno, function, call=False, args=(), kwargs=None):
+        self.path = path
+        self.lineno = lineno
+        self.function = function
+        self.call = call
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+
+
+class MissingMember:
+    __slots__ = ("class_info", "name", "accesses")
+
+    def __init__(self, class_info, name):
+        self.class_info = class_info
+        self.name = name
+        self.accesses = []
+
+    @property
+    def is_method(self):
+        return any(access.call for access in self.accesses)
+
+    def __repr__(self):
+        return f"MissingMember({self.class_info.full_name!r}, {self.name!r})"
+
+
+class _Module:
+    __slots__ = ("name", "path", "root", "source", "tree", "imports", "classes")
+
+    def __init__(self, name, path, root, source, tree):
+        self.name = name
+        self.path = path
+        self.root = root
+        self.source = source
+        self.tree = tree
+        # Local name -> dotted name of what was imported
+        self.imports = {}
+        # Qualname -> ClassInfo
+        self.classes = OrderedDict()
+
+
+def module_name(path):
+    """
+    The dotted module name of the file path and the directory it is imported from,
+    found by walking up the packages (directories with an __init__.py).
+    """
+    path = os.path.abspath(path)
+    directory, filename = os.path.split(path)
+    parts = [] if filename == "__init__.py" else [os.path.splitext(filename)[0]]
+    while os.path.exists(os.path.join(directory, "__init__.py")):
+        directory, package = os.path.split(directory)
+        parts.insert(0, package)
+    return ".".join(parts), directory
+
+
+def _dotted_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        value = _dotted_name(node.value)
+        return f"{value}.{node.attr}" if value else None
+    return None
+
+
+class _ClassCollector(ast.NodeVisitor):
+    def __init__(self, module):
+        self.module = module
+        self.scope = []
+
+    def visit_Import(self, node):
+        if not self.scope:
+            for alias in node.names:
+                if alias.asname:
+                    self.module.imports[alias.asname] = alias.name
+                else:
+                    self.module.imports[alias.name.split(".")[0]] = alias.name.split(".")[0]
+
+    def visit_ImportFrom(self, node):
+        if self.scope:
+            return
+        base = node.module or ""
+        if node.level:
+            package = self.module.name.split(".")
+            if not self.module.path.endswith("__init__.py"):
+                package = package[:-1]
+            package = package[:len(package) - node.level + 1]
+            base = ".".join(package + ([base] if base else []))
+        for alias in node.names:
+            self.module.imports[alias.asname or alias.name] = f"{base}.{alias.name}" if base else alias.name
+
+    def visit_ClassDef(self, node):
+        qualname = ".".join(self.scope + [node.name])
+        bases = [_dotted_name(base) for base in node.bases]
+        info = ClassInfo(self.module.name, qualname, self.module.path, node.lineno, bases, class_member_names(node))
+        for child in node.body:
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                info.instance_attributes |= _self_assignments(child)
+        self.module.classes[qualname] = info
+        self.scope.append(node.name)
+        self.generic_visit(node)
+        self.scope.pop()
+
+    def visit_FunctionDef(self, node):
+        self.scope += [node.name, "<locals>"]
+        self.generic_visit(node)
+        del self.scope[-2:]
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+
+def _self_name(function):
+    args = function.args.posonlyargs + function.args.args if hasattr(function.args, "posonlyargs") else function.args.args
+    decorators = {_dotted_name(decorator) for decorator in function.decorator_list}
+    if not args or "staticmethod" in decorators or "classmethod" in decorators:
+        return None
+    return args[0].arg
+
+
+def _self_assignments(function):
+    self_name = _self_name(function)
+    names = set()
+    if self_name is None:
+        return names
+    for node in ast.walk(function):
+        if isinstance(node, ast.Attribute) and isinstance(node.ctx, (ast.Store, ast.Del)) and isinstance(node.value, ast.Name) and node.value.id == self_name:
+            names.add(node.attr)
+    return names
+
+
+class _AccessCollector(ast.NodeVisitor):
+    """
+    Finds attribute loads on expressions known to be instances of generative classes:
+    self in their methods, variables assigned from a call of the class or annotated with it,
+    and calls of the class themselves.
+    """
+    def __init__(self, scanner, module):
+        self.scanner = scanner
+        self.module = module
+        # Variable name -> ClassInfo, per function scope
+        self.variables = [{}]
+        self.functions = ["<module>"]
+        self.classes = []
+        self.calls = {}
+
+    def visit_ClassDef(self, node):
+        self.classes.append(node)
+        self.generic_visit(node)
+        self.classes.pop()
+
+    def visit_FunctionDef(self, node):
+        variables = {}
+        self_name = _self_name(node)
+        if self.classes and self_name is not None:
+            qualname = ".".join(self._class_qualname())
+            info = self.module.classes.get(qualname)
+            if info is not None and self.scanner.is_generative(info):
+                variables[self_name] = info
+        for arg in node.args.args + node.args.kwonlyargs:
+            info = self._annotation_class(arg.annotation)
+            if info is not None:
+                variables[arg.arg] = info
+        self.variables.append(variables)
+        self.functions.append(node.name)
+        saved_classes, self.classes = self.classes, []
+        self.generic_visit(node)
+        self.classes = saved_classes
+        self.functions.pop()
+        self.variables.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def _class_qualname(self):
+        # Classes nested in the current function are not reachable by qualname; only the outer chain is used
+        return [cls.name for cls in self.classes]
+
+    def _annotation_class(self, annotation):
+        if annotation is None:
+            return None
+        name = annotation.value if isinstance(annotation, ast.Constant) and isinstance(annotation.value, str) else _dotted_name(annotation)
+        info = self.scanner.resolve(self.module, name) if name else None
+        return info if isinstance(info, ClassInfo) and self.scanner.is_generative(info) else None
+
+    def _instance_class(self, node):
+        if isinstance(node, ast.Name):
+            for variables in reversed(self.variables):
+                if node.id in variables:
+                    return variables[node.id]
+            return None
+        if isinstance(node, ast.Call):
+            name = _dotted_name(node.func)
+            info = self.scanner.resolve(self.module, name) if name else None
+            if isinstance(info, ClassInfo) and self.scanner.is_generative(info):
+                return info
+        return None
+
+    def visit_Assign(self, node):
+        self.generic_visit(node)
+        info = self._instance_class(node.value)
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                if info is not None:
+                    self.variables[-1][target.id] = info
+                else:
+                    self.variables[-1].pop(target.id, None)
+
+    def visit_AnnAssign(self, node):
+        self.generic_visit(node)
+        info = self._annotation_class(node.annotation) or (self._instance_class(node.value) if node.value else None)
+        if isinstance(node.target, ast.Name) and info is not None:
+            self.variables[-1][node.target.id] = info
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Attribute):
+            self.calls[id(node.func)] = node
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        info = self._instance_class(node.value)
+        if info is not None:
+            if isinstance(node.ctx, ast.Load):
+                call = self.calls.get(id(node))
+                if call is not None:
+                    args = [ast.get_source_segment(self.module.source, arg) for arg in call.args]
+                    kwargs = {keyword.arg: ast.get_source_segment(self.module.source, keyword.value) for keyword in call.keywords if keyword.arg}
+                    access = Access(self.module.path, node.lineno, self.functions[-1], True, args, kwargs)
+                else:
+                    access = Access(self.module.path, node.lineno, self.functions[-1])
+                self.scanner.add_access(info, node.attr, access)
+            else:
+                info.instance_attributes.add(node.attr)
+        self.generic_visit(node)
+
+
+class ProjectScanner:
+    """
+    Finds the members that are used on instances of GenerativeBase subclasses in a project
+    but not defined anywhere in their MRO, by reading the sources with ast without importing them.
+    Only classes whose bases can all be resolved within the scanned sources are considered,
+    since members of other bases cannot be known.
+    """
+    def __init__(self, paths):
+        self.paths = paths
+        self.modules = OrderedDict()
+        self.accesses = OrderedDict()
+        self.errors = []
+        self._generative = {}
+
+    def scan(self):
+        """
+        Returns the list of MissingMember found.
+        """
+        for path in self._source_files():
+            self._parse(path)
+        for module in self.modules.values():
+            for info in module.classes.values():
+                info.resolved_bases = [self.resolve(module, base) if base else None for base in info.bases]
+                for base in info.resolved_bases:
+                    if isinstance(base, ClassInfo):
+                        base.children.append(info)
+        for module in self.modules.values():
+            _AccessCollector(self, module).visit(module.tree)
+
+        missing = []
+        for (info, name), accesses in self.accesses.items():
+            if self.is_defined(info, name):
+                continue
+            member = MissingMember(info, name)
+            member.accesses = accesses
+            missing.append(member)
+        return missing
+
+    def _source_files(self):
+        for path in self.paths:
+            if os.path.isfile(path):
+                yield os.path.abspath(path)
+                continue
+            for directory, directories, filenames in os.walk(path):
+                directories[:] = sorted(d for d in directories if not d.startswith(".") and d not in SKIPPED_DIRECTORIES)
+                for filename in sorted(filenames):
+                    if filename.endswith(".py"):
+                        yield os.path.abspath(os.path.join(directory, filename))
+
+    def _parse(self, path):
+        try:
+            with open(path) as f:
+                source = f.read()
+            tree = ast.parse(source, filename=path)
+        except (OSError, SyntaxError, UnicodeDecodeError) as e:
+            self.errors.append((path, e))
+            return
+        name, root = module_name(path)
+        module = _Module(name, path, root, source, tree)
+        _ClassCollector(module).visit(tree)
+        self.modules[name] = module
+
+    def resolve(self, module, dotted):
+        """
+        Resolve a dotted name used in module to a ClassInfo, GENERATIVE_BASE, "object", or None if unknown.
+        """
+        first, _, rest = dotted.partition(".")
+        if first in module.classes and not rest:
+            return module.classes[first]
+        if rest and first in module.classes:
+            return module.classes.get(dotted)
+        if first == "object" and not rest and first not in module.imports:
+            return "object"
+        target = module.imports.get(first)
+        if target is None:
+            return None
+        full = f"{target}.{rest}" if rest else target
+        if full in (GENERATIVE_BASE, "code_generator.GenerativeBase", ASYNC_GENERATIVE_BASE, "code_generator.AsyncGenerativeBase"):
+            return GENERATIVE_BASE
+        # Find the longest module prefix that was scanned
+        parts = full.split(".")
+        for i in range(len(parts) - 1, 0, -1):
+            other = self.modules.get(".".join(parts[:i]))
+            if other is not None:
+                qualname = ".".join(parts[i:])
+                if qualname in other.classes:
+                    return other.classes[qualname]
+                # Re-exported through an import in that module
+                if other is not module and parts[i] in other.imports:
+                    return self.resolve(other, qualname)
+                return None
+        return None
+
+    def is_generative(self, info):
+        """
+        Whether info derives from GenerativeBase and all its bases are known.
+        """
+        if info.full_name not in self._generative:
+            self._generative[info.full_name] = False
+            bases = info.resolved_bases or []
+            known = all(base is not None for base in bases)
+            derives = any(base == GENERATIVE_BASE or (isinstance(base, ClassInfo) and self.is_generative(base)) for base in bases)
+            self._generative[info.full_name] = known and derives
+        return self._generative[info.full_name]
+
+    def add_access(self, info, name, access):
+        if name.startswith("__") and name.endswith("__"):
+            return
+        self.accesses.setdefault((info, name), []).append(access)
+
+    def is_defined(self, info, name):
+        if name in _BUILTIN_MEMBERS:
+            return True
+        # Defined by the class, one of its bases or, for self in base methods, one of its subclasses
+        return self._defined_in_ancestors(info, name, set()) or self._defined_in_descendants(info, name, set())
+
+    def _defined_in_ancestors(self, info, name, seen):
+        if info.full_name in seen:
+            return False
+        seen.add(info.full_name)
+        if name in info.members or name in info.instance_attributes:
+            return True
+        return any(isinstance(base, ClassInfo) and self._defined_in_ancestors(base, name, seen) for base in info.resolved_bases or [])
+
+    def _defined_in_descendants(self, info, name, seen):
+        for child in info.children:
+            if child.full_name in seen:
+                continue
+            seen.add(child.full_name)
+            if name in child.members or name in child.instance_attributes or self._defined_in_descendants(child, name, seen):
+                return True
+        return False
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import contextlib
+from . import config
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks on this platform; only threads are coordinated
+    fcntl = None
+
+# Recorded results are only needed by the processes that waited for the call, so they expire
+RESULT_TTL = 600
+
+
+class _Flight:
+    __slots__ = ("event", "result", "exception")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time.
+    Threads that ask for a key that is already in flight wait for that call and share its result.
+    Across processes, an advisory lock file per key makes the calls take turns; a call that gets the
+    lock after another process finished can check with already_done() and skip the work, for instance
+    by looking for the result that call recorded with record_result().
+    Lock files are removed when they are released, and recorded results after RESULT_TTL seconds.
+    """
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._swept = 0
+
+    def do(self, key, func, already_done=None):
+        """
+        Run func() for key, or wait for the call already in flight for key.
+        already_done() is called while holding the file lock and may return a result to use instead of calling func.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.exception is not None:
+                raise flight.exception
+            return flight.result
+
+        try:
+            with self.file_lock(key):
+                result = already_done() if already_done is not None else None
+                if result is None:
+                    result = func()
+            flight.result = result
+            return result
+        except BaseException as e:
+            flight.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+    def record_result(self, key, result):
+        """
+        Record result, a JSON-serializable value, as the result of the call for key,
+        for recorded_result() in later calls for key, in this process or in another one.
+        """
+        path = self._path(key, "result")
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+            json.dump(result, f)
+        os.replace(f.name, path)
+        self._sweep(os.path.dirname(path))
+
+    def recorded_result(self, key):
+        """
+        The result recorded for key with record_result() in the last RESULT_TTL seconds, or None.
+        """
+        path = self._path(key, "result")
+        try:
+            with open(path) as f:
+                if time.time() - os.fstat(f.fileno()).st_mtime > RESULT_TTL:
+                    return None
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _sweep(self, lock_dir):
+        """
+        Remove expired results, and lock files left behind by processes that died holding them.
+        Runs at most once every RESULT_TTL seconds per process.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._swept < RESULT_TTL:
+                return
+            self._swept = now
+        try:
+            entries = list(os.scandir(lock_dir))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if now - entry.stat().st_mtime <= RESULT_TTL:
+                    continue
+                if entry.name.endswith((".result", ".tmp")):
+                    os.unlink(entry.path)
+                elif entry.name.endswith(".lock") and fcntl is not None:
+                    with open(entry.path, "a") as lock_file:
+                        try:
+                            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except OSError:
+                            # Still held
+                            continue
+                        os.unlink(entry.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _path(key, extension):
+        lock_dir = config.lock_dir or os.path.join(tempfile.gettempdir(), "code_generator_locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(lock_dir, f"{digest}.{extension}")
+
+    @contextlib.contextmanager
+    def file_lock(self, key):
+        if fcntl is None:
+            yield
+            return
+        path = self._path(key, "lock")
+        while True:
+            lock_file = open(path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # The holder we waited for removes the file before it unlocks, so ours may be gone already
+                if self._same_file(lock_file, path):
+                    break
+            except BaseException:
+                lock_file.close()
+                raise
+            lock_file.close()
+        try:
+            yield
+        finally:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    @staticmethod
+    def _same_file(lock_file, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        opened = os.fstat(lock_file.fileno())
+        return (stat.st_dev, stat.st_ino) == (opened.st_dev, opened.st_ino)
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
@@ -0,0 +1,51 @@
+import sys
+
+
+class FrameRecord:
+    """
+    Where a frame was executing: file, line and function name. Holds no reference to the frame itself.
+    """
+    __slots__ = ("filename", "lineno", "function")
+
+    def __init__(self, filename, lineno, function):
+        self.filename = filename
+        self.lineno = lineno
+        self.function = function
+
+    def __repr__(self):
+        return f"FrameRecord({self.filename!r}, {self.lineno}, {self.function!r})"
+
+
+class StackSnapshot:
+    """
+    A compact copy of the call stack, most recent frame first, like inspect.stack().
+    Source lines are not read when the snapshot is taken; CodeGenerator resolves them only when it needs them.
+    """
+    __slots__ = ("frames",)
+
+    def __init__(self, frames):
+        self.frames = tuple(frames)
+
+    @classmethod
+    def capture(cls, skip=0, limit=None):
+        # Index 0 is the function that called capture, unless frames are skipped
+        frame = sys._getframe(skip + 1)
+        frames = []
+        while frame is not None and (limit is None or len(frames) < limit):
+            code = frame.f_code
+            frames.append(FrameRecord(code.co_filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        del frame
+        return cls(frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __repr__(self):
+        return f"StackSnapshot({list(self.frames)!r})"
@@ -0,0 +1,161 @@
+import os
+import ast
+import inspect
+import linecache
+import threading
+import tokenize
+from collections import OrderedDict
+
+
+class FileIndex:
+    """
+    The lines of a source file and the line spans of the classes and functions defined in it.
+    Spans are keyed by __qualname__ and are (first line, last line), 1-based and inclusive,
+    with decorators counted as part of the definition like inspect.getsourcelines does.
+    """
+    def __init__(self, path, key, lines, spans):
+        self.path = path
+        self.key = key
+        self.lines = lines
+        self.spans = spans
+
+    @classmethod
+    def build(cls, path, key):
+        with tokenize.open(path) as f:
+            lines = f.readlines()
+        spans = {}
+        try:
+            tree = ast.parse("".join(lines), filename=path)
+        except SyntaxError:
+            tree = None
+        if tree is not None:
+            cls._collect_spans(tree, "", spans)
+        return cls(path, key, lines, spans)
+
+    @classmethod
+    def _collect_spans(cls, node, prefix, spans):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                qualname = prefix + child.name
+                start = min([child.lineno] + [decorator.lineno for decorator in child.decorator_list])
+                spans[qualname] = (start, child.end_lineno)
+                if isinstance(child, ast.ClassDef):
+                    cls._collect_spans(child, qualname + ".", spans)
+                else:
+                    cls._collect_spans(child, qualname + ".<locals>.", spans)
+
+    def get_lines(self, qualname):
+        start, end = self.spans[qualname]
+        return self.lines[start - 1:end], start
+
+    def find_enclosing(self, lineno):
+        """
+        Return the qualname of the innermost function or class whose span contains lineno, or None.
+        """
+        best = None
+        for qualname, (start, end) in self.spans.items():
+            if start <= lineno <= end and (best is None or start >= self.spans[best][0]):
+                best = qualname
+        return best
+
+
+class SourceIndex:
+    """
+    Cache of parsed source files keyed by (path, mtime, size), so that source lookups
+    do not re-read and re-tokenize files that did not change.
+    Rendered class summaries are cached alongside and dropped with their file.
+    Files are keyed by their real path, so a file reached through a symlink is indexed once
+    and invalidate() finds it whichever path it is given.
+    """
+    def __init__(self, max_summaries=1024):
+        self.files = {}
+        self.summaries = OrderedDict()
+        self.max_summaries = max_summaries
+        self._lock = threading.RLock()
+        # path as given -> real path, and real path -> the paths given for it
+        self._realpaths = {}
+        self._aliases = {}
+
+    def realpath(self, path):
+        realpath = self._realpaths.get(path)
+        if realpath is None:
+            realpath = os.path.realpath(path)
+            with self._lock:
+                self._realpaths[path] = realpath
+                self._aliases.setdefault(realpath, set()).add(path)
+        return realpath
+
+    def get_file(self, path) -> FileIndex:
+        path = self.realpath(path)
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            index = self.files.get(path)
+            if index is not None and index.key == key:
+                return index
+        index = FileIndex.build(path, key)
+        with self._lock:
+            self.files[path] = index
+            self._drop_summaries(path)
+        return index
+
+    def getsourcelines(self, obj):
+        """
+        Drop-in replacement for inspect.getsourcelines for classes and functions.
+        """
+        obj = inspect.unwrap(obj) if inspect.isfunction(obj) else obj
+        path = inspect.getsourcefile(obj)
+        qualname = getattr(obj, "__qualname__", None)
+        if path and qualname and os.path.exists(path):
+            index = self.get_file(path)
+            if qualname in index.spans:
+                return index.get_lines(qualname)
+        return inspect.getsourcelines(obj)
+
+    def _summary_key(self, cls, key):
+        try:
+            path = inspect.getsourcefile(cls)
+        except TypeError:
+            return None
+        if not path or not os.path.exists(path):
+            return None
+        path = self.realpath(path)
+        return (path, self.get_file(path).key, id(cls), key)
+
+    def get_summary(self, cls, key):
+        summary_key = self._summary_key(cls, key)
+        with self._lock:
+            if summary_key in self.summaries:
+                self.summaries.move_to_end(summary_key)
+                return self.summaries[summary_key]
+        return None
+
+    def set_summary(self, cls, key, summary):
+        summary_key = self._summary_key(cls, key)
+        if summary_key is None:
+            return
+        with self._lock:
+            self.summaries[summary_key] = summary
+            while len(self.summaries) > self.max_summaries:
+                self.summaries.popitem(last=False)
+
+    def _drop_summaries(self, path):
+        for summary_key in [k for k in self.summaries if k[0] == path]:
+            del self.summaries[summary_key]
+
+    def invalidate(self, path):
+        path = os.path.realpath(path)
+        with self._lock:
+            if self.files.pop(path, None) is not None:
+                self._drop_summaries(path)
+            aliases = set(self._aliases.get(path, ()))
+        # inspect reads files through linecache, under the path the code was compiled with
+        for alias in aliases | {path}:
+            linecache.checkcache(alias)
+
+
+_source_index = SourceIndex()
+
+
+def get_source_index() -> SourceIndex:
+    return _source_index
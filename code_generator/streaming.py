@@ -0,0 +1,150 @@
+import re
+import codeop
+import textwrap
+import warnings
+from .structured import is_section_header
+from .exceptions import InvalidResponseException
+
+# Only the start of a code response is checked; the rest is just read
+MAX_CHECKED_LINES = 40
+
+_FENCE = re.compile(r"^\s*```")
+
+
+class ResponseParser:
+    """
+    Reads a streamed response line by line as it arrives.
+    feed() takes the next chunk and returns True once the response is complete and the rest of
+    the stream is not needed. With abort=True a parser raises InvalidResponseException as soon as
+    the response clearly is not what was asked for, so it can be asked for again; with abort=False
+    the response is read to the end whatever it looks like, and valid tells whether it passed.
+    """
+    def __init__(self, abort=True):
+        self.abort = abort
+        self.valid = True
+        self.text = ""
+        self._partial_line = ""
+
+    @classmethod
+    def check_response(cls, response) -> bool:
+        """
+        Whether response, read in full, passes the checks made while it streams.
+        """
+        parser = cls(abort=False)
+        parser.feed(response + "\n")
+        return parser.valid
+
+    def feed(self, chunk) -> bool:
+        self.text += chunk
+        *lines, self._partial_line = (self._partial_line + chunk).split("\n")
+        return any(self.line(line) for line in lines)
+
+    def line(self, line) -> bool:
+        return False
+
+    def invalid(self, reason):
+        self.valid = False
+        if self.abort:
+            raise InvalidResponseException(reason)
+
+    def result(self) -> str:
+        return self.text.strip()
+
+
+class FirstLineParser(ResponseParser):
+    """
+    For one-line answers such as "class", "None" or a method name: done after the first line.
+    """
+    def line(self, line):
+        return bool(line.strip()) and not _FENCE.match(line)
+
+    def result(self):
+        for line in self.text.splitlines():
+            if line.strip() and not _FENCE.match(line):
+                return line.strip()
+        return ""
+
+
+class CodeParser(ResponseParser):
+    """
+    For code: Markdown fences are dropped as they arrive, and the first lines are compiled as they
+    complete, so a response that starts with anything but Python (e.g. an explanation) is stopped
+    at its first line.
+    """
+    def __init__(self, abort=True):
+        super().__init__(abort)
+        self.lines = []
+        self.checked = False
+
+    def line(self, line):
+        if _FENCE.match(line):
+            return False
+        self.lines.append(line)
+        if not self.checked:
+            self.check(line)
+        return False
+
+    def check(self, line):
+        source = textwrap.dedent("\n".join(self.lines)) + "\n"
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                # None while the code so far is valid but incomplete
+                compiled = codeop.compile_command(source, symbol="exec")
+        except (SyntaxError, ValueError, OverflowError):
+            self.checked = True
+            self.invalid(f"Response is not Python code: {line.strip()[:80]!r}")
+            return
+        if compiled is not None or len(self.lines) >= MAX_CHECKED_LINES:
+            self.checked = True
+
+    def result(self):
+        lines = self.lines
+        if self._partial_line and not _FENCE.match(self._partial_line):
+            lines = lines + [self._partial_line]
+        return "\n".join(lines).strip()
+
+
+class SectionParser(ResponseParser):
+    """
+    For sectioned responses (structured.py): the response must start with a section header,
+    and the code sections are checked like CodeParser checks code.
+    """
+    def __init__(self, abort=True):
+        super().__init__(abort)
+        self.started = False
+        self.code = None
+
+    def line(self, line):
+        if _FENCE.match(line) or not line.strip():
+            return False
+        if is_section_header(line):
+            self.started = True
+            header = line.strip("#: \t").upper()
+            self.code = CodeParser(self.abort) if header == "CODE" or header.startswith("MEMBER") else None
+        elif not self.started:
+            self.started = True
+            self.invalid(f"Response does not start with a section header: {line.strip()[:80]!r}")
+        elif self.code is not None:
+            self.code.line(line)
+        return False
+
+
+class PatchParser(ResponseParser):
+    """
+    For unified diffs (patching.py): the response must start with a file header or a hunk header.
+    """
+    def __init__(self, abort=True):
+        super().__init__(abort)
+        self.started = False
+
+    def line(self, line):
+        if _FENCE.match(line) or not line.strip() or self.started:
+            return False
+        self.started = True
+        if not line.startswith(("@@", "--- ", "diff ")):
+            self.invalid(f"Response is not a patch: {line.strip()[:80]!r}")
+        return False
+
+    def result(self):
+        return "\n".join(line for line in self.text.splitlines() if not _FENCE.match(line)).strip("\n")
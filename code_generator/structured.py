@@ -0,0 +1,139 @@
+import ast
+import re
+import textwrap
+
+SECTION_HEADERS = {
+    "code": "### CODE",
+    "imports": "### IMPORTS",
+    "commit_message": "### COMMIT MESSAGE",
+    "return_value": "### RETURN VALUE",
+}
+
+_HEADER_PATTERN = re.compile(r"^\s*#{2,}\s*(CODE|IMPORTS|COMMIT MESSAGE|RETURN VALUE|MEMBER\s+[A-Za-z_]\w*)\s*:?\s*$", re.IGNORECASE)
+
+
+def is_section_header(line):
+    return _HEADER_PATTERN.match(line) is not None
+
+
+def member_header(name):
+    return f"### MEMBER {name}"
+
+
+def strip_markdown(text):
+    # Remove the Markdown formatting
+    text = text.strip()
+    text = text.replace("```python", "")
+    text = text.replace("```", "")
+    return text.strip()
+
+
+class StructuredResponse:
+    """
+    The sections of a single-shot structured response.
+    A section is None if it is missing from the response or could not be parsed,
+    in which case the caller falls back to a separate model call for it.
+    """
+    def __init__(self, code=None, imports=None, commit_message=None, return_value=None):
+        self.code = code
+        self.imports = imports
+        self.commit_message = commit_message
+        self.return_value = return_value
+
+    @classmethod
+    def parse(cls, response):
+        sections = split_sections(response)
+        return cls(
+            code=_parse_code(sections.get("code")),
+            imports=_parse_imports(sections.get("imports")),
+            commit_message=sections.get("commit_message") or None,
+            return_value=_parse_expression(sections.get("return_value")),
+        )
+
+
+class BatchResponse:
+    """
+    The sections of a batched response that implements several members of one class.
+    members maps each member name to its code; members that are missing or do not
+    parse are left out.
+    """
+    def __init__(self, members=None, imports=None, commit_message=None):
+        self.members = members or {}
+        self.imports = imports
+        self.commit_message = commit_message
+
+    @classmethod
+    def parse(cls, response, names):
+        sections = split_sections(response)
+        members = {}
+        for name in names:
+            code = _parse_code(sections.get(f"member_{name.lower()}"))
+            if code is not None and name in _defined_names(code):
+                members[name] = code
+        return cls(
+            members=members,
+            imports=_parse_imports(sections.get("imports")),
+            commit_message=sections.get("commit_message") or None,
+        )
+
+
+def split_sections(response):
+    """
+    Split a response into its sections, keyed by lower-case header name with spaces replaced by underscores.
+    """
+    sections = {}
+    current = None
+    for line in response.splitlines():
+        match = _HEADER_PATTERN.match(line)
+        if match:
+            current = re.sub(r"\s+", "_", match.group(1).lower())
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    return {name: strip_markdown("\n".join(lines)) for name, lines in sections.items()}
+
+
+def _parse_code(code):
+    if not code:
+        return None
+    try:
+        ast.parse(textwrap.dedent(code))
+    except SyntaxError:
+        return None
+    return code
+
+
+def _parse_imports(imports):
+    if imports is None:
+        return None
+    if imports in ("None", "none", ""):
+        return ""
+    try:
+        tree = ast.parse(textwrap.dedent(imports))
+    except SyntaxError:
+        return None
+    if not all(isinstance(node, (ast.Import, ast.ImportFrom)) for node in tree.body):
+        return None
+    return imports
+
+
+def _parse_expression(expression):
+    if not expression:
+        return None
+    try:
+        ast.parse(expression, mode="eval")
+    except SyntaxError:
+        return None
+    return expression
+
+
+def _defined_names(code):
+    names = set()
+    for node in ast.parse(textwrap.dedent(code)).body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.Assign):
+            names.update(target.id for target in node.targets if isinstance(target, ast.Name))
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            names.add(node.target.id)
+    return names
@@ -1,76 +1,383 @@
-import types
+import os
 import inspect
+import logging
+import weakref
 from . import config
+from .aio import run_generation
 from .code_writer import CodeWriter
 from .code_generator import CodeGenerator
+from .background import get_generation_pool
+from .exceptions import GenerationPendingException
+from .exceptions import CodeWriterException
+from .exceptions import CodeGenerationException
+from .installer import install_code
+from .pipeline import Pipeline
+from .file_writer import Patch
+from .recorder import get_recorder
+from .singleflight import get_single_flight
+from .snapshot import StackSnapshot
+
+logger = logging.getLogger(__name__)
+
+SPECIAL_METHODS = (
+    "__str__",
+    "__repr__",
+    "__int__",
+    "__float__",
+    "__bool__",
+    "__complex__",
+    "__hash__",
+    "__len__",
+    "__iter__",
+    "__getitem__",
+    "__setitem__",
+    "__delitem__",
+    "__add__",
+    "__sub__",
+    "__mul__",
+    "__truediv__",
+    "__floordiv__",
+    "__mod__",
+    "__pow__",
+    "__lt__",
+    "__le__",
+    "__eq__",
+    "__ne__",
+    "__gt__",
+    "__ge__",
+    "__and__",
+    "__or__",
+    "__xor__",
+    "__invert__",
+    "__lshift__",
+    "__rshift__",
+    "__rlshift__",
+    "__rrshift__",
+    "__contains__",
+    "__missing__",
+    "__enter__",
+    "__exit__",
+    "__next__",
+    "__aenter__",
+    "__aexit__",
+    "__aiter__",
+    "__anext__",
+    "__await__",
+)
+
+
+# id(owner) -> (weak reference to the owner, weak references to its proxies by name). Kept out of the owner, whose
+# __dict__ may be printed, compared or serialized, and keyed by id as the owner's __eq__ and __hash__
+# may be generated code too.
+_proxies = {}
+
+
+def _forget_owner(key, ref):
+    entry = _proxies.get(key)
+    if entry is not None and entry[0] is ref:
+        del _proxies[key]
+
+
+def _normalize(code):
+    # Code without its indentation and blank lines, to find generated code in the file it was placed in
+    return "\n".join(line.strip() for line in code.splitlines() if line.strip())
+
 
 class UniversalAttribute:
     """
     This class is used to delay the generation of the code for a method until it is called.
+    The special methods are defined once on the class, below. Proxies are memoized per
+    (owner, name) while they are in use, so repeated misses get the same proxy. The memo
+    holds neither the owner nor the proxies, so both go away as usual.
     """
+    __slots__ = ("name", "owner", "__weakref__")
+
     def __init__(self, name, owner):
-        print(f"LazyAttribute: __init__ called for {name}")
+        logger.debug("LazyAttribute: __init__ called for %s", name)
         self.name = name
         self.owner = owner
 
-        # Define all the special methods
-        special_methods = [
-                "__str__", "__repr__", "__int__", "__float__", "__bool__", "__complex__", "__hash__", "__len__", "__iter__", "__getitem__", "__setitem__", "__delitem__", "__add__", "__sub__", "__mul__", "__truediv__", "__floordiv__", "__mod__", "__pow__", "__lt__", "__le__", "__eq__", "__ne__", "__gt__", "__ge__", "__and__", "__or__", "__xor__", "__invert__", "__lshift__", "__rshift__", "__rlshift__", "__rrshift__", "__contains__", "__missing__", "__enter__", "__exit__", "__next__", "__aenter__", "__aexit__", "__aiter__", "__anext__", "__await__"
-                ]
-
-        for method in special_methods:
-            setattr(self.__class__, method, types.MethodType(self._make_special_method(method), self))
-
-    def _make_special_method(self, method_name):
-        def _special_method(self, *args, **kwargs):
-            nonlocal method_name
-            print(f"LazyAttribute: _special_method called for {self.name}")
-            # Generate the code
-            method = CodeGenerator().decide_which_method_sets_attribute(cls=self.owner.__class__, attribute_name=self.name, stack=inspect.stack())
-            if method == "None":
-                # Implement a new method to set the attribute
-                code = CodeGenerator().generate_method_for_attribute(self.owner.__class__, self.name, inspect.stack())
-                class_source = CodeWriter().insert_code(cls=self.owner.__class__, code=code)
-                imports = CodeGenerator().generate_imports(code)
-                class_source = CodeWriter().insert_code(main_source=class_source, code=imports)
-                commit_message = CodeGenerator().generate_commit_message(old_code="", new_code=code)
-                CodeWriter().commit_changes(self.owner.__class__, class_source, commit_message)
-            elif method == "class":
-                # Add the attribute to the class source as a class attribute
-                code = CodeGenerator().generate_class_attribute(self.owner.__class__, self.name, inspect.stack())
-                class_source = CodeWriter().insert_code(cls=self.owner.__class__, code=code)
-                imports = CodeGenerator().generate_imports(code)
-                class_source = CodeWriter().insert_code(main_source=class_source, code=imports)
-                commit_message = CodeGenerator().generate_commit_message(old_code="", new_code=code)
-                CodeWriter().commit_changes(self.owner.__class__, class_source, commit_message)
-            else:
-                # Modify an existing method to set the attribute
-                existing_method_source = inspect.getsource(self.owner.__class__.__dict__[method])
-                code = CodeGenerator().modify_method_for_attribute(self.owner.__class__, self.name, inspect.stack(), method)
-                class_source = CodeWriter().replace_code(cls=self.owner.__class__, old_code=existing_method_source, new_code=code)
-                imports = CodeGenerator().generate_imports(code)
-                class_source = CodeWriter().insert_code(main_source=class_source, code=imports)
-                commit_message = CodeGenerator().generate_commit_message(old_code=existing_method_source, new_code=code)
-                CodeWriter().commit_changes(self.owner.__class__, class_source, commit_message)
-
-            if config.after_generation == "continue":
-                return CodeGenerator().generate_return_value(code, self.name, method_name, args, kwargs)
-            elif config.after_generation == "raise":
-                raise AttributeError( f"Attribute {self.name} did not exist on class {self.owner.__class__.__name__}.  It has been generated by the code generator and written to file {inspect.getsourcefile(self.owner.__class__)}.  Please validate the generated code and try again.")
-
-        return _special_method
+    @classmethod
+    def for_owner(cls, owner, name):
+        key = id(owner)
+        entry = _proxies.get(key)
+        # An entry whose owner is gone may still be there if its id was reused
+        if entry is None or entry[0]() is not owner:
+            try:
+                ref = weakref.ref(owner, lambda ref: _forget_owner(key, ref))
+            except TypeError:
+                # Owners that cannot be weakly referenced are not memoized
+                return cls(name, owner)
+            entry = _proxies[key] = (ref, {})
+        proxy_ref = entry[1].get(name)
+        proxy = proxy_ref() if proxy_ref is not None else None
+        if proxy is None or type(proxy) is not cls:
+            proxy = cls(name, owner)
+            entry[1][name] = weakref.ref(proxy)
+        return proxy
+
+    @classmethod
+    def forget(cls, owner, name):
+        # Drop the memoized proxy, the member now exists
+        entry = _proxies.get(id(owner))
+        if entry is not None and entry[0]() is owner:
+            entry[1].pop(name, None)
+
+    def _generate_and_write(self, generate, existing_method_source=""):
+        """
+        Generate code with generate(structured) and write it to the class file.
+        Returns the code and, in structured mode, the return value expression.
+        Imports and the commit message only depend on the generated code, so they run
+        concurrently; the code is placed when the file is written, against its current source.
+        With AI placement the AI is asked where the code goes in a stage of its own, next to them,
+        rather than while the file is locked for the write.
+        In structured mode the imports and commit message come from the same response as the
+        code and are only asked for separately if they could not be parsed from it.
+        With config.hot_install the code is also installed on the class in memory.
+        """
+        cls = self.owner.__class__
+        structured = config.generation_mode == "structured"
+
+        def get_code(response):
+            if response is not None and response.code:
+                return response.code
+            return generate(False)
+
+        def get_imports(response, code):
+            if response is not None and response.imports is not None:
+                return response.imports
+            return CodeGenerator().generate_imports(code)
+
+        def get_commit_message(response, code):
+            if response is not None and response.commit_message:
+                return f"AI generated {response.commit_message}"
+            return CodeGenerator().generate_commit_message(old_code=existing_method_source, new_code=code)
+
+        def place(code):
+            if config.placement != "ai" or existing_method_source.strip() or not code.strip():
+                return None
+            writer = CodeWriter()
+            try:
+                return writer.anchor_code(writer.read_source(inspect.getsourcefile(cls)), code, cls.__name__)
+            except (OSError, CodeWriterException) as e:
+                # The AI is asked again when the file is written
+                logger.info("AI placement of %s.%s failed: %s", cls.__qualname__, self.name, e)
+                return None
+
+        def write(code, imports, commit_message, anchor):
+            patches = [
+                Patch(cls.__qualname__, code, old_code=existing_method_source, message=commit_message, anchor=anchor),
+                Patch(cls.__qualname__, imports, imports=True),
+            ]
+            return CodeWriter().apply_changes(inspect.getsourcefile(cls), patches)
+
+        pipeline = Pipeline()
+        pipeline.add("response", lambda: generate(True) if structured else None)
+        pipeline.add("code", get_code, "response")
+        pipeline.add("imports", get_imports, "response", "code")
+        pipeline.add("commit_message", get_commit_message, "response", "code")
+        pipeline.add("placement", place, "code")
+        pipeline.add("commit", write, "code", "imports", "commit_message", "placement")
+        results = pipeline.run()
+        if config.hot_install:
+            self._install(results["code"], results["imports"])
+        UniversalAttribute.forget(self.owner, self.name)
+        response = results["response"]
+        return results["code"], response.return_value if response is not None else None
+
+    def _single_flight(self, generate, *args):
+        """
+        Run generate(*args) unless the same member of the same class is already being generated,
+        in this process or in another one, in which case wait for that generation instead.
+        """
+        cls = self.owner.__class__
+        class_file = os.path.realpath(inspect.getsourcefile(cls))
+        key = (class_file, cls.__qualname__, self.name)
+        single_flight = get_single_flight()
+
+        def run():
+            code, return_value = generate(*args)
+            single_flight.record_result(key, [code, return_value])
+            return code, return_value
+
+        return single_flight.do(key, run, already_done=lambda: self._already_generated(key, class_file))
+
+    def _already_generated(self, key, class_file):
+        """
+        The result of a generation for key that another process finished while we waited for the lock.
+        Generations are recorded by key rather than looked up among the class members, as the code
+        generated for an attribute may be a method that sets it on the instance.
+        """
+        recorded = get_single_flight().recorded_result(key)
+        if recorded is None:
+            return None
+        code, return_value = recorded
+        try:
+            source = CodeWriter().read_source(class_file)
+        except (OSError, CodeWriterException):
+            return None
+        # The generated code may have been removed since, in a review for instance
+        if _normalize(code) not in _normalize(source):
+            return None
+        if config.hot_install:
+            self._install(code)
+        return code, return_value
+
+    def _record_use(self, special_method_name, args, kwargs):
+        # In record mode the use is only recorded, and the attribute stays missing until the recorder is flushed
+        get_recorder().record_use(self.owner.__class__, self.name, special_method_name, args, kwargs)
+        raise AttributeError(f"Attribute {self.name} did not exist on class {self.owner.__class__.__name__}.  It has been recorded and will be generated when the recorder is flushed.")
+
+    def _install(self, code, imports=""):
+        try:
+            install_code(self.owner.__class__, code, imports)
+        except CodeGenerationException as e:
+            logger.warning("%s", e)
+
+    def _is_installed(self):
+        return any(self.name in vars(cls) for cls in self.owner.__class__.__mro__)
+
+    def _continue(self, code, return_value, special_method_name, args, kwargs):
+        """
+        The result of the call that was made on this proxy, through the generated member
+        if it is installed, otherwise from the return value expression or the AI.
+        """
+        if self._is_installed():
+            value = getattr(self.owner, self.name)
+            if special_method_name == "__call__":
+                return value(*args, **kwargs)
+            special_method = getattr(type(value), special_method_name, None)
+            if special_method is not None:
+                return special_method(value, *args, **kwargs)
+        return CodeGenerator().evaluate_return_value(code, self.name, special_method_name, args, kwargs, expression=return_value)
+
+    def generate_call(self, stack, args, kwargs):
+        """
+        Generate the method that was called, write it, and return the code and return value expression.
+        """
+        return self._single_flight(self._generate_call, stack, args, kwargs)
+
+    def _generate_call(self, stack, args, kwargs):
+        # An installed method gives the return value itself
+        return_value_for = ("__call__", args, kwargs) if config.after_generation == "continue" and not config.hot_install else None
+        return self._generate_and_write(lambda structured: CodeGenerator().generate_method(self.owner.__class__, self.name, args, kwargs, stack, structured=structured, return_value_for=return_value_for))
+
+    def generate_attribute(self, stack, special_method_name, args, kwargs):
+        """
+        Generate the attribute that was used through special_method_name, write it, and return the code and return value expression.
+        """
+        return self._single_flight(self._generate_attribute, stack, special_method_name, args, kwargs)
+
+    def _generate_attribute(self, stack, special_method_name, args, kwargs):
+        method = CodeGenerator().decide_which_method_sets_attribute(cls=self.owner.__class__, attribute_name=self.name, stack=stack)
+        return_value_for = (special_method_name, args, kwargs) if config.after_generation == "continue" else None
+        if method == "None":
+            # Implement a new method to set the attribute
+            return self._generate_and_write(lambda structured: CodeGenerator().generate_method_for_attribute(self.owner.__class__, self.name, stack, structured=structured, return_value_for=return_value_for))
+        elif method == "class":
+            # Add the attribute to the class source as a class attribute
+            if config.hot_install:
+                # The installed attribute gives the value itself
+                return_value_for = None
+            return self._generate_and_write(lambda structured: CodeGenerator().generate_class_attribute(self.owner.__class__, self.name, stack, structured=structured, return_value_for=return_value_for))
+        else:
+            # Modify an existing method to set the attribute
+            existing_method_source = inspect.getsource(self.owner.__class__.__dict__[method])
+            return self._generate_and_write(lambda structured: CodeGenerator().modify_method_for_attribute(self.owner.__class__, self.name, stack, method, structured=structured, return_value_for=return_value_for), existing_method_source)
+
+    def _submit_background(self, generate, *args):
+        # Hand the generation to the background pool and give control back right away
+        future = get_generation_pool().submit((self.owner.__class__, self.name), generate, *args)
+        if future is None:
+            message = f"Attribute {self.name} did not exist on class {self.owner.__class__.__name__}.  The background generation queue is full, so it was not generated."
+        else:
+            message = f"Attribute {self.name} did not exist on class {self.owner.__class__.__name__}.  It is being generated in the background."
+        raise GenerationPendingException(message, future)
 
     def __call__(self, *args, **kwargs):
-        print("LazyAttribute: __call__ called")
+        logger.debug("LazyAttribute: __call__ called for %s", self.name)
+        if config.record_mode:
+            self._record_use("__call__", args, kwargs)
+        # Stages run on worker threads, so the stack has to be taken here
+        stack = StackSnapshot.capture()
+        if config.background_generation:
+            self._submit_background(self.generate_call, stack, args, kwargs)
         # Generate the method
-        code = CodeGenerator().generate_method(self.owner.__class__, self.name, args, kwargs, inspect.stack())
-        class_source = CodeWriter().insert_code(cls=self.owner.__class__, code=code)
-        imports = CodeGenerator().generate_imports(code)
-        class_source = CodeWriter().insert_code(main_source=class_source, code=imports)
-        commit_message = CodeGenerator().generate_commit_message(old_code="", new_code=code)
-        CodeWriter().commit_changes(self.owner.__class__, class_source, commit_message)
+        code, return_value = self.generate_call(stack, args, kwargs)
+        if config.after_generation == "continue":
+            return self._continue(code, return_value, "__call__", args, kwargs)
+        elif config.after_generation == "raise":
+            raise AttributeError( f"Attribute {self.name} did not exist on class {self.owner.__class__.__name__}.  It has been generated by the code generator and committed to branch {config.git_branch}.  Please validate the generated code and try again.")
+
+
+def _make_special_method(method_name):
+    def _special_method(self, *args, **kwargs):
+        logger.debug("LazyAttribute: %s called for %s", method_name, self.name)
+        if config.record_mode:
+            self._record_use(method_name, args, kwargs)
+        # Stages run on worker threads, so the stack has to be taken here
+        stack = StackSnapshot.capture()
+        if config.background_generation:
+            self._submit_background(self.generate_attribute, stack, method_name, args, kwargs)
+        # Generate the code
+        code, return_value = self.generate_attribute(stack, method_name, args, kwargs)
+
         if config.after_generation == "continue":
-            return CodeGenerator().generate_return_value(code, self.name, "__call__", args, kwargs)
+            return self._continue(code, return_value, method_name, args, kwargs)
         elif config.after_generation == "raise":
+            raise AttributeError( f"Attribute {self.name} did not exist on class {self.owner.__class__.__name__}.  It has been generated by the code generator and written to file {inspect.getsourcefile(self.owner.__class__)}.  Please validate the generated code and try again.")
+
+    return _special_method
+
+
+for _method_name in SPECIAL_METHODS:
+    setattr(UniversalAttribute, _method_name, _make_special_method(_method_name))
+del _method_name
+
+
+class AsyncUniversalAttribute(UniversalAttribute):
+    """
+    The proxy of AsyncGenerativeBase: calling it returns a coroutine, and awaiting it gives the
+    value of the attribute. The generation runs off the event loop (aio.run_generation).
+    Other uses of the proxy generate synchronously, like UniversalAttribute.
+    """
+    __slots__ = ()
+
+    def __call__(self, *args, **kwargs):
+        logger.debug("AsyncLazyAttribute: __call__ called for %s", self.name)
+        if config.record_mode:
+            self._record_use("__call__", args, kwargs)
+        return self._call(StackSnapshot.capture(), args, kwargs)
+
+    def __await__(self):
+        logger.debug("AsyncLazyAttribute: __await__ called for %s", self.name)
+        if config.record_mode:
+            self._record_use("__await__", (), {})
+        return self._value(StackSnapshot.capture()).__await__()
+
+    async def _call(self, stack, args, kwargs):
+        code, return_value = await run_generation(self.generate_call, stack, args, kwargs)
+        if config.after_generation == "raise":
             raise AttributeError( f"Attribute {self.name} did not exist on class {self.owner.__class__.__name__}.  It has been generated by the code generator and committed to branch {config.git_branch}.  Please validate the generated code and try again.")
+        if config.after_generation != "continue":
+            return None
+        if self._is_installed():
+            # Called here, on the event loop, like any other method of the class
+            result = getattr(self.owner, self.name)(*args, **kwargs)
+        else:
+            result = await run_generation(CodeGenerator().evaluate_return_value, code, self.name, "__call__", args, kwargs, expression=return_value)
+        if inspect.isawaitable(result):
+            # A generated coroutine function
+            result = await result
+        return result
+
+    async def _value(self, stack):
+        code, return_value = await run_generation(self.generate_attribute, stack, "__await__", (), {})
+        if config.after_generation == "raise":
+            raise AttributeError( f"Attribute {self.name} did not exist on class {self.owner.__class__.__name__}.  It has been generated by the code generator and written to file {inspect.getsourcefile(self.owner.__class__)}.  Please validate the generated code and try again.")
+        if config.after_generation != "continue":
+            return None
+        if self._is_installed():
+            return getattr(self.owner, self.name)
+        return await run_generation(CodeGenerator().evaluate_return_value, code, self.name, "__await__", (), {}, expression=return_value)
 
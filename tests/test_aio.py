@@ -0,0 +1,93 @@
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+from code_generator import config
+from code_generator.backends import StubBackend, register_backend
+
+MODULE = '''from code_generator import AsyncGenerativeBase
+
+
+class Target(AsyncGenerativeBase):
+    pass
+'''
+
+
+def respond(prompt):
+    if "class attribute or an instance attribute" in prompt:
+        return "class"
+    if "Add the attribute" in prompt:
+        code = "name = 'target'"
+    else:
+        code = "def double(self, x):\n    return x * 2"
+    return f"### CODE\n{code}\n### IMPORTS\nNone\n### COMMIT MESSAGE\nAdd code\n### RETURN VALUE\nNone\n"
+
+
+class TestAsyncGenerativeBase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="code_generator_test_")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "async_target.py")
+        with open(self.path, "w") as f:
+            f.write(MODULE)
+        spec = importlib.util.spec_from_file_location("async_target", self.path)
+        self.module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = self.module
+        self.addCleanup(sys.modules.pop, spec.name)
+        spec.loader.exec_module(self.module)
+
+        self.backend = StubBackend(respond)
+        self.addCleanup(self.backend.close)
+        register_backend("test-stub", self.backend)
+        patcher = mock.patch.multiple(
+            config, backend="test-stub", fallback_backend=None, providers=None, hedge_after=None, cache_enabled=False,
+            git_branch=None, lock_dir=self.directory, generation_mode="structured", after_generation="continue",
+            hot_install=True, placement="ast", background_generation=False, record_mode=False,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_method_is_generated_and_awaited(self):
+        target = self.module.Target()
+        self.assertEqual(asyncio.run(target.double(2)), 4)
+        self.assertIn("def double(self, x):", self.read())
+        # Installed, so the next call is a plain method call
+        self.assertEqual(target.double(3), 6)
+        self.assertEqual(self.backend.server.requests, 1)
+
+    def test_attribute_is_generated_and_awaited(self):
+        self.assertEqual(asyncio.run(self._await_name()), "target")
+        self.assertIn("name = 'target'", self.read())
+
+    async def _await_name(self):
+        return await self.module.Target().name
+
+    def test_event_loop_keeps_running_during_generation(self):
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0.001)
+
+        async def main():
+            ticker = asyncio.ensure_future(tick())
+            try:
+                return await self.module.Target().double(5)
+            finally:
+                ticker.cancel()
+
+        self.assertEqual(asyncio.run(main()), 10)
+        self.assertGreater(len(ticks), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
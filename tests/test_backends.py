@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+from code_generator.backends import HttpBackend, StubServer, TgptBackend
+from code_generator.exceptions import BackendException
+
+
+class TestHttpBackend(unittest.TestCase):
+    def setUp(self):
+        self.responses = {}
+        self.server = StubServer(self.respond).start()
+        self.addCleanup(self.server.stop)
+        self.backend = HttpBackend(url=self.server.url)
+        self.addCleanup(self.backend.close)
+
+    def respond(self, prompt):
+        response = self.responses.get(prompt, f"answer to {prompt}")
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def test_complete(self):
+        self.assertEqual(self.backend.complete('say "hi"'), 'answer to say "hi"')
+
+    def test_connection_is_reused(self):
+        for i in range(3):
+            self.assertEqual(self.backend.complete(f"prompt {i}"), f"answer to prompt {i}")
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_stream(self):
+        self.responses["prompt"] = ["first ", "second ", "third"]
+        self.assertEqual("".join(self.backend.stream("prompt")), "first second third")
+        # The streamed response was read to the end, so its connection is reused
+        self.backend.complete("next")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_stream_stopped_early_closes_the_connection(self):
+        self.responses["prompt"] = (f"chunk {i} " for i in range(100))
+        stream = self.backend.stream("prompt")
+        next(stream)
+        stream.close()
+        self.backend.complete("next")
+        self.assertEqual(self.server.connections, 2)
+
+    def test_error_status(self):
+        self.responses["prompt"] = ValueError("no")
+        with self.assertRaises(BackendException) as raised:
+            self.backend.complete("prompt")
+        self.assertIn("500", str(raised.exception))
+        with self.assertRaises(BackendException):
+            "".join(self.backend.stream("prompt"))
+        # The error responses were read, so the connection was kept
+        self.assertEqual(self.backend.complete("next"), "answer to next")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_unreachable_server(self):
+        self.server.stop()
+        with self.assertRaises(BackendException):
+            HttpBackend(url=self.server.url).complete("prompt")
+
+
+class TestTgptBackend(unittest.TestCase):
+    def test_prompt_is_passed_as_is(self):
+        result = mock.Mock(stdout=" answer \n")
+        with mock.patch("code_generator.backends.subprocess.run", return_value=result) as run:
+            self.assertEqual(TgptBackend().complete('say "hi"', "provider"), "answer")
+        self.assertEqual(run.call_args[0][0], ["tgpt", "-q", "--provider", "provider", 'say "hi"'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+import unittest
+from code_generator.background import GenerationPool, get_generation_pool, get_indexing_pool
+
+
+class TestGenerationPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = GenerationPool(max_workers=1, max_queue=1)
+        self.addCleanup(self.pool.shutdown)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.started = threading.Event()
+
+    def block(self, result=None):
+        self.started.set()
+        self.release.wait(10)
+        return result
+
+    def test_full_pool_rejects(self):
+        running = self.pool.submit("a", self.block)
+        self.started.wait(10)
+        queued = self.pool.submit("b", self.block)
+        self.assertIsNone(self.pool.submit("c", self.block))
+        self.assertEqual(self.pool.stats()["rejected"], 1)
+        self.release.set()
+        running.result(10)
+        queued.result(10)
+
+    def test_same_key_is_not_submitted_twice(self):
+        first = self.pool.submit("key", self.block, "first")
+        self.assertIs(self.pool.submit("key", self.block, "second"), first)
+        self.release.set()
+        self.assertEqual(first.result(10), "first")
+        self.assertEqual(self.pool.stats()["submitted"], 1)
+
+    def test_stats(self):
+        pool = GenerationPool(max_workers=1, max_queue=2)
+        pool.submit("a", self.block)
+        self.started.wait(10)
+        pool.submit("b", self.block)
+        stats = pool.stats()
+        self.assertEqual((stats["running"], stats["queued"], stats["capacity"]), (1, 1, 3))
+        self.assertEqual(pool.queue_depth, 1)
+        failing = pool.submit("c", self.fail)
+        with self.assertLogs("code_generator.background", "WARNING"):
+            self.release.set()
+            # Waits for the done callbacks too
+            pool.shutdown()
+        with self.assertRaises(ValueError):
+            failing.result()
+        stats = pool.stats()
+        self.assertEqual((stats["submitted"], stats["completed"], stats["failed"], stats["rejected"]), (3, 2, 1, 0))
+        self.assertEqual((stats["running"], stats["queued"]), (0, 0))
+
+    @staticmethod
+    def fail():
+        raise ValueError("failed")
+
+
+class TestPools(unittest.TestCase):
+    def test_indexing_has_its_own_pool(self):
+        self.assertIsNot(get_indexing_pool(), get_generation_pool())
+        self.assertIs(get_indexing_pool(), get_indexing_pool())
+
+
+if __name__ == "__main__":
+    unittest.main()
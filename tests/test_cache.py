@@ -0,0 +1,113 @@
+import unittest
+from unittest import mock
+from code_generator import config
+from code_generator.backends import Backend, register_backend
+from code_generator.cache import ResponseCache
+from code_generator.code_generator import CodeGenerator
+from code_generator.exceptions import BackendException
+from code_generator.streaming import CodeParser
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(":memory:")
+        self.addCleanup(self.cache.close)
+
+    def test_key_depends_on_backend_and_provider(self):
+        keys = {ResponseCache.key("prompt"), ResponseCache.key("prompt", "http"), ResponseCache.key("prompt", "http", "other")}
+        self.assertEqual(len(keys), 3)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.max_entries = 2
+        with mock.patch("code_generator.cache.time.time", side_effect=[1, 2, 3, 4]):
+            self.cache.set("a", "1")
+            self.cache.set("b", "2")
+            # a is now more recently used than b
+            self.assertEqual(self.cache.get("a"), "1")
+            self.cache.set("c", "3")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), "1")
+        self.assertEqual(self.cache.get("c"), "3")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_eviction_by_size(self):
+        self.cache.max_bytes = 10
+        with mock.patch("code_generator.cache.time.time", side_effect=[1, 2, 3]):
+            self.cache.set("a", "x" * 4)
+            self.cache.set("b", "x" * 4)
+            self.cache.set("c", "x" * 4)
+        stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"]), (2, 8))
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_entry_expires_after_ttl(self):
+        self.cache.ttl = 10
+        with mock.patch("code_generator.cache.time.time", return_value=100):
+            self.cache.set("a", "1")
+        with mock.patch("code_generator.cache.time.time", return_value=110):
+            self.assertEqual(self.cache.get("a"), "1")
+        with mock.patch("code_generator.cache.time.time", return_value=111):
+            self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_expired_entries_are_removed_on_write(self):
+        self.cache.ttl = 10
+        with mock.patch("code_generator.cache.time.time", return_value=100):
+            self.cache.set("a", "1")
+        with mock.patch("code_generator.cache.time.time", return_value=200):
+            self.cache.set("b", "2")
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+
+class AnsweringBackend(Backend):
+    def __init__(self, response):
+        self.response = response
+
+    def complete(self, prompt, provider=None):
+        if self.response is None:
+            raise BackendException("Backend is down")
+        return self.response
+
+
+class TestFailoverCaching(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(":memory:")
+        self.addCleanup(self.cache.close)
+        register_backend("test-main", AnsweringBackend(None))
+        register_backend("test-fallback", AnsweringBackend("from fallback"))
+        patcher = mock.patch.multiple(config, backend="test-main", fallback_backend="test-fallback", provider="p",
+                                      providers=None, streaming=False, hedge_after=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("code_generator.code_generator.get_response_cache", return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_response_is_cached_under_the_backend_that_was_asked(self):
+        self.assertEqual(CodeGenerator().prompt_ai("prompt"), "from fallback")
+        self.assertEqual(self.cache.get(ResponseCache.key("prompt", "test-main", "p")), "from fallback")
+        self.assertIsNone(self.cache.get(ResponseCache.key("prompt", "test-fallback", "p")))
+        register_backend("test-fallback", AnsweringBackend(None))
+        self.assertEqual(CodeGenerator().prompt_ai("prompt"), "from fallback")
+
+    def test_invalid_response_is_not_cached(self):
+        register_backend("test-main", AnsweringBackend("Sure, here is the code:"))
+        with mock.patch.multiple(config, streaming=True, stream_retries=1):
+            # The last attempt is used anyway
+            self.assertEqual(CodeGenerator().prompt_ai("prompt", parser=CodeParser), "Sure, here is the code:")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_valid_response_is_cached(self):
+        register_backend("test-main", AnsweringBackend("```python\nx = 1\n```"))
+        self.assertEqual(CodeGenerator().prompt_ai("prompt", parser=CodeParser), "```python\nx = 1\n```")
+        self.assertEqual(self.cache.get(ResponseCache.key("prompt", "test-main", "p")), "```python\nx = 1\n```")
+
+    def test_response_of_the_configured_backend_is_answered_from_the_cache(self):
+        register_backend("test-main", AnsweringBackend("from main"))
+        self.assertEqual(CodeGenerator().prompt_ai("prompt"), "from main")
+        register_backend("test-main", AnsweringBackend(None))
+        self.assertEqual(CodeGenerator().prompt_ai("prompt"), "from main")
+
+
+if __name__ == "__main__":
+    unittest.main()
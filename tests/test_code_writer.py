@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+from code_generator import config
+from code_generator.code_writer import CodeWriter
+from code_generator.exceptions import CodeWriterException
+from code_generator.file_writer import Patch
+
+SOURCE = '''class A:
+    x = 1
+'''
+
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@example.com",
+    "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@example.com",
+    "GIT_CONFIG_GLOBAL": os.devnull, "GIT_CONFIG_NOSYSTEM": "1",
+}
+
+
+class GitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.repo = os.path.realpath(tempfile.mkdtemp(prefix="code_generator_test_"))
+        self.addCleanup(shutil.rmtree, self.repo)
+        for patcher in (
+            mock.patch.dict(os.environ, GIT_ENV),
+            mock.patch.multiple(config, git_branch="ai", auto_merge=True, placement="ast", hot_install=False, lock_dir=self.repo),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.git("init", "-q", "-b", "main")
+        self.a = self.write("a.py", SOURCE)
+        self.b = self.write("b.py", SOURCE)
+        self.git("add", ".")
+        self.git("commit", "-q", "-m", "initial")
+        self.head = self.git("rev-parse", "HEAD")
+
+    def git(self, *args):
+        return subprocess.run(["git", *args], cwd=self.repo, check=True, stdout=subprocess.PIPE, text=True).stdout.strip()
+
+    def write(self, name, content):
+        path = os.path.join(self.repo, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def show(self, revision, name):
+        return subprocess.run(["git", "show", f"{revision}:{name}"], cwd=self.repo, check=True, stdout=subprocess.PIPE, text=True).stdout
+
+
+class TestBranchCommit(GitTestCase):
+    def test_head_index_and_working_tree_edits_are_untouched(self):
+        # An edit the user has not committed
+        self.write("a.py", SOURCE + "\n\nUSER_EDIT = 1\n")
+        self.git("add", "a.py")
+        CodeWriter().apply_changes(self.a, [Patch("A", "y = 2", message="Add A.y")])
+
+        self.assertEqual(self.git("rev-parse", "HEAD"), self.head)
+        self.assertEqual(self.git("symbolic-ref", "HEAD"), "refs/heads/main")
+        # The index still holds the user's edit without the generated code
+        self.assertEqual(self.git("diff", "--cached", "--name-only"), "a.py")
+        self.assertNotIn("y = 2", self.show("", "a.py"))
+        # With auto_merge the working tree has both
+        self.assertIn("USER_EDIT = 1", self.read(self.a))
+        self.assertIn("y = 2", self.read(self.a))
+        # The branch has the generated code on top of the committed file, without the user's edit
+        branch_source = self.show("ai", "a.py")
+        self.assertIn("y = 2", branch_source)
+        self.assertNotIn("USER_EDIT", branch_source)
+        self.assertEqual(self.git("rev-parse", "ai^"), self.head)
+        self.assertEqual(self.git("log", "-1", "--format=%s", "ai"), "Add A.y")
+
+    def test_without_auto_merge_the_working_tree_is_not_written(self):
+        with mock.patch.object(config, "auto_merge", False):
+            CodeWriter().apply_changes(self.a, [Patch("A", "y = 2", message="Add A.y")])
+            CodeWriter().apply_changes(self.a, [Patch("A", "z = 3", message="Add A.z")])
+        self.assertEqual(self.read(self.a), SOURCE)
+        branch_source = self.show("ai", "a.py")
+        self.assertIn("y = 2", branch_source)
+        self.assertIn("z = 3", branch_source)
+
+    def test_batch_makes_one_commit(self):
+        writer = CodeWriter()
+        with writer.git_batch():
+            writer.apply_changes(self.a, [Patch("A", "y = 2", message="Add A.y")])
+            writer.apply_changes(self.b, [Patch("A", "z = 3", message="Add A.z")])
+            # A second write of the same file in the batch builds on the first
+            writer.apply_changes(self.a, [Patch("A", "w = 4", message="Add A.w")])
+            self.assertFalse(self.git("branch", "--list", "ai"))
+        self.assertEqual(self.git("rev-parse", "ai^"), self.head)
+        self.assertEqual(self.git("log", "-1", "--format=%B", "ai"), "Add A.y\n\nAdd A.z\n\nAdd A.w")
+        self.assertIn("y = 2", self.show("ai", "a.py"))
+        self.assertIn("w = 4", self.show("ai", "a.py"))
+        self.assertIn("z = 3", self.show("ai", "b.py"))
+
+    def test_concurrent_ref_update_is_retried(self):
+        shell = CodeWriter.shell
+        moved = []
+
+        def move_branch_first(writer, command, **kwargs):
+            if command[1] == "update-ref" and not moved:
+                # Another process commits to the branch between our commit-tree and update-ref
+                tree = self.git("rev-parse", "HEAD^{tree}")
+                commit = self.git("commit-tree", tree, "-p", self.head, "-m", "concurrent")
+                self.git("update-ref", "refs/heads/ai", commit)
+                moved.append(commit)
+            return shell(writer, command, **kwargs)
+
+        with mock.patch.object(CodeWriter, "shell", move_branch_first):
+            CodeWriter().git_commit_files({self.a: SOURCE + "y = 2\n"}, "Add A.y")
+        self.assertEqual(self.git("rev-parse", "ai^"), moved[0])
+        self.assertEqual(self.show("ai", "a.py"), SOURCE + "y = 2\n")
+
+
+class TestAIPlacement(unittest.TestCase):
+    SOURCE = "class A:\n    x = 1\n\n    y = 2\n"
+
+    def setUp(self):
+        patcher = mock.patch.object(config, "placement", "ai")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_anchor_places_the_code_without_asking_again(self):
+        writer = CodeWriter()
+        with mock.patch.object(CodeWriter, "generate_info", return_value="2") as generate_info:
+            anchor = writer.anchor_code(self.SOURCE, "z = 3", "A")
+        self.assertEqual(anchor, ("    x = 1", 0))
+        # Lines were added before the anchor in the meantime
+        source = "# comment\n" + self.SOURCE
+        with mock.patch.object(CodeWriter, "generate_info") as generate_info:
+            placed = writer.insert_code(main_source=source, code="z = 3", class_name="A", anchor=anchor)
+        generate_info.assert_not_called()
+        self.assertEqual(placed.split("\n")[:4], ["# comment", "class A:", "    x = 1", "    ## AI GENERATED CODE; PLEASE REVIEW ##"])
+
+    def test_missing_anchor_asks_again(self):
+        with mock.patch.object(CodeWriter, "generate_info", return_value="1") as generate_info:
+            placed = CodeWriter().insert_code(main_source=self.SOURCE, code="z = 3", class_name="A", anchor=("    w = 0", 0))
+        generate_info.assert_called_once()
+        self.assertIn("z = 3", placed)
+
+    def test_invalid_line_number(self):
+        with mock.patch.object(CodeWriter, "generate_info", return_value="99"):
+            with self.assertRaises(CodeWriterException):
+                CodeWriter().anchor_code(self.SOURCE, "z = 3", "A")
+
+
+if __name__ == "__main__":
+    unittest.main()
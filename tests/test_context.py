@@ -0,0 +1,62 @@
+import unittest
+from code_generator.context import ContextBuilder, MIN_TRUNCATED_CHARS
+
+
+def code(name, lines):
+    return "".join(f"    {name}_{i} = {i}  # some padding to make the line longer\n" for i in range(lines))
+
+
+class TestContextBuilder(unittest.TestCase):
+    def builder(self, budget):
+        builder = ContextBuilder(budget)
+        for i in range(40):
+            section = ("Class source", "Related classes", "Stack")[i % 3]
+            builder.add(section, i, code(f"full{i}", 30), code(f"summary{i}", 5))
+        return builder
+
+    def test_context_stays_within_budget(self):
+        for budget in (1000, 5000, 24000, 24048, 60000):
+            builder = self.builder(budget)
+            context = builder.build()
+            self.assertLessEqual(len(context), budget)
+            self.assertEqual(builder.size, len(context))
+            self.assertTrue(builder.omitted or builder.elided or budget == 60000)
+
+    def test_omitted_pieces_are_counted(self):
+        builder = self.builder(3000)
+        context = builder.build()
+        self.assertGreater(builder.omitted, 0)
+        self.assertIn(f"({builder.omitted} less relevant pieces of context were left out)", context)
+
+    def test_building_again_gives_the_same_context(self):
+        builder = self.builder(5000)
+        context = builder.build()
+        counts = builder.elided, builder.omitted
+        self.assertEqual(builder.build(), context)
+        self.assertEqual((builder.elided, builder.omitted), counts)
+
+    def test_most_relevant_piece_is_kept_in_full(self):
+        builder = ContextBuilder(2000)
+        builder.add("Stack", 1, "less relevant\n" * 200)
+        builder.add("Class source", 0, "relevant\n")
+        context = builder.build()
+        self.assertLess(context.index("Stack:"), context.index("Class source:"))
+        self.assertIn("relevant\n", context)
+        self.assertIn("... (truncated)", context)
+        self.assertLessEqual(len(context), 2000)
+
+    def test_piece_too_small_to_truncate_is_left_out(self):
+        builder = ContextBuilder(MIN_TRUNCATED_CHARS)
+        builder.add("Stack", 0, "x\n" * MIN_TRUNCATED_CHARS)
+        context = builder.build()
+        self.assertEqual(builder.omitted, 1)
+        self.assertLessEqual(len(context), MIN_TRUNCATED_CHARS)
+
+    def test_no_budget(self):
+        builder = ContextBuilder(0)
+        builder.add("Stack", 0, "x" * 100000)
+        self.assertEqual(builder.build(), f"Stack:\n {'x' * 100000}\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
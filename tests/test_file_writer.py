@@ -0,0 +1,160 @@
+import os
+import ast
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from code_generator import config
+from code_generator.code_writer import CodeWriter
+from code_generator.exceptions import CodeWriterException
+from code_generator.file_writer import FileWriter, Patch, get_file_writer
+
+SOURCE = '''import os
+
+
+class A:
+    x = 1
+
+    def method(self):
+        return self.x
+
+
+class B:
+    pass
+'''
+
+
+class FileWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="code_generator_test_")
+        self.path = os.path.join(self.directory, "module.py")
+        with open(self.path, "w") as f:
+            f.write(SOURCE)
+        patcher = mock.patch.multiple(config, git_branch=None, placement="ast", lock_dir=self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory)
+        # CodeWriter.commit_source writes through the shared writer, which has to hold the file lock
+        self.writer = get_file_writer()
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+
+class TestBatch(FileWriterTestCase):
+    def test_batch_is_written_once(self):
+        patches = [
+            Patch("A", "def added(self):\n    return 2", message="Add A.added"),
+            Patch("A", "import sys"),
+            Patch("B", "y = 2", message="Add B.y"),
+            Patch("A", "def method(self):\n    return self.x + 1", old_code="def method(self):\n        return self.x", message="Change A.method"),
+        ]
+        with mock.patch.object(CodeWriter, "commit_source", wraps=CodeWriter().commit_source) as commit_source:
+            self.writer.flush(self.path, CodeWriter(), patches)
+        self.assertEqual(commit_source.call_count, 1)
+        self.assertEqual(commit_source.call_args[0][2], "Add A.added\n\nAdd B.y\n\nChange A.method")
+
+        source = self.read()
+        ast.parse(source)
+        namespace = {}
+        exec(source, namespace)
+        self.assertEqual(namespace["A"]().added(), 2)
+        self.assertEqual(namespace["A"]().method(), 2)
+        self.assertEqual(namespace["B"].y, 2)
+        self.assertIn("import sys", source)
+        # The replaced method is not kept around
+        self.assertEqual(source.count("def method"), 1)
+
+    def test_patch_that_cannot_be_placed_does_not_stop_the_others(self):
+        bad = Patch("Missing", "x = 1")
+        good = Patch("A", "y = 2")
+        with mock.patch.object(CodeWriter, "generate_info", return_value="not a number"):
+            with self.assertRaises(CodeWriterException):
+                self.writer.flush(self.path, CodeWriter(), [bad, good])
+        self.assertIsNone(good.error)
+        self.assertIn("    y = 2", self.read())
+
+    def test_patch_that_does_not_parse_fails_alone(self):
+        good, bad = Patch("A", "y = 2"), Patch("A", "def broken(self):\n    return (")
+        with self.assertRaises(CodeWriterException):
+            self.writer.flush(self.path, CodeWriter(), [good, bad])
+        self.assertIsNone(good.error)
+        self.assertIsNotNone(bad.error)
+        source = self.read()
+        self.assertIn("    y = 2", source)
+        self.assertNotIn("broken", source)
+
+    def test_text_in_imports_is_left_out(self):
+        patches = [Patch("A", "y = 2"), Patch("A", "Here are the imports:\nimport sys\nfrom os import path", imports=True)]
+        self.writer.flush(self.path, CodeWriter(), patches)
+        source = self.read()
+        ast.parse(source)
+        self.assertIn("import sys\nfrom os import path\n", source)
+        self.assertNotIn("Here are", source)
+        self.assertIn("    y = 2", source)
+
+    def test_batch_that_does_not_parse_is_rejected(self):
+        patches = [Patch("A", "y = 2"), Patch("B", "z = 3")]
+        with mock.patch.object(CodeWriter, "apply_patches", return_value="class A:\n"):
+            with self.assertRaises(CodeWriterException):
+                self.writer.flush(self.path, CodeWriter(), patches)
+        self.assertEqual(self.read(), SOURCE)
+        self.assertTrue(all(patch.error is not None for patch in patches))
+
+
+class TestJournal(FileWriterTestCase):
+    NEW = SOURCE.replace("x = 1", "x = 2")
+
+    def crash_after_journal(self):
+        # What an interrupted write leaves behind: the journal, and the file as it was
+        journal = {"path": self.path, "original": SOURCE, "new": self.NEW,
+                   "original_sha256": None, "new_sha256": None}
+        from code_generator.file_writer import _digest
+        journal["original_sha256"] = _digest(SOURCE)
+        journal["new_sha256"] = _digest(self.NEW)
+        with open(FileWriter.journal_path(self.path), "w") as f:
+            json.dump(journal, f)
+
+    def test_recover_replays_the_write(self):
+        self.crash_after_journal()
+        self.assertEqual(FileWriter.journals(self.directory), [self.path])
+        self.assertTrue(self.writer.recover(self.path))
+        self.assertEqual(self.read(), self.NEW)
+        self.assertFalse(os.path.exists(FileWriter.journal_path(self.path)))
+        self.assertFalse(self.writer.recover(self.path))
+
+    def test_recover_rolls_back(self):
+        self.crash_after_journal()
+        with open(self.path, "w") as f:
+            f.write(self.NEW)
+        self.assertTrue(self.writer.recover(self.path, rollback=True))
+        self.assertEqual(self.read(), SOURCE)
+
+    def test_recover_refuses_a_file_changed_since(self):
+        self.crash_after_journal()
+        with open(self.path, "w") as f:
+            f.write("x = 3\n")
+        with self.assertRaises(CodeWriterException):
+            self.writer.recover(self.path)
+        self.assertTrue(os.path.exists(FileWriter.journal_path(self.path)))
+
+    def test_batch_builds_on_interrupted_write(self):
+        self.crash_after_journal()
+        self.writer.flush(self.path, CodeWriter(), [Patch("B", "y = 2")])
+        source = self.read()
+        self.assertIn("x = 2", source)
+        self.assertIn("    y = 2", source)
+        self.assertFalse(os.path.exists(FileWriter.journal_path(self.path)))
+
+    def test_rejected_batch_keeps_the_journal(self):
+        self.crash_after_journal()
+        with self.assertRaises(CodeWriterException):
+            self.writer.flush(self.path, CodeWriter(), [Patch("B", "def broken(self):\n    return (")])
+        self.assertEqual(self.read(), SOURCE)
+        self.assertTrue(os.path.exists(FileWriter.journal_path(self.path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import gc
+import unittest
+from code_generator import GenerativeBase
+from code_generator.hierarchy import ClassRegistry, get_class_registry
+
+
+class TestClassRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = ClassRegistry()
+
+        class Root:
+            pass
+
+        class A(Root):
+            pass
+
+        class B(Root):
+            pass
+
+        class A1(A):
+            pass
+
+        class AB(A, B):
+            pass
+
+        self.Root, self.A, self.B, self.A1, self.AB = Root, A, B, A1, AB
+        for cls in (Root, A, B, A1, AB):
+            self.registry.register(cls)
+
+    def test_register_and_lookup(self):
+        self.assertTrue(self.registry.is_registered(self.A))
+        self.assertFalse(self.registry.is_registered(int))
+        self.assertEqual(self.registry.children(self.Root), [self.A, self.B])
+        self.assertEqual(self.registry.children(self.A), [self.A1, self.AB])
+        self.assertEqual(self.registry.children(self.A1), [])
+        self.assertEqual(self.registry.parents(self.AB), [self.A, self.B])
+        self.assertEqual(self.registry.parents(self.Root), [])
+
+    def test_descendants_closest_first(self):
+        self.assertEqual(self.registry.descendants(self.Root), [self.A, self.B, self.A1, self.AB])
+        # Excluded classes are skipped, but their subclasses are not
+        self.assertEqual(self.registry.descendants(self.Root, excluded_classes={self.A}), [self.B, self.A1, self.AB])
+
+    def test_related_classes(self):
+        related = self.registry.related_classes([self.A, self.Root], excluded_classes={self.A})
+        self.assertEqual(related, [self.A1, self.AB, self.Root, self.B])
+
+    def test_classes_are_held_weakly(self):
+        class C(self.Root):
+            pass
+        self.registry.register(C)
+        self.assertIn(C, self.registry.children(self.Root))
+        del C
+        gc.collect()
+        self.assertEqual(self.registry.children(self.Root), [self.A, self.B])
+
+    def test_generative_base_subclasses_are_registered(self):
+        class Generated(GenerativeBase):
+            pass
+
+        class Child(Generated):
+            pass
+
+        self.assertTrue(get_class_registry().is_registered(Generated))
+        self.assertEqual(get_class_registry().children(Generated), [Child])
+
+
+if __name__ == "__main__":
+    unittest.main()
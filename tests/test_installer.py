@@ -0,0 +1,68 @@
+import gc
+import inspect
+import linecache
+import unittest
+from code_generator.exceptions import CodeGenerationException
+from code_generator.installer import install_code
+
+
+class Base:
+    def greet(self):
+        return "base"
+
+
+class TestInstallCode(unittest.TestCase):
+    def setUp(self):
+        class Target(Base):
+            x = 1
+        self.Target = Target
+
+    def test_method(self):
+        names = install_code(self.Target, "def greet(self):\n    return 'target ' + super().greet()\n")
+        self.assertEqual(names, ["greet"])
+        self.assertEqual(self.Target().greet(), "target base")
+        self.assertEqual(self.Target.greet.__qualname__, f"{self.Target.__qualname__}.greet")
+        self.assertIn("super().greet()", inspect.getsource(self.Target.greet))
+
+    def test_class_attribute(self):
+        self.assertEqual(install_code(self.Target, "y = 2"), ["y"])
+        self.assertEqual(self.Target.y, 2)
+
+    def test_dependent_attributes(self):
+        names = install_code(self.Target, "y = x + 1\nz = y * 2\nnames = [name for name in ('y', 'z')]\n")
+        self.assertEqual(sorted(names), ["names", "y", "z"])
+        self.assertEqual((self.Target.y, self.Target.z, self.Target.names), (2, 4, ["y", "z"]))
+        # Existing members are left as they are
+        self.assertNotIn("x", names)
+
+    def test_decorated_members(self):
+        install_code(self.Target, "@property\ndef double(self):\n    return self.x * 2\n\n@classmethod\ndef make(cls):\n    return cls()\n")
+        self.assertEqual(self.Target().double, 2)
+        self.assertIsInstance(self.Target.make(), self.Target)
+
+    def test_imports_run_in_the_module(self):
+        install_code(self.Target, "def path(self):\n    return posixpath.join('a', 'b')\n", "import posixpath")
+        self.assertEqual(self.Target().path(), "a/b")
+
+    def test_invalid_code(self):
+        with self.assertRaises(CodeGenerationException):
+            install_code(self.Target, "y = undefined_name")
+        with self.assertRaises(CodeGenerationException):
+            install_code(self.Target, "def f(:")
+
+    def test_source_lines_are_released_with_the_functions(self):
+        install_code(self.Target, "def greet(self):\n    return 'target'\n")
+        filename = self.Target.greet.__code__.co_filename
+        self.assertIn(filename, linecache.cache)
+        del self.Target.greet
+        gc.collect()
+        self.assertNotIn(filename, linecache.cache)
+
+    def test_source_lines_of_attributes_are_not_kept(self):
+        before = set(linecache.cache)
+        install_code(self.Target, "y = 2")
+        self.assertEqual(set(linecache.cache), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import threading
+import unittest
+from code_generator.instrumentation import Instrumentation
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = Instrumentation()
+        self.events = []
+        self.instrumentation.add_hook(self.events.append)
+
+    def test_nested_phases(self):
+        with self.instrumentation.phase("model") as outer:
+            self.assertIs(self.instrumentation.current(), outer)
+            with self.instrumentation.phase("git", files=2) as inner:
+                self.assertIs(self.instrumentation.current(), inner)
+            self.assertIs(self.instrumentation.current(), outer)
+        self.assertIsNone(self.instrumentation.current())
+        # The inner phase finishes first, and is timed within the outer one
+        self.assertEqual([event.phase for event in self.events], ["git", "model"])
+        self.assertEqual(inner.details, {"files": 2})
+        self.assertLessEqual(inner.duration, outer.duration)
+
+    def test_phases_are_per_thread(self):
+        seen = []
+        with self.instrumentation.phase("model"):
+            thread = threading.Thread(target=lambda: seen.append(self.instrumentation.current()))
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, [None])
+
+    def test_byte_counts_and_retries_are_summed(self):
+        for bytes_in, bytes_out in ((10, 100), (20, 200)):
+            with self.instrumentation.phase("model") as event:
+                event.bytes_in = bytes_in
+                event.bytes_out = bytes_out
+                event.retries = 1
+        stats = self.instrumentation.stats()["model"]
+        self.assertEqual((stats["count"], stats["bytes_in"], stats["bytes_out"], stats["retries"], stats["errors"]), (2, 30, 300, 2, 0))
+        self.assertAlmostEqual(stats["mean_seconds"], stats["total_seconds"] / 2)
+
+    def test_error_is_counted_and_raised(self):
+        with self.assertRaises(ValueError):
+            with self.instrumentation.phase("write"):
+                raise ValueError("failed")
+        self.assertIsInstance(self.events[0].error, ValueError)
+        self.assertEqual(self.instrumentation.stats()["write"]["errors"], 1)
+        self.assertIsNone(self.instrumentation.current())
+
+    def test_failing_hook_does_not_fail_the_phase(self):
+        def hook(event):
+            raise RuntimeError("hook failed")
+        self.instrumentation.add_hook(hook)
+        with self.assertLogs("code_generator.instrumentation", "ERROR"):
+            with self.instrumentation.phase("context"):
+                pass
+        self.assertEqual(len(self.events), 1)
+
+    def test_report_and_reset(self):
+        with self.instrumentation.phase("placement") as event:
+            event.bytes_in = 1234
+        report = self.instrumentation.report()
+        self.assertIn("placement", report)
+        self.assertIn("1234", report)
+        self.instrumentation.reset()
+        self.assertEqual(self.instrumentation.stats(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import ast
+import sys
+import shutil
+import inspect
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+from code_generator.code_generator import CodeGenerator
+from code_generator.code_writer import CodeWriter
+from code_generator.exceptions import InvalidResponseException
+from code_generator.patching import apply_patch, number_lines
+
+METHOD = '''def method(self):
+    x = self.x
+    return x
+'''
+
+MODULE = '''class A:
+    x = 1
+
+    def method(self):
+        x = self.x
+        return x
+
+    def other(self):
+        return 0
+'''
+
+PATCH = '''@@ -1,3 +1,4 @@
+ def method(self):
+     x = self.x
++    self.y = x + 1
+     return x
+'''
+
+
+class TestApplyPatch(unittest.TestCase):
+    def test_number_lines(self):
+        self.assertEqual(number_lines("a\n  b\n"), "1| a\n2|   b\n")
+
+    def test_apply(self):
+        patched = apply_patch(METHOD, PATCH)
+        self.assertEqual(patched, "def method(self):\n    x = self.x\n    self.y = x + 1\n    return x\n")
+
+    def test_line_numbers_a_little_off(self):
+        patched = apply_patch(METHOD, PATCH.replace("@@ -1,3 +1,4 @@", "@@ -3,3 +3,4 @@"))
+        self.assertIn("    self.y = x + 1\n", patched)
+
+    def test_fences_and_headers_are_ignored(self):
+        patch = f"```diff\n--- a/module.py\n+++ b/module.py\n{PATCH}```\n"
+        self.assertEqual(apply_patch(METHOD, patch), apply_patch(METHOD, PATCH))
+
+    def test_context_that_does_not_match(self):
+        with self.assertRaises(InvalidResponseException):
+            apply_patch(METHOD, PATCH.replace(" x = self.x", " x = self.z"))
+
+    def test_result_that_does_not_parse(self):
+        with self.assertRaises(InvalidResponseException):
+            apply_patch(METHOD, PATCH.replace("+    self.y = x + 1", "+    self.y = ("))
+
+    def test_no_hunks(self):
+        with self.assertRaises(InvalidResponseException):
+            apply_patch(METHOD, "def method(self):\n    return 1\n")
+
+
+class TestPatchMethod(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="code_generator_test_")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "patched_module.py")
+        with open(self.path, "w") as f:
+            f.write(MODULE)
+        spec = importlib.util.spec_from_file_location("patched_module", self.path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        self.addCleanup(sys.modules.pop, spec.name)
+        spec.loader.exec_module(module)
+        self.cls = module.A
+
+        self.method_source = inspect.getsource(self.cls.method)
+
+    def patch(self, patch):
+        with mock.patch.object(CodeGenerator, "prompt_ai", return_value=patch):
+            return CodeGenerator().patch_code("Set y.\n", "", self.method_source, self.cls, "method")
+
+    def test_patched_method_in_class_keeps_the_module_valid(self):
+        code = self.patch(PATCH)
+        self.assertEqual(code, "def method(self):\n    x = self.x\n    self.y = x + 1\n    return x")
+
+        source = CodeWriter().replace_code(main_source=MODULE, old_code=self.method_source, new_code=code, class_name="A")
+        ast.parse(source)
+        self.assertIn("\n        self.y = x + 1\n", source)
+        # The old method is replaced, not kept around in any form
+        self.assertEqual(source.count("def method"), 1)
+        self.assertNotIn('"""', source)
+
+        namespace = {}
+        exec(source, namespace)
+        instance = namespace["A"]()
+        self.assertEqual(instance.method(), 1)
+        self.assertEqual(instance.y, 2)
+        self.assertEqual(instance.other(), 0)
+
+    def test_patch_that_does_not_apply_asks_for_the_whole_method(self):
+        self.assertIsNone(self.patch(PATCH.replace(" x = self.x", " x = self.z")))
+
+    def test_patch_of_a_method_that_is_gone(self):
+        with open(self.path, "w") as f:
+            f.write("class A:\n    x = 1\n")
+        self.assertIsNone(self.patch(PATCH))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import contextvars
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from code_generator.pipeline import Pipeline
+
+variable = contextvars.ContextVar("variable", default=None)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(self.executor.shutdown)
+        self.order = []
+
+    def stage(self, name, value=None):
+        def run(*args):
+            self.order.append(name)
+            return (name, args) if value is None else value
+        return run
+
+    def test_stages_get_the_results_of_their_dependencies(self):
+        pipeline = Pipeline()
+        pipeline.add("a", self.stage("a", 1))
+        pipeline.add("b", lambda a: a + 1, "a")
+        pipeline.add("c", lambda a, b: a * 10 + b, "a", "b")
+        self.assertEqual(pipeline.run(self.executor), {"a": 1, "b": 2, "c": 12})
+
+    def test_dependencies_finish_first(self):
+        pipeline = Pipeline()
+        pipeline.add("response", self.stage("response"))
+        pipeline.add("code", self.stage("code"), "response")
+        pipeline.add("imports", self.stage("imports"), "code")
+        pipeline.add("message", self.stage("message"), "code")
+        pipeline.add("commit", self.stage("commit"), "imports", "message")
+        pipeline.run(self.executor)
+        self.assertEqual(self.order[:2], ["response", "code"])
+        self.assertEqual(sorted(self.order[2:4]), ["imports", "message"])
+        self.assertEqual(self.order[4], "commit")
+
+    def test_independent_stages_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=10)
+        pipeline = Pipeline()
+        pipeline.add("a", barrier.wait)
+        pipeline.add("b", barrier.wait)
+        # Would time out if a and b ran one after the other
+        pipeline.run(self.executor)
+
+    def test_error_is_raised_and_dependent_stages_do_not_run(self):
+        def fail(a):
+            raise ValueError("stage failed")
+
+        pipeline = Pipeline()
+        pipeline.add("a", self.stage("a"))
+        pipeline.add("b", fail, "a")
+        pipeline.add("c", self.stage("c"), "b")
+        with self.assertRaisesRegex(ValueError, "stage failed"):
+            pipeline.run(self.executor)
+        self.assertEqual(self.order, ["a"])
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(ValueError):
+            Pipeline().add("a", self.stage("a"), "missing")
+
+    def test_stages_see_the_context_of_the_caller(self):
+        pipeline = Pipeline()
+        pipeline.add("a", variable.get)
+        token = variable.set("value")
+        try:
+            self.assertEqual(pipeline.run(self.executor), {"a": "value"})
+        finally:
+            variable.reset(token)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import ast
+import unittest
+from code_generator.placement import insert_into_class, merge_imports, member_source, GENERATED_HEADER, GENERATED_FOOTER
+from code_generator.exceptions import CodeWriterException
+
+
+class TestGeneratedFooter(unittest.TestCase):
+    def test_attribute_does_not_go_into_next_generated_block(self):
+        source = "\n".join([
+            "class A:",
+            "    x = 1",
+            f"    {GENERATED_HEADER}",
+            "    def method(self):",
+            "        return 1",
+            f"    {GENERATED_FOOTER}",
+            "",
+        ])
+        result = insert_into_class(source, "A", "label = 'x'")
+        ast.parse(result)
+        self.assertNotIn(f"    {GENERATED_HEADER}\n    {GENERATED_HEADER}", result)
+        lines = result.split("\n")
+        self.assertEqual(lines[lines.index("    def method(self):") - 1], f"    {GENERATED_HEADER}")
+        self.assertLess(lines.index("    label = 'x'"), lines.index("    def method(self):"))
+
+    def test_attribute_goes_after_footer_of_generated_attribute(self):
+        source = "\n".join([
+            "class A:",
+            f"    {GENERATED_HEADER}",
+            "    x = 1",
+            f"    {GENERATED_FOOTER}",
+            "    def method(self):",
+            "        return 1",
+            "",
+        ])
+        result = insert_into_class(source, "A", "y = 2")
+        lines = result.split("\n")
+        self.assertEqual(lines[3], f"    {GENERATED_FOOTER}")
+        self.assertEqual(lines[4], f"    {GENERATED_HEADER}")
+        self.assertEqual(lines[5], "    y = 2")
+
+    def test_leading_comment_of_next_member_is_kept_with_it(self):
+        source = "\n".join([
+            "class A:",
+            "    x = 1",
+            "    # Explains the method below",
+            "    def method(self):",
+            "        return 1",
+            "",
+        ])
+        result = insert_into_class(source, "A", "y = 2")
+        lines = result.split("\n")
+        self.assertEqual(lines[lines.index("    # Explains the method below") + 1], "    def method(self):")
+        self.assertLess(lines.index("    y = 2"), lines.index("    # Explains the method below"))
+
+    def test_method_goes_after_footer(self):
+        source = "\n".join([
+            "class A:",
+            f"    {GENERATED_HEADER}",
+            "    def first(self):",
+            "        return 1",
+            f"    {GENERATED_FOOTER}",
+            "",
+            "x = 1",
+            "",
+        ])
+        result = insert_into_class(source, "A", "def second(self):\n    return 2")
+        ast.parse(result)
+        lines = result.split("\n")
+        self.assertEqual(lines[4], f"    {GENERATED_FOOTER}")
+        self.assertLess(lines.index("    def second(self):"), lines.index("x = 1"))
+
+    def test_stops_at_blank_line(self):
+        source = "\n".join([
+            "class A:",
+            "    x = 1",
+            "",
+            f"    {GENERATED_FOOTER}",
+            "",
+        ])
+        result = insert_into_class(source, "A", "y = 2")
+        lines = result.split("\n")
+        self.assertEqual(lines[1], "    x = 1")
+        self.assertEqual(lines[2], f"    {GENERATED_HEADER}")
+
+
+class TestInsertIntoClass(unittest.TestCase):
+    SOURCE = "\n".join([
+        "import os",
+        "",
+        "",
+        "class A:",
+        '    """Docstring."""',
+        "    x = 1",
+        "",
+        "    def method(self):",
+        "        return self.x",
+        "",
+        "",
+        "class B:",
+        "    pass",
+        "",
+    ])
+
+    def test_attribute_goes_after_class_attributes(self):
+        result = insert_into_class(self.SOURCE, "A", "y = 2")
+        lines = result.split("\n")
+        self.assertEqual(lines[5], "    x = 1")
+        self.assertEqual(lines[6:9], [f"    {GENERATED_HEADER}", "    y = 2", f"    {GENERATED_FOOTER}"])
+        ast.parse(result)
+
+    def test_attribute_goes_after_docstring(self):
+        source = 'class A:\n    """Docstring."""\n\n    def method(self):\n        pass\n'
+        lines = insert_into_class(source, "A", "y = 2").split("\n")
+        self.assertEqual(lines[1], '    """Docstring."""')
+        self.assertEqual(lines[3], "    y = 2")
+
+    def test_method_goes_to_end_of_class(self):
+        result = insert_into_class(self.SOURCE, "A", "def other(self):\n    return 2")
+        ast.parse(result)
+        lines = result.split("\n")
+        self.assertEqual(lines.index("    def other(self):"), lines.index("        return self.x") + 3)
+        self.assertLess(lines.index("    def other(self):"), lines.index("class B:"))
+        self.assertEqual(member_source(result, "A", "other"), "def other(self):\n    return 2")
+
+    def test_one_line_class_body(self):
+        result = insert_into_class("class A: pass\n", "A", "def method(self):\n    return 1")
+        namespace = {}
+        exec(result, namespace)
+        self.assertEqual(namespace["A"]().method(), 1)
+
+    def test_nested_class(self):
+        source = "class Outer:\n    class Inner:\n        x = 1\n\n    y = 2\n"
+        result = insert_into_class(source, "Outer.Inner", "z = 3")
+        namespace = {}
+        exec(result, namespace)
+        self.assertEqual(namespace["Outer"].Inner.z, 3)
+        self.assertFalse(hasattr(namespace["Outer"], "z"))
+
+    def test_unknown_class(self):
+        with self.assertRaises(CodeWriterException):
+            insert_into_class(self.SOURCE, "C", "x = 1")
+
+
+class TestMergeImports(unittest.TestCase):
+    def test_new_imports_go_after_import_block(self):
+        result = merge_imports('"""Module."""\nimport os\n\nx = 1\n', "import sys\nimport os")
+        self.assertEqual(result, '"""Module."""\nimport os\nimport sys\n\nx = 1\n')
+
+    def test_nothing_to_merge(self):
+        source = "from os import path\n"
+        self.assertEqual(merge_imports(source, "from os import path"), source)
+
+
+if __name__ == "__main__":
+    unittest.main()
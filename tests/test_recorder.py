@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+from code_generator import config
+from code_generator.exceptions import CodeWriterException
+from code_generator.recorder import MissRecorder
+
+
+class A:
+    pass
+
+
+class B:
+    pass
+
+
+class TestFlush(unittest.TestCase):
+    def setUp(self):
+        self.recorder = MissRecorder()
+        self.recorder.record(A, "a", [])
+        self.recorder.record(B, "b", [])
+        self.written = []
+        self.failing = set()
+        for patcher in (
+            mock.patch.multiple(config, git_branch=None, hot_install=False),
+            mock.patch("code_generator.recorder.inspect.getsourcefile", side_effect=lambda cls: f"/{cls.__name__}.py"),
+            mock.patch.object(MissRecorder, "_generate_class", side_effect=self.generate_class),
+            mock.patch.object(MissRecorder, "_write_file", side_effect=self.write_file),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def generate_class(cls, records):
+        return {record.name: f"{record.name} = 1" for record in records}, "", "message"
+
+    def write_file(self, class_file, classes, generated):
+        if class_file in self.failing:
+            raise CodeWriterException(f"cannot write {class_file}")
+        self.written.append(class_file)
+
+    def test_flush(self):
+        self.assertEqual(self.recorder.flush(), {A: ["a"], B: ["b"]})
+        self.assertEqual(self.written, ["/A.py", "/B.py"])
+        self.assertEqual(self.recorder.pending(), [])
+
+    def test_flushing_twice_writes_once(self):
+        self.recorder.flush()
+        self.assertEqual(self.recorder.flush(), {})
+        self.assertEqual(self.written, ["/A.py", "/B.py"])
+
+    def test_partial_failure_keeps_only_the_failed_records(self):
+        self.failing.add("/A.py")
+        with self.assertRaisesRegex(CodeWriterException, "/A.py"):
+            self.recorder.flush()
+        # The other file was still written and its records removed
+        self.assertEqual(self.written, ["/B.py"])
+        self.assertEqual([(record.owner_class, record.name) for record in self.recorder.pending()], [(A, "a")])
+
+        self.failing.clear()
+        self.assertEqual(self.recorder.flush(), {A: ["a"]})
+        self.assertEqual(self.written, ["/B.py", "/A.py"])
+        self.assertEqual(self.recorder.pending(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
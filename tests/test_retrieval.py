@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from code_generator import config
+from code_generator.retrieval import RetrievalIndex, project_root
+
+
+class RetrievalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp(prefix="code_generator_test_"))
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, path, content=""):
+        path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+
+class TestProjectRoot(RetrievalTestCase):
+    def outside_git(self):
+        # In case the temp directory is in a git work tree
+        return mock.patch("code_generator.retrieval.os.path.exists", side_effect=lambda path: not path.endswith(".git") and os.path.lexists(path))
+
+    def test_git_work_tree(self):
+        os.makedirs(os.path.join(self.directory, "project", ".git"))
+        path = self.write("project/src/package/module.py")
+        self.write("project/src/package/__init__.py")
+        self.assertEqual(project_root(path), os.path.join(self.directory, "project"))
+
+    def test_import_directory_without_git(self):
+        path = self.write("project/package/module.py")
+        self.write("project/package/__init__.py")
+        with self.outside_git():
+            self.assertEqual(project_root(path), os.path.join(self.directory, "project"))
+
+    def test_installed_packages_are_not_a_project(self):
+        path = self.write("lib/python3/site-packages/package/module.py")
+        self.write("lib/python3/site-packages/package/__init__.py")
+        with self.outside_git():
+            self.assertIsNone(project_root(path))
+
+    def test_home_directory_is_not_a_project(self):
+        path = self.write("script.py")
+        with mock.patch.dict(os.environ, HOME=self.directory), self.outside_git():
+            self.assertIsNone(project_root(path))
+
+    def test_configured_root(self):
+        with mock.patch.object(config, "retrieval_root", self.directory):
+            self.assertEqual(project_root("/anywhere/module.py"), self.directory)
+
+
+class TestBackgroundUpdate(RetrievalTestCase):
+    def test_index_is_ready_after_background_update(self):
+        self.write("module.py", "def get_user_name(user):\n    return user.name\n\n\ndef other():\n    pass\n")
+        index = RetrievalIndex(self.directory, ":memory:", refresh=0)
+        self.addCleanup(index.close)
+        self.assertFalse(index.ready)
+        self.assertEqual(index.search("user name"), [])
+
+        future = index.update_in_background()
+        self.assertEqual(future.result(timeout=10), 1)
+        self.assertTrue(index.ready)
+        self.assertEqual([snippet.qualname for snippet in index.search("user name")], ["get_user_name"])
+
+    def test_index_built_by_an_earlier_run_is_ready(self):
+        self.write("module.py", "def f():\n    pass\n")
+        path = os.path.join(self.directory, "index.sqlite3")
+        index = RetrievalIndex(self.directory, path)
+        index.update()
+        index.close()
+        index = RetrievalIndex(self.directory, path)
+        self.addCleanup(index.close)
+        self.assertTrue(index.ready)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import unittest
+from unittest import mock
+from code_generator import config
+from code_generator.backends import Backend, register_backend
+from code_generator.code_generator import CodeGenerator
+from code_generator.exceptions import BackendException, CodeGenerationException
+from code_generator.retry import RetryPolicy, CircuitBreaker, CLOSED, OPEN, HALF_OPEN, get_providers
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_delay_doubles_up_to_the_maximum(self):
+        policy = RetryPolicy(attempts=5, backoff=0.5, backoff_max=3)
+        with mock.patch("code_generator.retry.random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual([policy.delay(retry) for retry in range(5)], [0.5, 1, 2, 3, 3])
+
+    def test_delay_is_jittered(self):
+        policy = RetryPolicy(backoff=1, backoff_max=10)
+        for _ in range(50):
+            self.assertTrue(0 <= policy.delay(2) <= 4)
+
+    def test_defaults_come_from_config(self):
+        with mock.patch.multiple(config, retry_attempts=7, retry_backoff=2, retry_backoff_max=9):
+            policy = RetryPolicy()
+        self.assertEqual((policy.attempts, policy.backoff, policy.backoff_max), (7, 2, 9))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("code_generator.retry.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+
+    def open(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertFalse(self.breaker.available())
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_lets_one_request_through(self):
+        self.open()
+        self.now += 10
+        self.assertTrue(self.breaker.available())
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertFalse(self.breaker.available())
+
+    def test_half_open_success_closes(self):
+        self.open()
+        self.now += 10
+        self.breaker.allow()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.recent_failures(), 0)
+
+    def test_half_open_failure_opens_again(self):
+        self.open()
+        self.now += 10
+        self.breaker.allow()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.now += 5
+        self.assertFalse(self.breaker.allow())
+
+    def test_cancelled_trial_opens_again(self):
+        self.open()
+        self.now += 10
+        self.breaker.allow()
+        self.breaker.record_cancelled()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.now += 10
+        self.assertTrue(self.breaker.allow())
+
+    def test_recent_failures_are_forgotten_after_reset_timeout(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.recent_failures(), 1)
+        self.now += 10
+        self.assertEqual(self.breaker.recent_failures(), 0)
+
+
+class FlakyBackend(Backend):
+    """
+    Fails for the providers in failing, answers with the provider name otherwise.
+    """
+    def __init__(self, failing=(), failures=None):
+        self.failing = set(failing)
+        self.failures = failures
+        self.calls = []
+
+    def complete(self, prompt, provider=None):
+        self.calls.append(provider)
+        if provider in self.failing or (self.failures is not None and len(self.calls) <= self.failures):
+            raise BackendException(f"{provider} is down")
+        return provider
+
+
+class TestRequestRetries(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(config, backend="test-flaky", fallback_backend=None, provider="first",
+                                      providers=["first", "second"], streaming=False, hedge_after=None,
+                                      retry_attempts=3, circuit_failure_threshold=2, circuit_reset_timeout=60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Fresh circuit breakers for every test
+        patcher = mock.patch("code_generator.retry._breakers", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("code_generator.code_generator.time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def backend(self, **kwargs):
+        backend = FlakyBackend(**kwargs)
+        register_backend("test-flaky", backend)
+        return backend
+
+    def test_failure_is_retried_after_backoff(self):
+        backend = self.backend(failures=1)
+        with mock.patch.object(config, "providers", None):
+            self.assertEqual(CodeGenerator().request_ai("prompt"), ("first", "test-flaky", "first"))
+        self.assertEqual(backend.calls, ["first", "first"])
+        self.assertEqual(self.sleep.call_count, 1)
+
+    def test_gives_up_after_attempts(self):
+        self.backend(failing=["first", "second"])
+        with self.assertRaises(CodeGenerationException):
+            CodeGenerator().request_ai("prompt")
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_retry_goes_to_the_provider_with_fewest_recent_failures(self):
+        backend = self.backend(failing=["first"])
+        self.assertEqual(CodeGenerator().request_ai("prompt"), ("second", "test-flaky", "second"))
+        self.assertEqual(backend.calls, ["first", "second"])
+
+    def test_provider_is_skipped_once_its_circuit_opens(self):
+        backend = self.backend(failing=["first"])
+        with mock.patch.object(config, "providers", None):
+            with self.assertRaises(CodeGenerationException):
+                CodeGenerator().request_ai("prompt")
+        # Two failures opened the circuit, so the third attempt was not sent
+        self.assertEqual(backend.calls, ["first", "first"])
+        backend.calls.clear()
+        self.assertEqual(CodeGenerator().request_ai("prompt"), ("second", "test-flaky", "second"))
+        self.assertEqual(backend.calls, ["second"])
+
+    def test_providers(self):
+        self.assertEqual(get_providers(), ["first", "second"])
+        with mock.patch.multiple(config, provider="other", providers=["first"]):
+            self.assertEqual(get_providers(), ["other", "first"])
+
+
+if __name__ == "__main__":
+    unittest.main()
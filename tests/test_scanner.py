@@ -0,0 +1,114 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import contextlib
+from code_generator import cli
+from code_generator.scanner import ProjectScanner, module_name
+
+FILES = {
+    "app/__init__.py": "",
+    "app/models.py": '''from code_generator import GenerativeBase
+from somewhere import Unknown
+
+
+class Model(GenerativeBase):
+    def setup(self):
+        self.x = 1
+
+    def run(self):
+        return self.helper(self.x, key="value")
+
+
+class Child(Model):
+    value = 2
+
+
+class Other(Unknown, GenerativeBase):
+    def run(self):
+        return self.anything
+''',
+    "app/use.py": '''from .models import Child
+
+
+def use():
+    child = Child()
+    child.value
+    child.setup()
+    return child.total
+
+
+def annotated(model: "Child"):
+    model.compute(1, 2)
+''',
+    "app/broken.py": "def broken(:\n",
+}
+
+
+class ScannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp(prefix="code_generator_test_"))
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name, content in FILES.items():
+            path = os.path.join(self.directory, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+
+
+class TestProjectScanner(ScannerTestCase):
+    def test_missing_members(self):
+        scanner = ProjectScanner([self.directory])
+        missing = {(member.class_info.full_name, member.name): member for member in scanner.scan()}
+        self.assertEqual(sorted(missing), [("app.models.Child", "compute"), ("app.models.Child", "total"), ("app.models.Model", "helper")])
+
+        helper = missing["app.models.Model", "helper"]
+        self.assertTrue(helper.is_method)
+        access = helper.accesses[0]
+        self.assertEqual((access.path, access.lineno, access.function), (os.path.join(self.directory, "app/models.py"), 10, "run"))
+        self.assertEqual(access.args, ("self.x",))
+        self.assertEqual(access.kwargs, {"key": '"value"'})
+        self.assertFalse(missing["app.models.Child", "total"].is_method)
+        self.assertEqual(missing["app.models.Child", "compute"].accesses[0].args, ("1", "2"))
+
+    def test_unparsable_files_are_reported(self):
+        scanner = ProjectScanner([self.directory])
+        scanner.scan()
+        self.assertEqual([path for path, _ in scanner.errors], [os.path.join(self.directory, "app/broken.py")])
+
+    def test_module_name(self):
+        self.assertEqual(module_name(os.path.join(self.directory, "app/models.py")), ("app.models", self.directory))
+        self.assertEqual(module_name(os.path.join(self.directory, "app/__init__.py")), ("app", self.directory))
+
+
+class TestCli(ScannerTestCase):
+    def run_cli(self, *argv):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = cli.main(list(argv))
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_scan_is_a_dry_run(self):
+        before = {name: os.path.getmtime(os.path.join(self.directory, name)) for name in FILES}
+        status, out, err = self.run_cli("scan", self.directory)
+        self.assertEqual(status, 0)
+        lines = out.splitlines()
+        self.assertIn(f"app.models.Model.helper (method), used at {os.path.join(self.directory, 'app/models.py')}:10", lines)
+        self.assertIn(f"app.models.Child.total (attribute), used at {os.path.join(self.directory, 'app/use.py')}:8", lines)
+        self.assertEqual(lines[-1], "3 missing members")
+        self.assertIn("Skipped", err)
+        # Nothing was written
+        self.assertEqual({name: os.path.getmtime(os.path.join(self.directory, name)) for name in FILES}, before)
+
+    def test_generate_without_missing_members(self):
+        os.remove(os.path.join(self.directory, "app/use.py"))
+        with open(os.path.join(self.directory, "app/models.py"), "w") as f:
+            f.write("from code_generator import GenerativeBase\n\n\nclass Model(GenerativeBase):\n    pass\n")
+        status, out, _ = self.run_cli("generate", self.directory)
+        self.assertEqual(status, 0)
+        self.assertEqual(out, "Nothing to generate\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
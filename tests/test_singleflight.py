@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import importlib.util
+from unittest import mock
+from code_generator import config
+from code_generator import singleflight
+from code_generator.singleflight import SingleFlight
+from code_generator.universal_attribute import UniversalAttribute
+
+MODULE = '''class A:
+    ## AI MODIFIED CODE; PLEASE REVIEW ##
+    def setup(self):
+        self.x = 1
+    ## END OF AI MODIFIED CODE ##
+'''
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="code_generator_test_")
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = mock.patch.multiple(config, lock_dir=self.directory, git_branch=None, hot_install=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestSingleFlight(SingleFlightTestCase):
+    def test_concurrent_calls_share_one_result(self):
+        single_flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "result"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(single_flight.do("key", func)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.append(single_flight.do("key", func)))
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(results, ["result", "result"])
+        self.assertEqual(len(calls), 1)
+
+    def test_recorded_result(self):
+        single_flight = SingleFlight()
+        self.assertIsNone(single_flight.recorded_result(("file", "A", "x")))
+        single_flight.record_result(("file", "A", "x"), ["code", None])
+        # Another process sees it too
+        self.assertEqual(SingleFlight().recorded_result(("file", "A", "x")), ["code", None])
+        self.assertIsNone(single_flight.recorded_result(("file", "A", "y")))
+
+    def test_recorded_result_expires(self):
+        single_flight = SingleFlight()
+        single_flight.record_result("key", "result")
+        old = time.time() - singleflight.RESULT_TTL - 1
+        os.utime(single_flight._path("key", "result"), (old, old))
+        self.assertIsNone(single_flight.recorded_result("key"))
+
+    def test_lock_files_are_removed(self):
+        single_flight = SingleFlight()
+        self.assertEqual(single_flight.do("key", lambda: os.listdir(self.directory)), [os.path.basename(single_flight._path("key", "lock"))])
+        with single_flight.file_lock(("file", "path")):
+            pass
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_waiter_on_a_removed_lock_file_locks_again(self):
+        single_flight = SingleFlight()
+        inside = []
+        lock = single_flight.file_lock("key")
+        lock.__enter__()
+        waiter = threading.Thread(target=lambda: single_flight.do("key", lambda: inside.append(os.listdir(self.directory))))
+        waiter.start()
+        time.sleep(0.1)
+        lock.__exit__(None, None, None)
+        waiter.join()
+        self.assertEqual(inside, [[os.path.basename(single_flight._path("key", "lock"))]])
+
+    def test_expired_files_are_swept(self):
+        single_flight = SingleFlight()
+        for name in ("expired.result", "expired.tmp", "stale.lock", "fresh.result"):
+            with open(os.path.join(self.directory, name), "w"):
+                pass
+        old = time.time() - singleflight.RESULT_TTL - 1
+        for name in ("expired.result", "expired.tmp", "stale.lock"):
+            os.utime(os.path.join(self.directory, name), (old, old))
+        single_flight.record_result("key", "result")
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(["fresh.result", os.path.basename(single_flight._path("key", "result"))]))
+
+    def test_already_done_skips_the_call(self):
+        single_flight = SingleFlight()
+        func = mock.Mock(return_value="new")
+        self.assertEqual(single_flight.do("key", func, already_done=lambda: "done"), "done")
+        func.assert_not_called()
+
+
+class TestAlreadyGenerated(SingleFlightTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.directory, "generated_module.py")
+        with open(self.path, "w") as f:
+            f.write(MODULE)
+        spec = importlib.util.spec_from_file_location("generated_module", self.path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        self.addCleanup(sys.modules.pop, spec.name)
+        spec.loader.exec_module(module)
+        self.proxy = UniversalAttribute("x", module.A())
+        self.generate = mock.Mock(return_value=("def setup(self):\n    self.x = 1", None))
+
+    def test_instance_attribute_generated_by_another_process_is_not_generated_again(self):
+        # Another process wrote the code and recorded it; A has no member x
+        key = (os.path.realpath(self.path), "A", "x")
+        SingleFlight().record_result(key, ["def setup(self):\n    self.x = 1", "1"])
+        self.assertEqual(self.proxy._single_flight(self.generate), ("def setup(self):\n    self.x = 1", "1"))
+        self.generate.assert_not_called()
+
+    def test_generation_is_recorded(self):
+        self.proxy._single_flight(self.generate)
+        self.generate.assert_called_once()
+        self.assertEqual(self.proxy._single_flight(self.generate), ("def setup(self):\n    self.x = 1", None))
+        self.generate.assert_called_once()
+
+    def test_removed_code_is_generated_again(self):
+        self.proxy._single_flight(self.generate)
+        with open(self.path, "w") as f:
+            f.write("class A:\n    pass\n")
+        self.proxy._single_flight(self.generate)
+        self.assertEqual(self.generate.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
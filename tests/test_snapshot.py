@@ -0,0 +1,43 @@
+import inspect
+import unittest
+from code_generator.snapshot import StackSnapshot
+
+
+def inner(**kwargs):
+    return StackSnapshot.capture(**kwargs)
+
+
+def outer(**kwargs):
+    return inner(**kwargs)
+
+
+class TestStackSnapshot(unittest.TestCase):
+    def test_most_recent_frame_first(self):
+        snapshot = outer()
+        self.assertEqual([frame.function for frame in snapshot[:3]], ["inner", "outer", "test_most_recent_frame_first"])
+        self.assertEqual(snapshot[0].filename, __file__)
+        self.assertEqual(snapshot[0].lineno, inspect.getsourcelines(inner)[1] + 1)
+
+    def test_whole_stack_is_captured(self):
+        self.assertEqual(len(outer()), len(inspect.stack(0)) + 2)
+
+    def test_skip(self):
+        self.assertEqual([frame.function for frame in outer(skip=1)[:2]], ["outer", "test_skip"])
+
+    def test_limit(self):
+        snapshot = outer(limit=2)
+        self.assertEqual(len(snapshot), 2)
+        self.assertEqual([frame.function for frame in snapshot], ["inner", "outer"])
+
+    def test_limit_deeper_than_the_stack(self):
+        depth = len(outer())
+        self.assertEqual(len(outer(limit=depth + 10)), depth)
+
+    def test_records_hold_no_frames(self):
+        record = outer()[0]
+        self.assertEqual(type(record).__slots__, ("filename", "lineno", "function"))
+        self.assertFalse(hasattr(record, "__dict__"))
+
+
+if __name__ == "__main__":
+    unittest.main()
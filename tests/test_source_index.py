@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+from code_generator.source_index import SourceIndex
+
+SOURCE = '''class A:
+    @property
+    def x(self):
+        return 1
+
+
+def f():
+    def g():
+        pass
+'''
+
+
+class TestSourceIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="code_generator_test_")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = self.write("module.py", SOURCE)
+        self.index = SourceIndex()
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, ns=(mtime, mtime))
+        return path
+
+    def test_spans(self):
+        file_index = self.index.get_file(self.path)
+        self.assertEqual(file_index.spans, {"A": (1, 4), "A.x": (2, 4), "f": (7, 9), "f.<locals>.g": (8, 9)})
+        self.assertEqual(file_index.find_enclosing(4), "A.x")
+        self.assertEqual(file_index.find_enclosing(6), None)
+
+    def test_unchanged_file_is_not_read_again(self):
+        self.assertIs(self.index.get_file(self.path), self.index.get_file(self.path))
+
+    def test_changed_mtime_reads_the_file_again(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        first = self.index.get_file(self.path)
+        # Same size, so only the mtime tells the files apart
+        self.write("module.py", SOURCE.replace("class A", "class B"), mtime + 1_000_000)
+        second = self.index.get_file(self.path)
+        self.assertIsNot(second, first)
+        self.assertIn("B", second.spans)
+
+    def test_summaries_are_dropped_with_their_file(self):
+        self.index.summaries[(os.path.realpath(self.path), None, 0, "key")] = "summary"
+        self.index.get_file(self.path)
+        self.index.invalidate(self.path)
+        self.assertEqual(len(self.index.summaries), 0)
+
+    def test_symlinked_path(self):
+        link = os.path.join(self.directory, "link.py")
+        os.symlink(self.path, link)
+        file_index = self.index.get_file(link)
+        self.assertIs(self.index.get_file(self.path), file_index)
+        self.assertEqual(list(self.index.files), [os.path.realpath(self.path)])
+
+        # Invalidated through either path
+        self.index.invalidate(self.path)
+        self.assertEqual(self.index.files, {})
+        self.index.get_file(self.path)
+        self.index.invalidate(link)
+        self.assertEqual(self.index.files, {})
+
+    def test_symlinked_directory(self):
+        linked_directory = os.path.join(self.directory, "linked")
+        os.symlink(self.directory, linked_directory)
+        self.index.get_file(os.path.join(linked_directory, "module.py"))
+        self.index.invalidate(self.path)
+        self.assertEqual(self.index.files, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
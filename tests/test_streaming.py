@@ -0,0 +1,109 @@
+import unittest
+from code_generator.exceptions import InvalidResponseException
+from code_generator.streaming import FirstLineParser, CodeParser, SectionParser, PatchParser
+
+
+def feed(parser, text, size):
+    """
+    Feed text in chunks of size characters. Returns the number of chunks fed before the parser was done.
+    """
+    chunks = [text[i:i + size] for i in range(0, len(text), size)]
+    for count, chunk in enumerate(chunks, 1):
+        if parser.feed(chunk):
+            return count
+    return len(chunks)
+
+
+# Chunk sizes that split lines, fences and headers at every possible place
+SIZES = (1, 2, 3, 5, 7, 1000)
+
+
+class TestFirstLineParser(unittest.TestCase):
+    def test_done_after_the_first_line(self):
+        for size in SIZES:
+            parser = FirstLineParser()
+            fed = feed(parser, "```\nclass\nmore text\nthat is not read\n", size)
+            self.assertEqual(parser.result(), "class")
+            self.assertLessEqual(fed * size, len("```\nclass\n") + size)
+
+    def test_line_without_newline(self):
+        parser = FirstLineParser()
+        self.assertFalse(parser.feed("None"))
+        self.assertEqual(parser.result(), "None")
+
+
+class TestCodeParser(unittest.TestCase):
+    CODE = "```python\ndef method(self,\n           other):\n    return (self.x +\n            other)\n```\n"
+
+    def test_split_code(self):
+        for size in SIZES:
+            parser = CodeParser()
+            feed(parser, self.CODE, size)
+            self.assertEqual(parser.result(), "def method(self,\n           other):\n    return (self.x +\n            other)")
+            self.assertTrue(parser.valid)
+
+    def test_explanation_is_stopped_at_its_first_line(self):
+        for size in SIZES:
+            parser = CodeParser()
+            with self.assertRaises(InvalidResponseException):
+                feed(parser, "Sure! Here is the method you asked for:\n" + self.CODE, size)
+            self.assertLess(len(parser.text), len("Sure! Here is the method you asked for:\n") + size)
+
+    def test_without_abort_the_response_is_read(self):
+        parser = CodeParser(abort=False)
+        feed(parser, "Sure!\n" + self.CODE, 3)
+        self.assertFalse(parser.valid)
+        self.assertIn("def method", parser.result())
+
+    def test_last_line_without_newline(self):
+        parser = CodeParser()
+        feed(parser, "x = 1\ny = 2", 4)
+        self.assertEqual(parser.result(), "x = 1\ny = 2")
+
+
+class TestSectionParser(unittest.TestCase):
+    RESPONSE = "### CODE\n```python\ndef f(self):\n    pass\n```\n### IMPORTS\nimport os\n### COMMIT MESSAGE\nAdd f\n"
+
+    def test_split_sections(self):
+        for size in SIZES:
+            parser = SectionParser()
+            feed(parser, self.RESPONSE, size)
+            self.assertTrue(parser.valid)
+            self.assertEqual(parser.result(), self.RESPONSE.strip())
+
+    def test_missing_header(self):
+        for size in SIZES:
+            with self.assertRaises(InvalidResponseException):
+                feed(SectionParser(), "Here you go:\n" + self.RESPONSE, size)
+
+    def test_code_section_is_checked(self):
+        for size in SIZES:
+            with self.assertRaises(InvalidResponseException):
+                feed(SectionParser(), "### CODE\nThis method does this:\n", size)
+
+
+class TestPatchParser(unittest.TestCase):
+    PATCH = "```diff\n--- a/module.py\n+++ b/module.py\n@@ -1,2 +1,3 @@\n class A:\n+    x = 1\n     pass\n```\n"
+
+    def test_split_patch(self):
+        for size in SIZES:
+            parser = PatchParser()
+            feed(parser, self.PATCH, size)
+            self.assertEqual(parser.result(), self.PATCH[len("```diff\n"):-len("```\n")].rstrip("\n"))
+
+    def test_not_a_patch(self):
+        for size in SIZES:
+            with self.assertRaises(InvalidResponseException):
+                feed(PatchParser(), "I changed the class:\n" + self.PATCH, size)
+
+
+class TestCheckResponse(unittest.TestCase):
+    def test_check_response(self):
+        self.assertTrue(CodeParser.check_response("```python\nx = 1\n```"))
+        self.assertFalse(CodeParser.check_response("Sure, here it is"))
+        self.assertTrue(PatchParser.check_response("@@ -1 +1 @@\n-a\n+b"))
+        self.assertFalse(SectionParser.check_response("No sections here"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import gc
+import json
+import weakref
+import unittest
+from unittest import mock
+from code_generator import GenerativeBase, config
+from code_generator.universal_attribute import UniversalAttribute
+
+
+class Probe(GenerativeBase):
+    pass
+
+
+class TestProxies(unittest.TestCase):
+    def test_proxy_is_memoized_per_instance(self):
+        probe, other = Probe(), Probe()
+        self.assertIs(probe.missing, probe.missing)
+        self.assertIsNot(probe.missing, other.missing)
+        self.assertIs(other.missing.owner, other)
+
+    def test_proxies_do_not_keep_their_owner_alive(self):
+        probe = Probe()
+        probe.missing
+        owner = weakref.ref(probe)
+        del probe
+        gc.collect()
+        self.assertIsNone(owner())
+
+    def test_proxy_is_reused_while_it_is_held(self):
+        probe = Probe()
+        proxy = probe.missing
+        self.assertIs(probe.missing, proxy)
+
+    def test_instance_dict_is_unchanged_by_a_miss(self):
+        probe = Probe()
+        probe.value = 1
+        probe.missing
+        self.assertEqual(vars(probe), {"value": 1})
+        self.assertEqual(json.dumps(vars(probe)), '{"value": 1}')
+
+    def test_forget(self):
+        probe = Probe()
+        proxy = probe.missing
+        UniversalAttribute.forget(probe, "missing")
+        self.assertIsNot(probe.missing, proxy)
+
+
+class TestRecordMode(unittest.TestCase):
+    def test_use_is_recorded_and_raises(self):
+        recorder = mock.Mock()
+        with mock.patch.object(config, "record_mode", True), \
+             mock.patch("code_generator.universal_attribute.get_recorder", return_value=recorder), \
+             mock.patch("code_generator.generative_base.get_recorder", return_value=recorder):
+            with self.assertRaisesRegex(AttributeError, "recorded"):
+                Probe().missing(1, x=2)
+        recorder.record_use.assert_called_once_with(Probe, "missing", "__call__", (1,), {"x": 2})
+
+
+class TestAIPlacementStage(unittest.TestCase):
+    def test_code_is_placed_before_the_write(self):
+        proxy = UniversalAttribute("missing", Probe())
+        with mock.patch.multiple(config, placement="ai", generation_mode="staged", hot_install=False), \
+             mock.patch("code_generator.universal_attribute.CodeGenerator") as generator, \
+             mock.patch("code_generator.universal_attribute.CodeWriter.read_source", return_value="class Probe:\n    pass\n"), \
+             mock.patch("code_generator.universal_attribute.CodeWriter.anchor_code", return_value=("class Probe:", 0)) as anchor_code, \
+             mock.patch("code_generator.universal_attribute.CodeWriter.apply_changes") as apply_changes:
+            generator.return_value.generate_imports.return_value = ""
+            generator.return_value.generate_commit_message.return_value = "Add missing"
+            code, _ = proxy._generate_and_write(lambda structured: "def missing(self):\n    pass")
+        self.assertEqual(code, "def missing(self):\n    pass")
+        anchor_code.assert_called_once_with("class Probe:\n    pass\n", code, "Probe")
+        patch = apply_changes.call_args[0][1][0]
+        self.assertEqual(patch.anchor, ("class Probe:", 0))
+
+
+if __name__ == "__main__":
+    unittest.main()